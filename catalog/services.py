@@ -109,8 +109,9 @@ class InventoryService:
         Ajuste le stock d'un produit. 
         `quantity` peut être positif (ajout) ou négatif (retrait).
         """
-        inventory = product.inventory # Access via related_name
-        
+        # Verrou de ligne : deux commandes simultanées ne peuvent pas réserver le même stock
+        inventory = Inventory.objects.select_for_update().get(product=product)
+
         new_quantity = inventory.quantity + quantity
         
         if new_quantity < 0:
@@ -0,0 +1,72 @@
+"""
+Registre de métriques en mémoire (par processus), exposé au format texte Prometheus
+par la vue `core:metrics`.
+"""
+import threading
+from collections import defaultdict
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in labels
+    )
+    return '{' + ','.join(escaped) + '}'
+
+class MetricsRegistry:
+    """
+    Compteurs et résumés (nombre, somme, maximum) étiquetés, sûrs entre threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._summaries = {}
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[_key(name, labels)] += value
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            key = _key(name, labels)
+            count, total, maximum = self._summaries.get(key, (0, 0.0, 0.0))
+            self._summaries[key] = (count + 1, total + value, max(maximum, value))
+
+    def counter(self, name, **labels):
+        return self._counters.get(_key(name, labels), 0)
+
+    def summary(self, name, **labels):
+        count, total, maximum = self._summaries.get(_key(name, labels), (0, 0.0, 0.0))
+        return {'count': count, 'sum': total, 'max': maximum}
+
+    def top(self, name, limit=10):
+        """Les `limit` séries d'un compteur ayant les plus fortes valeurs."""
+        with self._lock:
+            series = [(dict(labels), value) for (n, labels), value in self._counters.items() if n == name]
+        return sorted(series, key=lambda item: item[1], reverse=True)[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._summaries.clear()
+
+    def render_prometheus(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            summaries = sorted(self._summaries.items())
+
+        lines = []
+        for (name, labels), value in counters:
+            lines.append(f"{name}_total{_format_labels(labels)} {value:g}")
+        for (name, labels), (count, total, maximum) in summaries:
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total:g}")
+            lines.append(f"{name}_max{_format_labels(labels)} {maximum:g}")
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
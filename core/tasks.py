@@ -0,0 +1,49 @@
+"""
+Exécution de tâches en arrière-plan, hors du chemin de la requête.
+
+Les tâches sont soumises après la validation de la transaction courante à un pool
+de threads du processus. Avec ASYNC_TASKS_EAGER=True (tests, scripts), elles
+s'exécutent immédiatement au moment du commit.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'ASYNC_TASKS_WORKERS', 2),
+                thread_name_prefix='ventdelivr-task'
+            )
+        return _executor
+
+def _run(func, args, kwargs):
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception("Échec de la tâche d'arrière-plan %s", getattr(func, '__qualname__', func))
+    finally:
+        # Le thread du pool a ouvert sa propre connexion
+        connection.close()
+
+def run_async(func, *args, **kwargs):
+    """
+    Planifie `func(*args, **kwargs)` après le commit de la transaction en cours.
+    """
+    def submit():
+        if getattr(settings, 'ASYNC_TASKS_EAGER', False):
+            func(*args, **kwargs)
+        else:
+            _get_executor().submit(_run, func, args, kwargs)
+
+    transaction.on_commit(submit)
@@ -1,3 +1,65 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.db import OperationalError, IntegrityError
+from django.contrib.auth import get_user_model
+from .metrics import metrics
+from .transactions import _hot_row_label, _hot_rows, transactional_retry
 
-# Create your tests here.
+User = get_user_model()
+
+@override_settings(DB_RETRY_ATTEMPTS=3)
+class TransactionalRetryTests(TransactionTestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def test_retries_lock_conflicts_then_succeeds(self):
+        calls = []
+
+        @transactional_retry(base_delay=0, name='test.flaky')
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise OperationalError('database is locked')
+            return 'ok'
+
+        self.assertEqual(flaky(), 'ok')
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(metrics.counter('db_operation_retries', operation='test.flaky', reason='database_locked'), 2)
+        self.assertEqual(metrics.summary('db_operation_attempts_per_success', operation='test.flaky')['max'], 3)
+
+    def test_non_retryable_errors_are_raised_immediately(self):
+        calls = []
+
+        @transactional_retry(name='test.broken')
+        def broken():
+            calls.append(1)
+            raise IntegrityError('duplicate key')
+
+        with self.assertRaises(IntegrityError):
+            broken()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(metrics.counter('db_operation_rollbacks', operation='test.broken', reason='IntegrityError'), 1)
+
+@override_settings(DB_HOT_ROWS_MAX_KEYS=2)
+class HotRowLabelTests(SimpleTestCase):
+    def setUp(self):
+        _hot_rows.clear()
+
+    def test_label_is_the_locked_pk_with_bounded_cardinality(self):
+        lookup = 'SELECT "t"."id" FROM "t" WHERE "t"."id" = %s LIMIT 21 FOR UPDATE'
+        self.assertEqual(_hot_row_label('t', lookup, (7,)), '7')
+        self.assertEqual(_hot_row_label('t', lookup, (8,)), '8')
+        self.assertEqual(_hot_row_label('t', lookup, (9,)), 'other')
+        self.assertEqual(_hot_row_label('t', lookup, (7,)), '7')
+
+        ranged = 'SELECT "t"."id" FROM "t" WHERE "t"."id" IN (%s, %s) FOR UPDATE'
+        self.assertEqual(_hot_row_label('t', ranged, (1, 2)), '*')
+
+class MetricsViewTests(TestCase):
+    def test_metrics_require_staff(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+
+        staff = User.objects.create_user(username='ops', password='password', is_staff=True)
+        self.client.force_login(staff)
+        metrics.inc('db_operation_attempts', operation='FinanceService.transfer_funds')
+        response = self.client.get('/metrics/')
+        self.assertContains(response, 'db_operation_attempts_total{operation="FinanceService.transfer_funds"}')
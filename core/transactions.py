@@ -0,0 +1,129 @@
+"""
+Exécution transactionnelle avec reprise automatique des conflits de verrous.
+
+`transactional_retry` remplace `transaction.atomic` sur les méthodes de service :
+en bloc atomique le plus externe, un interblocage ou un échec de sérialisation
+relance l'opération entière après une attente aléatoire ; appelée depuis un bloc
+déjà ouvert, elle se comporte comme `transaction.atomic` (c'est l'appelant qui reprendra).
+Les temps d'attente de verrous (requêtes FOR UPDATE), les tentatives et les causes
+d'annulation sont publiés dans `core.metrics`.
+"""
+import functools
+import random
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction, DatabaseError
+
+from .metrics import metrics
+
+# SQLSTATE PostgreSQL pouvant réussir au second essai
+RETRYABLE_SQLSTATES = {
+    '40001': 'serialization_failure',
+    '40P01': 'deadlock_detected',
+    '55P03': 'lock_not_available',
+}
+
+_TABLE_RE = re.compile(r'FROM\s+"?(\w+)"?', re.IGNORECASE)
+# Verrou d'une seule ligne par clé primaire : ... WHERE "table"."id" = %s [LIMIT n] FOR UPDATE
+_PK_LOOKUP_RE = re.compile(r'WHERE\s+"?\w+"?\."?id"?\s*=\s*%s\s+(?:LIMIT\s+\d+\s+)?FOR UPDATE', re.IGNORECASE)
+
+# Lignes chaudes suivies individuellement (au-delà, regroupées sous rows="other")
+_hot_rows = set()
+_hot_rows_lock = threading.Lock()
+
+def classify_db_error(exc):
+    """
+    Retourne la cause d'un échec de base de données si l'opération peut être rejouée, sinon None.
+    """
+    cause = exc.__cause__ or exc
+    sqlstate = getattr(cause, 'pgcode', None) or getattr(cause, 'sqlstate', None)
+    if sqlstate in RETRYABLE_SQLSTATES:
+        return RETRYABLE_SQLSTATES[sqlstate]
+    if 'database is locked' in str(exc):
+        return 'database_locked'
+    return None
+
+def _hot_row_label(table, sql, params):
+    """
+    Étiquette d'une ligne chaude : la clé primaire verrouillée si la requête n'en vise
+    qu'une, '*' sinon. Au plus DB_HOT_ROWS_MAX_KEYS clés distinctes sont suivies par
+    processus ; les suivantes sont comptées sous 'other'.
+    """
+    if not params or len(params) != 1 or not _PK_LOOKUP_RE.search(sql):
+        return '*'
+    key = (table, str(params[0]))
+    with _hot_rows_lock:
+        if key not in _hot_rows:
+            if len(_hot_rows) >= getattr(settings, 'DB_HOT_ROWS_MAX_KEYS', 1000):
+                return 'other'
+            _hot_rows.add(key)
+    return key[1]
+
+def _lock_wait_recorder(operation):
+    """Wrapper d'exécution qui chronomètre les requêtes de verrouillage (SELECT ... FOR UPDATE)."""
+    hot_threshold = getattr(settings, 'DB_LOCK_WAIT_HOT_MS', 50) / 1000
+
+    def wrapper(execute, sql, params, many, context):
+        if 'FOR UPDATE' not in sql:
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            waited = time.perf_counter() - start
+            match = _TABLE_RE.search(sql)
+            table = match.group(1) if match else 'unknown'
+            metrics.observe('db_lock_wait_seconds', waited, operation=operation, table=table)
+            if waited >= hot_threshold:
+                metrics.inc('db_hot_rows', table=table, rows=_hot_row_label(table, sql, params))
+
+    return wrapper
+
+def transactional_retry(func=None, *, attempts=None, base_delay=0.05, max_delay=1.0, name=None):
+    """
+    Décorateur : exécute la fonction dans `transaction.atomic` et la rejoue en cas de
+    conflit de verrous (jusqu'à `attempts` essais, attente exponentielle avec gigue).
+    Utilisable avec ou sans arguments : `@transactional_retry` ou `@transactional_retry(attempts=5)`.
+    """
+    if func is None:
+        return functools.partial(
+            transactional_retry, attempts=attempts, base_delay=base_delay, max_delay=max_delay, name=name
+        )
+
+    operation = name or func.__qualname__
+
+    @functools.wraps(func)
+    def wrapped(*args, **kwargs):
+        if connection.in_atomic_block:
+            # Un bloc englobant existe déjà : impossible de rejouer seul, on délègue à l'appelant
+            with transaction.atomic():
+                return func(*args, **kwargs)
+
+        max_attempts = attempts or getattr(settings, 'DB_RETRY_ATTEMPTS', 3)
+        for attempt in range(1, max_attempts + 1):
+            metrics.inc('db_operation_attempts', operation=operation)
+            try:
+                with connection.execute_wrapper(_lock_wait_recorder(operation)):
+                    with transaction.atomic():
+                        result = func(*args, **kwargs)
+            except DatabaseError as exc:
+                reason = classify_db_error(exc)
+                metrics.inc('db_operation_rollbacks', operation=operation, reason=reason or type(exc).__name__)
+                if reason is None or attempt == max_attempts:
+                    metrics.inc('db_operation_failures', operation=operation)
+                    raise
+                metrics.inc('db_operation_retries', operation=operation, reason=reason)
+                time.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1))))
+            except Exception as exc:
+                # Erreur métier (solde, stock, validation) : annulation sans reprise
+                metrics.inc('db_operation_rollbacks', operation=operation, reason=type(exc).__name__)
+                raise
+            else:
+                metrics.observe('db_operation_attempts_per_success', attempt, operation=operation)
+                return result
+
+    return wrapped
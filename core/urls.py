@@ -5,4 +5,5 @@ app_name = 'core'
 
 urlpatterns = [
     path('', views.HomeView.as_view(), name='index'),
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
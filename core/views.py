@@ -1,4 +1,7 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
 from django.views.generic import ListView
+from .metrics import metrics
 from merchants.models import MerchantProfile
 
 class HomeView(ListView):
@@ -26,3 +29,16 @@ class HomeView(ListView):
                 # Add customer specific data
                 pass
         return context
+
+def metrics_view(request):
+    """
+    Expose les métriques du processus au format texte Prometheus.
+    Accès réservé au staff, ou via l'en-tête `Authorization: Bearer <METRICS_TOKEN>`.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    authorized = request.user.is_authenticated and request.user.is_staff
+    if token and request.headers.get('Authorization') == f"Bearer {token}":
+        authorized = True
+    if not authorized:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4')
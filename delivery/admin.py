@@ -1,8 +1,48 @@
 from django.contrib import admin
-from .models import Delivery
+from .models import Delivery, GeocodeCacheEntry, DeliveryRoute, RouteStop, DriverAvailability, FeeSurge, DeliveryQuote, DeliveryEvent
+
+class DeliveryEventInline(admin.TabularInline):
+    model = DeliveryEvent
+    extra = 0
+    can_delete = False
+    readonly_fields = ('code', 'at', 'actor', 'latitude', 'longitude', 'note')
 
 @admin.register(Delivery)
 class DeliveryAdmin(admin.ModelAdmin):
-    list_display = ('id', 'order', 'driver', 'status', 'delivery_code', 'assigned_at')
+    list_display = ('id', 'order', 'merchant', 'driver', 'status', 'delivery_code', 'assigned_at')
     list_filter = ('status', 'assigned_at')
     search_fields = ('delivery_code', 'order__id', 'driver__username')
+    inlines = [DeliveryEventInline]
+
+@admin.register(GeocodeCacheEntry)
+class GeocodeCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ('normalized_address', 'latitude', 'longitude', 'expires_at', 'created_at')
+    search_fields = ('normalized_address',)
+    readonly_fields = ('address_key', 'created_at')
+
+class RouteStopInline(admin.TabularInline):
+    model = RouteStop
+    extra = 0
+    readonly_fields = ('delivery', 'sequence', 'kind', 'latitude', 'longitude', 'completed_at')
+
+@admin.register(DeliveryRoute)
+class DeliveryRouteAdmin(admin.ModelAdmin):
+    list_display = ('id', 'driver', 'status', 'total_distance_km', 'created_at')
+    list_filter = ('status',)
+    inlines = [RouteStopInline]
+
+@admin.register(DriverAvailability)
+class DriverAvailabilityAdmin(admin.ModelAdmin):
+    list_display = ('driver', 'state', 'current_load', 'capacity', 'updated_at')
+    list_filter = ('state',)
+    search_fields = ('driver__username',)
+
+@admin.register(FeeSurge)
+class FeeSurgeAdmin(admin.ModelAdmin):
+    list_display = ('zone', 'multiplier', 'starts_at', 'ends_at', 'reason')
+    search_fields = ('zone',)
+
+@admin.register(DeliveryQuote)
+class DeliveryQuoteAdmin(admin.ModelAdmin):
+    list_display = ('order', 'merchant', 'fee', 'surge_multiplier', 'quoted_at')
+    readonly_fields = ('order', 'merchant', 'origin_zone', 'destination_zone', 'base_fee', 'surge_multiplier', 'fee', 'quoted_at')
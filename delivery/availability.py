@@ -0,0 +1,102 @@
+"""
+Disponibilité des livreurs.
+
+Chaque livreur a une ligne `DriverAvailability` (état, capacité, charge) recalculée
+à chaque transition d'une de ses livraisons. Les livreurs dispatchables forment le
+pool en mémoire de `spatial.drivers`, dans lequel le dispatch choisit ses candidats
+sans parcourir la table des utilisateurs.
+Un livreur sans ligne de disponibilité est considéré comme disponible (IDLE).
+"""
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from core.transactions import transactional_retry
+from .models import Delivery, DriverAvailability
+from .spatial import drivers
+
+# Livraisons comptées dans la charge d'un livreur
+OPEN_STATUSES = (
+    Delivery.Status.PENDING, Delivery.Status.READY_FOR_PICKUP,
+    Delivery.Status.PICKED_UP, Delivery.Status.IN_TRANSIT,
+)
+CARRYING_STATUSES = (Delivery.Status.PICKED_UP, Delivery.Status.IN_TRANSIT)
+PAUSED_STATES = (DriverAvailability.State.OFFLINE, DriverAvailability.State.ON_BREAK)
+
+class AvailabilityService:
+    """
+    Calcul de l'état des livreurs et synchronisation du pool de dispatch.
+    """
+
+    @staticmethod
+    def derive_state(current, load, carrying):
+        """Hors ligne / en pause restent tels quels tant que le livreur n'a rien en cours."""
+        if load == 0 and current in PAUSED_STATES:
+            return current
+        if carrying:
+            return DriverAvailability.State.CARRYING
+        if load:
+            return DriverAvailability.State.TO_PICKUP
+        return DriverAvailability.State.IDLE
+
+    @staticmethod
+    def refresh_many(driver_ids):
+        """
+        Recalcule charge et état des livreurs donnés (une requête groupée), puis met à
+        jour le pool de dispatch après le commit. Retourne les disponibilités.
+        """
+        from users.models import User
+
+        driver_ids = {driver_id for driver_id in driver_ids if driver_id}
+        if not driver_ids:
+            return {}
+        loads = {
+            row['driver_id']: row
+            for row in Delivery.objects.filter(driver_id__in=driver_ids, status__in=OPEN_STATUSES)
+            .values('driver_id')
+            .annotate(load=Count('id'), carrying=Count('id', filter=Q(status__in=CARRYING_STATUSES)))
+            .order_by()
+        }
+        rows = DriverAvailability.objects.in_bulk(driver_ids)
+        missing = driver_ids - set(rows)
+        if missing:
+            rows.update({
+                driver_id: DriverAvailability(driver_id=driver_id)
+                for driver_id in User.objects.filter(pk__in=missing, role=User.Role.DRIVER).values_list('id', flat=True)
+            })
+
+        now = timezone.now()
+        created, changed = [], []
+        for driver_id, row in rows.items():
+            counts = loads.get(driver_id, {'load': 0, 'carrying': 0})
+            state = AvailabilityService.derive_state(row.state, counts['load'], counts['carrying'])
+            if row._state.adding:
+                row.state, row.current_load = state, counts['load']
+                created.append(row)
+            elif (row.state, row.current_load) != (state, counts['load']):
+                row.state, row.current_load, row.updated_at = state, counts['load'], now
+                changed.append(row)
+        DriverAvailability.objects.bulk_create(created, ignore_conflicts=True)
+        DriverAvailability.objects.bulk_update(changed, ['state', 'current_load', 'updated_at'])
+
+        transaction.on_commit(lambda: drivers.sync_ids(driver_ids))
+        return rows
+
+    @staticmethod
+    @transactional_retry
+    def set_state(driver, state):
+        """
+        Passage en ligne (IDLE), hors ligne ou en pause, à la demande du livreur.
+        Un livreur ne peut pas se retirer du dispatch avec des livraisons en cours.
+        """
+        if state not in (DriverAvailability.State.IDLE, *PAUSED_STATES):
+            raise ValidationError("État de disponibilité invalide.")
+        availability, _ = DriverAvailability.objects.select_for_update().get_or_create(driver=driver)
+        load = Delivery.objects.filter(driver=driver, status__in=OPEN_STATUSES).count()
+        if state in PAUSED_STATES and load:
+            raise ValidationError("Terminez vos livraisons en cours avant de vous retirer.")
+
+        availability.state = state
+        availability.save(update_fields=['state', 'updated_at'])
+        return AvailabilityService.refresh_many([driver.pk])[driver.pk]
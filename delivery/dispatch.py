@@ -0,0 +1,379 @@
+"""
+Affectation groupée des livraisons aux livreurs.
+
+Toutes les livraisons en attente de livreur et tous les livreurs disponibles sont
+mis face à face dans une matrice de coûts (distance livreur -> ramassage) ; le
+problème d'affectation est résolu de façon optimale (algorithme hongrois, O(n³))
+ou quasi optimale pour les très grands lots (enchères, DISPATCH_AUCTION_THRESHOLD).
+
+Chaque livraison porte la zone geohash de son ramassage : `dispatch_sharded` répartit
+les groupes de zones (une ville) entre les processus d'un pool, chacun ne verrouillant
+que ses propres livraisons.
+
+Les livraisons regroupées en tournée (`routing.RoutePlanner`) ne sont jamais affectées
+une à une : chaque passage confie d'abord les tournées planifiées à des livreurs libres.
+"""
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import os
+import time
+
+import django
+import numpy as np
+from django.conf import settings
+from django.db import connections
+from django.db.models import F
+from django.utils import timezone
+
+from core.metrics import metrics
+from core.transactions import transactional_retry
+from .availability import PAUSED_STATES, AvailabilityService
+from .eta import EtaService
+from .events import DeliveryEventService
+from .models import Delivery, DeliveryEvent, DeliveryRoute, DriverAvailability, RouteStop
+from .spatial import drivers
+from .tracking import TrackingService
+from .zones import bounds, with_neighbors
+
+PENDING_STATUSES = (Delivery.Status.PENDING, Delivery.Status.READY_FOR_PICKUP)
+# Tournées dont les livraisons sont dispatchées ensemble, jamais une à une
+ROUTED_STATUSES = (DeliveryRoute.Status.PLANNED, DeliveryRoute.Status.ASSIGNED)
+
+# Coût des paires interdites (au-delà de la distance maximale, coordonnées manquantes)
+INFEASIBLE = 1e9
+
+def hungarian(cost):
+    """
+    Affectation de coût minimal pour une matrice (N, M) quelconque.
+    Retourne deux tableaux (lignes, colonnes) de longueur min(N, M).
+    Version « plus courts chemins augmentants » avec potentiels, vectorisée par ligne.
+    """
+    cost = np.asarray(cost, dtype=float)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    if n == 0:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    owner = np.zeros(m + 1, dtype=int)  # ligne (1..n) affectée à chaque colonne, 0 = libre
+    way = np.zeros(m + 1, dtype=int)
+
+    for row in range(1, n + 1):
+        owner[0] = row
+        col = 0
+        min_slack = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[col] = True
+            current_row = owner[col]
+            free = ~used
+            free[0] = False
+            slack = cost[current_row - 1] - u[current_row] - v[1:]
+            better = free[1:] & (slack < min_slack[1:])
+            min_slack[1:][better] = slack[better]
+            way[1:][better] = col
+
+            candidates = np.where(free, min_slack, np.inf)
+            next_col = int(np.argmin(candidates))
+            delta = candidates[next_col]
+
+            u[owner[used]] += delta
+            v[used] -= delta
+            min_slack[free] -= delta
+
+            col = next_col
+            if owner[col] == 0:
+                break
+        # Inversion du chemin augmentant
+        while col:
+            previous = way[col]
+            owner[col] = owner[previous]
+            col = previous
+
+    cols = np.nonzero(owner[1:])[0]
+    rows = owner[1:][cols] - 1
+    order = np.argsort(rows)
+    rows, cols = rows[order], cols[order]
+    if transposed:
+        order = np.argsort(cols)
+        return cols[order], rows[order]
+    return rows, cols
+
+def auction(cost, epsilon=None, max_rounds=100000):
+    """
+    Affectation quasi optimale par enchères (Bertsekas), pour les lots trop grands
+    pour l'algorithme hongrois. L'écart à l'optimum est borné par min(N, M) * epsilon.
+    Retourne (lignes, colonnes) comme `hungarian`.
+    """
+    cost = np.asarray(cost, dtype=float)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    if n == 0:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+
+    value = -cost
+    if epsilon is None:
+        epsilon = max(1e-6, (np.ptp(cost[cost < INFEASIBLE]) if (cost < INFEASIBLE).any() else 1.0) / (n + 1))
+    prices = np.zeros(m)
+    assigned_col = np.full(n, -1)
+    col_owner = np.full(m, -1)
+    unassigned = np.arange(n)
+
+    for _ in range(max_rounds):
+        if unassigned.size == 0:
+            break
+        # Tous les enchérisseurs libres jouent en même temps (variante Jacobi)
+        net = value[unassigned] - prices
+        if m > 1:
+            top2 = np.argpartition(-net, 1, axis=1)[:, :2]
+            first = net[np.arange(unassigned.size), top2[:, 0]]
+            second = net[np.arange(unassigned.size), top2[:, 1]]
+            swap = second > first
+            best_col = np.where(swap, top2[:, 1], top2[:, 0])
+            best, second_best = np.maximum(first, second), np.minimum(first, second)
+        else:
+            best_col = np.zeros(unassigned.size, dtype=int)
+            best, second_best = net[:, 0], net[:, 0] - epsilon
+        bids = prices[best_col] + best - second_best + epsilon
+
+        # Pour chaque colonne, seule l'enchère la plus haute l'emporte
+        order = np.lexsort((-bids, best_col))
+        cols_sorted = best_col[order]
+        winners = order[np.r_[True, cols_sorted[1:] != cols_sorted[:-1]]]
+        won_cols = best_col[winners]
+        bidders = unassigned[winners]
+
+        evicted = col_owner[won_cols]
+        evicted = evicted[evicted >= 0]
+        assigned_col[evicted] = -1
+        col_owner[won_cols] = bidders
+        assigned_col[bidders] = won_cols
+        prices[won_cols] = bids[winners]
+        unassigned = np.nonzero(assigned_col < 0)[0]
+
+    rows = np.nonzero(assigned_col >= 0)[0]
+    cols = assigned_col[rows]
+    if transposed:
+        order = np.argsort(cols)
+        return cols[order], rows[order]
+    return rows, cols
+
+def solve_assignment(cost, auction_threshold=2000):
+    """
+    Résout le problème d'affectation et écarte les paires interdites.
+    Retourne une liste de couples (ligne, colonne).
+    """
+    cost = np.asarray(cost, dtype=float)
+    cost = np.where(np.isfinite(cost), cost, INFEASIBLE)
+    solver = auction if min(cost.shape, default=0) > auction_threshold else hungarian
+    rows, cols = solver(cost)
+    return [(int(r), int(c)) for r, c in zip(rows, cols) if cost[r, c] < INFEASIBLE]
+
+class DispatchService:
+    """
+    Affectation périodique de toutes les livraisons sans livreur.
+    """
+
+    @staticmethod
+    def available_drivers(zones=None):
+        """
+        Candidats [(id, latitude, longitude)] lus dans le pool en mémoire (limités aux
+        zones données et à leurs voisines), puis confirmés en verrouillant leurs
+        disponibilités. Le pool rattrape d'abord les positions et disponibilités reçues
+        par les autres processus ; un livreur déjà retenu par un autre worker (ligne
+        verrouillée) est simplement ignoré.
+        """
+        drivers.catch_up()
+        candidates = drivers.candidates()
+        if zones is not None and candidates:
+            boxes = np.array([bounds(zone) for zone in with_neighbors(zones)]).reshape(-1, 4)
+            points = np.array([(lat, lng) for _, lat, lng in candidates])
+            inside = (
+                (points[:, None, 0] >= boxes[:, 0]) & (points[:, None, 0] < boxes[:, 1])
+                & (points[:, None, 1] >= boxes[:, 2]) & (points[:, None, 1] < boxes[:, 3])
+            ).any(axis=1)
+            candidates = [candidate for candidate, keep in zip(candidates, inside) if keep]
+        if not candidates:
+            return []
+
+        ids = [driver_id for driver_id, _, _ in candidates]
+        existing = set(DriverAvailability.objects.filter(driver_id__in=ids).values_list('driver_id', flat=True))
+        DriverAvailability.objects.bulk_create(
+            [DriverAvailability(driver_id=driver_id) for driver_id in ids if driver_id not in existing],
+            ignore_conflicts=True,
+        )
+        free = set(
+            DriverAvailability.objects.select_for_update(skip_locked=True)
+            .filter(driver_id__in=ids, current_load__lt=F('capacity'))
+            .exclude(state__in=PAUSED_STATES)
+            .values_list('driver_id', flat=True)
+        )
+        return [candidate for candidate in candidates if candidate[0] in free]
+
+    @staticmethod
+    def unassigned():
+        """Livraisons en attente de livreur, hors tournées (planifiées ou affectées) et commandes annulées."""
+        from orders.models import Order
+        return Delivery.objects.filter(driver__isnull=True, status__in=PENDING_STATUSES).exclude(
+            route_stops__route__status__in=ROUTED_STATUSES
+        ).exclude(order__status=Order.Status.CANCELLED)
+
+    @staticmethod
+    def zone_groups(precision=None):
+        """
+        Zones ayant des livraisons à affecter, regroupées par préfixe geohash
+        (DISPATCH_GROUP_PRECISION caractères, une ville) : {préfixe: [zones]}.
+        """
+        precision = precision or getattr(settings, 'DISPATCH_GROUP_PRECISION', 4)
+        zones = (
+            DispatchService.unassigned()
+            .exclude(pickup_zone='')
+            .values_list('pickup_zone', flat=True).distinct()
+        )
+        groups = {}
+        for zone in zones:
+            groups.setdefault(zone[:precision], []).append(zone)
+        return groups
+
+    @staticmethod
+    def dispatch_sharded(workers=None, max_km=None):
+        """
+        Dispatch par groupes de zones, un groupe par worker d'un pool de processus :
+        les groupes ne se partagent aucune livraison, et seuls les livreurs en bordure
+        peuvent être convoités par deux workers. Retourne le nombre de livraisons affectées.
+        """
+        workers = workers or getattr(settings, 'DISPATCH_WORKERS', None) or os.cpu_count() or 1
+        routed = DispatchService.assign_routes(max_km=max_km)
+        groups = sorted(DispatchService.zone_groups().values(), key=len, reverse=True)
+        if workers <= 1 or len(groups) <= 1:
+            return routed + sum(DispatchService.batch_assign(max_km=max_km, zones=zones) for zones in groups)
+
+        # Chaque processus ouvre ses propres connexions
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=min(workers, len(groups)), initializer=_init_worker) as pool:
+            return routed + sum(pool.map(dispatch_zone_group, groups, [max_km] * len(groups)))
+
+    @staticmethod
+    def cost_matrix(driver_positions, pickup_positions, max_km=None):
+        """Distance livreur -> ramassage ; les paires au-delà de `max_km` sont interdites."""
+        from .google_maps import GoogleMapsService
+        cost = GoogleMapsService.distance_matrix(driver_positions, pickup_positions)
+        if max_km is not None:
+            cost[cost > max_km] = np.inf
+        return cost
+
+    @staticmethod
+    @transactional_retry
+    def batch_assign(max_km=None, zones=None):
+        """
+        Affecte en une transaction les livraisons en attente (PENDING ou READY, sans livreur,
+        hors tournée) aux livreurs disponibles, en minimisant la distance totale d'approche.
+        Avec `zones`, seules les livraisons ramassées dans ces zones sont traitées, avec
+        les livreurs de ces zones et des zones voisines.
+        Les livraisons verrouillées par une autre opération sont laissées au passage suivant.
+        Retourne le nombre de livraisons affectées.
+        """
+        start = time.perf_counter()
+        zone_filter = {'pickup_zone__in': zones} if zones is not None else {}
+        deliveries = list(
+            DispatchService.unassigned().select_for_update(skip_locked=True)
+            .filter(**zone_filter)
+            .only('id', 'status', 'pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude')
+            .order_by('id')
+        )
+        if not deliveries:
+            return 0
+        candidates = DispatchService.available_drivers(zones)
+        if not candidates:
+            return 0
+
+        cost = DispatchService.cost_matrix(
+            [(lat, lng) for _, lat, lng in candidates],
+            [(d.pickup_latitude, d.pickup_longitude) for d in deliveries],
+            max_km=max_km,
+        )
+        pairs = solve_assignment(cost, getattr(settings, 'DISPATCH_AUCTION_THRESHOLD', 2000))
+
+        now = timezone.now()
+        assigned = []
+        for driver_index, delivery_index in pairs:
+            delivery = deliveries[delivery_index]
+            driver_id, lat, lng = candidates[driver_index]
+            delivery.driver_id = driver_id
+            delivery.assigned_at = now
+            delivery.estimated_delivery_time = EtaService.estimate(delivery, (lat, lng), at=now)
+            assigned.append(delivery)
+        Delivery.objects.bulk_update(assigned, ['driver', 'assigned_at', 'estimated_delivery_time'])
+        DeliveryEventService.record_many([
+            DeliveryEventService.build(delivery.id, DeliveryEvent.Code.ASSIGNED, at=now) for delivery in assigned
+        ])
+        AvailabilityService.refresh_many(delivery.driver_id for delivery in assigned)
+        TrackingService.invalidate(*(delivery.id for delivery in assigned))
+
+        metrics.inc('dispatch_assigned', len(assigned))
+        metrics.observe('dispatch_batch_seconds', time.perf_counter() - start)
+        return len(assigned)
+
+    @staticmethod
+    @transactional_retry
+    def assign_routes(max_km=None):
+        """
+        Confie les tournées planifiées à des livreurs libres (sans aucune livraison en
+        cours : une tournée occupe son livreur en entier), en minimisant la distance
+        jusqu'au premier ramassage ; chaque tournée passe par `RoutePlanner.assign`.
+        Retourne le nombre de livraisons affectées.
+        """
+        from users.models import User
+        from .routing import RoutePlanner
+
+        routes = list(
+            DeliveryRoute.objects.select_for_update(skip_locked=True)
+            .filter(status=DeliveryRoute.Status.PLANNED).order_by('id').values_list('id', flat=True)
+        )
+        if not routes:
+            return 0
+        first_stops = {
+            route_id: (lat, lng)
+            for route_id, lat, lng in RouteStop.objects.filter(route_id__in=routes, sequence=1)
+            .values_list('route_id', 'latitude', 'longitude')
+        }
+        routes = [route_id for route_id in routes if route_id in first_stops]
+        candidates = DispatchService.available_drivers() if routes else []
+        idle = set(DriverAvailability.objects.filter(
+            driver_id__in=[driver_id for driver_id, _, _ in candidates], current_load=0
+        ).values_list('driver_id', flat=True))
+        candidates = [candidate for candidate in candidates if candidate[0] in idle]
+        if not candidates:
+            return 0
+
+        cost = DispatchService.cost_matrix(
+            [(lat, lng) for _, lat, lng in candidates], [first_stops[route_id] for route_id in routes], max_km=max_km
+        )
+        pairs = solve_assignment(cost, getattr(settings, 'DISPATCH_AUCTION_THRESHOLD', 2000))
+        users = User.objects.in_bulk([candidates[driver_index][0] for driver_index, _ in pairs])
+        sizes = Counter(
+            RouteStop.objects.filter(route_id__in=[routes[route_index] for _, route_index in pairs],
+                                     kind=RouteStop.Kind.DROPOFF).values_list('route_id', flat=True)
+        )
+        assigned = 0
+        for driver_index, route_index in pairs:
+            RoutePlanner.assign(routes[route_index], users[candidates[driver_index][0]])
+            assigned += sizes[routes[route_index]]
+        metrics.inc('dispatch_routes_assigned', len(pairs))
+        return assigned
+
+def _init_worker():
+    django.setup()
+    connections.close_all()
+
+def dispatch_zone_group(zones, max_km=None):
+    """Point d'entrée d'un worker de `dispatch_sharded` : un groupe de zones."""
+    try:
+        return DispatchService.batch_assign(max_km=max_km, zones=zones)
+    finally:
+        connections.close_all()
@@ -0,0 +1,80 @@
+"""
+Matrices de distances (km) entre des lots d'origines et de destinations.
+
+Les points sont des tableaux de forme (N, 2) : latitude, longitude (float, Decimal
+ou None). Une ligne incomplète donne NaN dans la matrice. Le fournisseur routier
+est configurable via DISTANCE_PROVIDER ; par défaut, une estimation locale
+(vol d'oiseau multiplié par un coefficient de détour).
+"""
+import numpy as np
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+EARTH_RADIUS_KM = 6371
+
+def as_points(points):
+    """Convertit une séquence de (lat, lng) ou de {'lat', 'lng'} en tableau float (N, 2)."""
+    if isinstance(points, np.ndarray):
+        return points.astype(float, copy=False).reshape(-1, 2)
+    rows = [
+        (point['lat'], point['lng']) if isinstance(point, dict) else point
+        for point in points
+    ]
+    if not rows:
+        return np.empty((0, 2))
+    return np.array(
+        [[np.nan if value is None else float(value) for value in row] for row in rows],
+        dtype=float
+    )
+
+def _unit_vectors(points):
+    lat, lng = np.radians(points[:, 0]), np.radians(points[:, 1])
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lng), cos_lat * np.sin(lng), np.sin(lat)])
+
+def haversine_matrix(origins, destinations):
+    """
+    Distances à vol d'oiseau, matrice (N, M) en km.
+    Calculée à partir de la corde entre vecteurs unitaires : un seul produit matriciel
+    puis un arcsin par case (précision inférieure au mètre).
+    """
+    origins, destinations = as_points(origins), as_points(destinations)
+
+    # |u - v|² = 2 - 2 u·v ; distance = 2R·arcsin(|u - v| / 2)
+    result = 2 - 2 * (_unit_vectors(origins) @ _unit_vectors(destinations).T)
+    np.maximum(result, 0, out=result)
+    np.sqrt(result, out=result)
+    result *= 0.5
+    np.minimum(result, 1.0, out=result)
+    np.arcsin(result, out=result)
+    result *= 2 * EARTH_RADIUS_KM
+    return result
+
+def haversine_pairs(origins, destinations):
+    """Distances à vol d'oiseau ligne à ligne entre deux tableaux (N, 2), en km."""
+    origins, destinations = np.radians(as_points(origins)), np.radians(as_points(destinations))
+    lat1, lng1 = origins[:, 0], origins[:, 1]
+    lat2, lng2 = destinations[:, 0], destinations[:, 1]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+class LocalRoadDistanceProvider:
+    """
+    Estimation locale des distances routières (développement et tests) :
+    distance à vol d'oiseau multipliée par un coefficient de détour constant.
+    """
+    detour_factor = 1.3
+
+    def matrix(self, origins, destinations):
+        return haversine_matrix(origins, destinations) * self.detour_factor
+
+_provider = None
+
+def get_road_provider():
+    global _provider
+    if _provider is None:
+        _provider = import_string(
+            getattr(settings, 'DISTANCE_PROVIDER', 'delivery.distance.LocalRoadDistanceProvider')
+        )()
+    return _provider
@@ -0,0 +1,154 @@
+"""
+Estimation de l'heure de livraison.
+
+Les vitesses observées (ramassage -> livraison) sont agrégées par zone et par heure
+dans `SpeedProfile` par une tâche périodique (`manage.py rebuild_speed_profiles`).
+La table est gardée en mémoire dans chaque processus : une estimation n'est qu'une
+lecture de dictionnaire et un calcul distance / vitesse, sans requête.
+"""
+from datetime import timedelta
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .distance import haversine_pairs
+from .models import Delivery, DriverPosition, SpeedProfile
+from .spatial import haversine_km
+from .zones import zone_for
+
+_table = {}
+_loaded_at = None
+_lock = threading.Lock()
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+class EtaService:
+    """
+    Vitesses de référence et calcul des heures d'arrivée estimées.
+    """
+
+    @staticmethod
+    def profiles():
+        """Table {(zone, heure): km/h}, rechargée toutes les ETA_PROFILE_REFRESH_SECONDS."""
+        global _table, _loaded_at
+        refresh = _setting('ETA_PROFILE_REFRESH_SECONDS', 600)
+        if _loaded_at is None or time.monotonic() - _loaded_at > refresh:
+            with _lock:
+                if _loaded_at is None or time.monotonic() - _loaded_at > refresh:
+                    _table = {
+                        (zone, hour): speed
+                        for zone, hour, speed in SpeedProfile.objects.values_list('zone', 'hour', 'speed_kmh')
+                    }
+                    _loaded_at = time.monotonic()
+        return _table
+
+    @staticmethod
+    def clear_cache():
+        global _loaded_at
+        _loaded_at = None
+
+    @staticmethod
+    def speed_kmh(zone, hour):
+        table = EtaService.profiles()
+        return table.get((zone, hour)) or table.get(('', hour)) or _setting('ETA_DEFAULT_SPEED_KMH', 20.0)
+
+    @staticmethod
+    def travel_minutes(from_lat, from_lng, to_lat, to_lng, at=None):
+        """Durée estimée d'un trajet, avec la vitesse de la zone de départ à l'heure donnée."""
+        if None in (from_lat, from_lng, to_lat, to_lng):
+            return 0.0
+        at = timezone.localtime(at or timezone.now())
+        distance = haversine_km(float(from_lat), float(from_lng), float(to_lat), float(to_lng))
+        distance *= _setting('ETA_DETOUR_FACTOR', 1.3)
+        return distance / EtaService.speed_kmh(zone_for(from_lat, from_lng), at.hour) * 60
+
+    @staticmethod
+    def estimate(delivery, position=None, at=None):
+        """
+        Heure de livraison estimée.
+        Colis récupéré : de la position courante (ou du point de ramassage) au dépôt.
+        Sinon : position du livreur -> ramassage, temps de prise en charge, ramassage -> dépôt.
+        `position` est un couple (lat, lng) ; None si la position du livreur est inconnue.
+        """
+        at = at or timezone.now()
+        if delivery.status in (Delivery.Status.PICKED_UP, Delivery.Status.IN_TRANSIT):
+            start = position or (delivery.pickup_latitude, delivery.pickup_longitude)
+            minutes = EtaService.travel_minutes(*start, delivery.dropoff_latitude, delivery.dropoff_longitude, at)
+        else:
+            minutes = _setting('ETA_PICKUP_MINUTES', 5)
+            if position is not None:
+                minutes += EtaService.travel_minutes(*position, delivery.pickup_latitude, delivery.pickup_longitude, at)
+            minutes += EtaService.travel_minutes(
+                delivery.pickup_latitude, delivery.pickup_longitude,
+                delivery.dropoff_latitude, delivery.dropoff_longitude, at
+            )
+        return at + timedelta(minutes=minutes)
+
+    @staticmethod
+    def driver_position(driver):
+        """Dernière position GPS du livreur, à défaut les coordonnées de son adresse."""
+        live = DriverPosition.objects.filter(driver=driver).values_list('latitude', 'longitude').first()
+        if live:
+            return live
+        if driver.latitude is not None:
+            return (float(driver.latitude), float(driver.longitude))
+        return None
+
+    @staticmethod
+    def rebuild_profiles(days=None, min_samples=None):
+        """
+        Recalcule les profils de vitesse à partir des livraisons terminées des `days` derniers jours.
+        La vitesse d'un groupe est distance totale / durée totale (moins sensible aux trajets très courts).
+        Retourne le nombre de profils enregistrés.
+        """
+        days = days or _setting('ETA_PROFILE_DAYS', 28)
+        min_samples = min_samples or _setting('ETA_MIN_SAMPLES', 5)
+        rows = Delivery.objects.filter(
+            status=Delivery.Status.DELIVERED,
+            picked_up_at__isnull=False, delivered_at__isnull=False,
+            delivered_at__gte=timezone.now() - timedelta(days=days),
+            pickup_latitude__isnull=False, dropoff_latitude__isnull=False,
+        ).values_list(
+            'pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude',
+            'route_distance_km', 'picked_up_at', 'delivered_at',
+        )
+        frame = pd.DataFrame(list(rows), columns=[
+            'pickup_lat', 'pickup_lng', 'dropoff_lat', 'dropoff_lng', 'route_km', 'picked_up_at', 'delivered_at'
+        ])
+
+        profiles = []
+        if not frame.empty:
+            pickups = frame[['pickup_lat', 'pickup_lng']].astype(float).to_numpy()
+            dropoffs = frame[['dropoff_lat', 'dropoff_lng']].astype(float).to_numpy()
+            straight = haversine_pairs(pickups, dropoffs)
+            route_km = pd.to_numeric(frame['route_km'], errors='coerce').astype(float).to_numpy()
+            frame['distance'] = np.where(np.isnan(route_km), straight * _setting('ETA_DETOUR_FACTOR', 1.3), route_km)
+            picked_up = pd.to_datetime(frame['picked_up_at'], utc=True)
+            frame['hours'] = (pd.to_datetime(frame['delivered_at'], utc=True) - picked_up).dt.total_seconds() / 3600
+            frame['hour'] = picked_up.dt.tz_convert(str(timezone.get_current_timezone())).dt.hour
+            frame['zone'] = [zone_for(lat, lng) for lat, lng in pickups]
+
+            speed = frame['distance'] / frame['hours'].where(frame['hours'] > 0)
+            frame = frame[speed.between(_setting('ETA_MIN_SPEED_KMH', 1), _setting('ETA_MAX_SPEED_KMH', 120))]
+
+            for zone_frame in (frame, frame.assign(zone='')):
+                grouped = zone_frame.groupby(['zone', 'hour']).agg(
+                    distance=('distance', 'sum'), hours=('hours', 'sum'), samples=('distance', 'size')
+                )
+                grouped = grouped[grouped['samples'] >= min_samples]
+                profiles.extend(
+                    SpeedProfile(zone=zone, hour=int(hour), speed_kmh=row.distance / row.hours, sample_count=int(row.samples))
+                    for (zone, hour), row in grouped.iterrows()
+                )
+
+        with transaction.atomic():
+            SpeedProfile.objects.all().delete()
+            SpeedProfile.objects.bulk_create(profiles)
+        EtaService.clear_cache()
+        return len(profiles)
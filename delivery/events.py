@@ -0,0 +1,73 @@
+"""
+Historique des livraisons (`DeliveryEvent`).
+
+Chaque transition écrit une seule ligne (code court, horodatage, auteur, position
+éventuelle) ; l'historique n'est jamais modifié. Les durées par étape se calculent
+sur l'index (code, horodatage) plutôt qu'à partir des colonnes de la livraison.
+"""
+from datetime import timedelta
+
+import pandas as pd
+from django.utils import timezone
+
+from .models import DeliveryEvent
+
+Code = DeliveryEvent.Code
+
+# Étapes mesurées : nom -> (événement de début, événement de fin)
+STAGES = {
+    'assign': (Code.CREATED, Code.ASSIGNED),
+    'ready_to_pickup': (Code.READY, Code.PICKED_UP),
+    'pickup_to_delivered': (Code.PICKED_UP, Code.DELIVERED),
+}
+
+class DeliveryEventService:
+    """
+    Écriture et analyse de l'historique des livraisons.
+    """
+
+    @staticmethod
+    def build(delivery_id, code, at=None, actor=None, latitude=None, longitude=None, note=''):
+        return DeliveryEvent(
+            delivery_id=delivery_id, code=code, at=at or timezone.now(),
+            actor_id=getattr(actor, 'pk', actor), latitude=latitude, longitude=longitude, note=note[:255],
+        )
+
+    @staticmethod
+    def record(delivery, code, **kwargs):
+        """Ajoute un événement (un INSERT)."""
+        event = DeliveryEventService.build(delivery.pk, code, **kwargs)
+        event.save(force_insert=True)
+        return event
+
+    @staticmethod
+    def record_many(events):
+        """Ajoute un lot d'événements construits par `build` (un INSERT groupé)."""
+        return DeliveryEvent.objects.bulk_create(events, batch_size=2000)
+
+    @staticmethod
+    def stage_durations(days=7):
+        """
+        Durées (minutes) des étapes des livraisons dont l'étape s'est terminée sur les
+        `days` derniers jours : {étape: {'count', 'mean', 'median', 'p90'}}.
+        """
+        since = timezone.now() - timedelta(days=days)
+        stats = {}
+        for stage, (start_code, end_code) in STAGES.items():
+            ends = DeliveryEvent.objects.filter(code=end_code, at__gte=since)
+            starts = DeliveryEvent.objects.filter(code=start_code, delivery__in=ends.values('delivery'))
+            end_frame = pd.DataFrame(list(ends.values_list('delivery_id', 'at')), columns=['delivery', 'end'])
+            start_frame = pd.DataFrame(list(starts.values_list('delivery_id', 'at')), columns=['delivery', 'start'])
+            # Premier début, dernière fin (une livraison réaffectée compte une seule fois)
+            frame = start_frame.groupby('delivery')['start'].min().to_frame().join(
+                end_frame.groupby('delivery')['end'].max(), how='inner'
+            )
+            minutes = (pd.to_datetime(frame['end'], utc=True) - pd.to_datetime(frame['start'], utc=True)).dt.total_seconds() / 60
+            minutes = minutes[minutes >= 0]
+            stats[stage] = {
+                'count': int(minutes.size),
+                'mean': float(minutes.mean()) if minutes.size else None,
+                'median': float(minutes.median()) if minutes.size else None,
+                'p90': float(minutes.quantile(0.9)) if minutes.size else None,
+            }
+        return stats
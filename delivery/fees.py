@@ -0,0 +1,314 @@
+"""
+Devis de frais de livraison.
+
+Les frais dépendent de la zone de la boutique et de celle du client (geohash de
+précision FEE_ZONE_PRECISION, environ 1,2 km x 0,6 km) : la table `ZoneFee` est
+précalculée par `manage.py rebuild_fee_table` et gardée en mémoire dans chaque
+processus avec les majorations (`FeeSurge`) en cours. Un devis (boutique, adresse)
+reste en cache FEE_QUOTE_TTL_SECONDS. Les devis affichés au client lui sont remis
+dans un jeton signé (`sign`), valable aussi longtemps, que le panier renvoie à la
+validation : ce sont eux qui sont figés dans `DeliveryQuote` et facturés, quel que
+soit le processus qui reçoit la commande. Un jeton expiré, altéré ou qui ne couvre
+plus le panier ou l'adresse est refusé et le client doit confirmer de nouveaux frais.
+Un devis ne demande pas de calcul de distance sur le chemin de la requête ; il
+part des coordonnées stockées, et ne géocode (via les caches du géocodage) que
+si elles manquent encore. Sans coordonnées, aucun devis n'est émis : les frais
+de base ne sont jamais facturés par défaut.
+"""
+from datetime import datetime
+from decimal import Decimal
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.metrics import metrics
+from .distance import haversine_matrix
+from .geocoding import GeocodingService, LRUCache, address_key
+from .google_maps import GoogleMapsService
+from .models import DeliveryQuote, FeeSurge, ZoneFee
+from .spatial import haversine_km
+from .zones import bounds, geohash
+
+_fees = {}
+_surges = []
+_loaded_at = None
+_lock = threading.Lock()
+# Paires absentes de la table, calculées à la demande (bornées, expirées avec la table)
+_fallback = LRUCache(getattr(settings, 'FEE_FALLBACK_CACHE_SIZE', 10000))
+
+CENTS = Decimal('0.01')
+QUOTE_SALT = 'delivery.fees.quote'
+RECONFIRM = "Les frais de livraison ont changé depuis leur affichage : veuillez les confirmer à nouveau."
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+def zone_center(zone):
+    lat_min, lat_max, lng_min, lng_max = bounds(zone)
+    return (lat_min + lat_max) / 2, (lng_min + lng_max) / 2
+
+class FeeService:
+    """
+    Table des frais par paire de zones, majorations et devis.
+    """
+
+    @staticmethod
+    def zone(lat, lng):
+        if lat is None or lng is None:
+            return ''
+        return geohash(lat, lng, _setting('FEE_ZONE_PRECISION', 6))
+
+    @staticmethod
+    def tables():
+        """({(zone boutique, zone client): frais}, [majorations]), rechargés toutes les FEE_TABLE_REFRESH_SECONDS."""
+        global _fees, _surges, _loaded_at
+        refresh = _setting('FEE_TABLE_REFRESH_SECONDS', 300)
+        if _loaded_at is None or time.monotonic() - _loaded_at > refresh:
+            with _lock:
+                if _loaded_at is None or time.monotonic() - _loaded_at > refresh:
+                    _fees = {
+                        (origin, destination): fee
+                        for origin, destination, fee in ZoneFee.objects.values_list('origin_zone', 'destination_zone', 'fee')
+                    }
+                    _surges = list(
+                        FeeSurge.objects.filter(Q(ends_at__isnull=True) | Q(ends_at__gt=timezone.now()))
+                        .values_list('zone', 'multiplier', 'starts_at', 'ends_at')
+                    )
+                    _loaded_at = time.monotonic()
+        return _fees, _surges
+
+    @staticmethod
+    def clear_cache():
+        global _loaded_at
+        _loaded_at = None
+        _fallback.clear()
+
+    @staticmethod
+    def fee_for_distance(distance_km):
+        return Decimal(str(GoogleMapsService.calculate_delivery_cost(round(distance_km, 2)))).quantize(CENTS)
+
+    @staticmethod
+    def base_fee(origin_zone, destination_zone):
+        """Frais hors majoration ; les frais de base seuls si une des zones est inconnue."""
+        if not origin_zone or not destination_zone:
+            return FeeService.fee_for_distance(0)
+        fees, _ = FeeService.tables()
+        key = (origin_zone, destination_zone)
+        fee = fees.get(key)
+        if fee is None:
+            # Paire absente de la table : même calcul depuis les centres des zones, gardé en mémoire
+            now = time.monotonic()
+            fee = _fallback.get(key, now)
+            if fee is None:
+                fee = FeeService.fee_for_distance(haversine_km(*zone_center(origin_zone), *zone_center(destination_zone)))
+                _fallback.set(key, fee, now + _setting('FEE_TABLE_REFRESH_SECONDS', 300))
+        return fee
+
+    @staticmethod
+    def surge_multiplier(zone, at=None):
+        """Plus forte majoration en cours sur la zone (ou une zone qui la contient)."""
+        at = at or timezone.now()
+        multiplier = Decimal('1')
+        for prefix, surge, starts_at, ends_at in FeeService.tables()[1]:
+            if zone.startswith(prefix) and starts_at <= at and (ends_at is None or at < ends_at):
+                multiplier = max(multiplier, surge)
+        return multiplier
+
+    @staticmethod
+    def located_zone(instance, label):
+        """
+        Zone d'un client ou d'une boutique : depuis ses coordonnées stockées, sinon en
+        géocodant son adresse. ValidationError si elle reste introuvable.
+        """
+        if instance.latitude is not None and instance.longitude is not None:
+            return FeeService.zone(instance.latitude, instance.longitude)
+        coords = GeocodingService.geocode(instance.address) if instance.address else None
+        if coords is None:
+            metrics.inc('fee_quotes_refused')
+            raise ValidationError(f"Adresse {label} introuvable : impossible de calculer les frais de livraison.")
+        return FeeService.zone(coords['lat'], coords['lng'])
+
+    @staticmethod
+    def _key(merchant_id, address):
+        return f'delivery:quote:{merchant_id}:{address_key(address)}'
+
+    @staticmethod
+    def quote_many(customer, merchants):
+        """
+        Devis de chaque boutique vers l'adresse du client, dans l'ordre des boutiques :
+        [{'merchant', 'origin_zone', 'destination_zone', 'base_fee', 'surge_multiplier', 'fee', 'quoted_at'}].
+        ValidationError si le client ou une boutique n'a pas d'adresse localisable.
+        """
+        keys = [FeeService._key(merchant.pk, customer.address) for merchant in merchants]
+        cached = cache.get_many(keys)
+        metrics.inc('fee_quote_cache_hits', len(cached))
+
+        now = timezone.now()
+        destination = None
+        quotes, computed = [], {}
+        for merchant, key in zip(merchants, keys):
+            quote = cached.get(key)
+            if quote is None:
+                if destination is None:
+                    destination = FeeService.located_zone(customer, 'de livraison')
+                origin = FeeService.located_zone(merchant, f'de la boutique {merchant}')
+                base_fee = FeeService.base_fee(origin, destination)
+                surge = FeeService.surge_multiplier(origin, now)
+                quote = computed[key] = {
+                    'merchant': merchant.pk,
+                    'origin_zone': origin,
+                    'destination_zone': destination,
+                    'base_fee': base_fee,
+                    'surge_multiplier': surge,
+                    'fee': (base_fee * surge).quantize(CENTS),
+                    'quoted_at': now,
+                }
+            quotes.append(quote)
+        if computed:
+            cache.set_many(computed, _setting('FEE_QUOTE_TTL_SECONDS', 900))
+            metrics.inc('fee_quotes_computed', len(computed))
+        return quotes
+
+    @staticmethod
+    def sign(customer, quotes):
+        """Jeton signé des devis affichés au client, à renvoyer à la validation de la commande."""
+        return signing.dumps({
+            'customer': customer.pk,
+            'quotes': [
+                {
+                    'merchant': quote['merchant'],
+                    'origin_zone': quote['origin_zone'],
+                    'destination_zone': quote['destination_zone'],
+                    'base_fee': str(quote['base_fee']),
+                    'surge_multiplier': str(quote['surge_multiplier']),
+                    'fee': str(quote['fee']),
+                    'quoted_at': quote['quoted_at'].isoformat(),
+                }
+                for quote in quotes
+            ],
+        }, salt=QUOTE_SALT, compress=True)
+
+    @staticmethod
+    def shown_quotes(customer, token):
+        """
+        Devis d'un jeton `sign`, par boutique. ValidationError s'il est altéré, expiré
+        (FEE_QUOTE_TTL_SECONDS) ou émis pour un autre client.
+        """
+        try:
+            shown = signing.loads(token, salt=QUOTE_SALT, max_age=_setting('FEE_QUOTE_TTL_SECONDS', 900))
+        except signing.BadSignature:
+            shown = None
+        if not shown or shown['customer'] != customer.pk:
+            metrics.inc('fee_quotes_rejected')
+            raise ValidationError(RECONFIRM)
+        return {
+            quote['merchant']: {
+                **quote,
+                'base_fee': Decimal(quote['base_fee']),
+                'surge_multiplier': Decimal(quote['surge_multiplier']),
+                'fee': Decimal(quote['fee']),
+                'quoted_at': datetime.fromisoformat(quote['quoted_at']),
+            }
+            for quote in shown['quotes']
+        }
+
+    @staticmethod
+    def merchants_of(products):
+        """Boutiques distinctes des produits, dans l'ordre de première apparition."""
+        merchants = {}
+        for product in products:
+            merchants.setdefault(product.merchant_id, product.merchant)
+        return list(merchants.values())
+
+    @staticmethod
+    def lock(order, token=None):
+        """
+        Fige les frais de livraison de la commande, une ligne par boutique : ceux du jeton
+        `token` (les devis affichés au client), jamais recalculés. ValidationError (rien
+        n'est figé) si le jeton est refusé, ne couvre pas une boutique de la commande ou
+        si une des zones a changé depuis l'affichage. Sans jeton (commandes passées hors
+        panier), des devis courants ; ValidationError si une adresse n'est pas localisable.
+        """
+        items = order.items.select_related('product__merchant')
+        merchants = FeeService.merchants_of(item.product for item in items)
+        if token is None:
+            quotes = FeeService.quote_many(order.customer, merchants)
+        else:
+            shown = FeeService.shown_quotes(order.customer, token)
+            destination = FeeService.located_zone(order.customer, 'de livraison') if merchants else None
+            quotes = []
+            for merchant in merchants:
+                quote = shown.get(merchant.pk)
+                if quote is None or (quote['origin_zone'], quote['destination_zone']) != (
+                    FeeService.located_zone(merchant, f'de la boutique {merchant}'), destination
+                ):
+                    metrics.inc('fee_quotes_rejected')
+                    raise ValidationError(RECONFIRM)
+                quotes.append(quote)
+        DeliveryQuote.objects.bulk_create([
+            DeliveryQuote(order=order, merchant_id=quote['merchant'], origin_zone=quote['origin_zone'],
+                          destination_zone=quote['destination_zone'], base_fee=quote['base_fee'],
+                          surge_multiplier=quote['surge_multiplier'], fee=quote['fee'], quoted_at=quote['quoted_at'])
+            for quote in quotes
+        ], ignore_conflicts=True)
+        return quotes
+
+    @staticmethod
+    def fee_for(order, merchant):
+        """
+        Frais facturés pour la livraison d'une boutique : le devis figé, sinon un devis
+        courant ; zéro si aucun devis n'est possible (rien n'a été facturé au client).
+        """
+        locked = DeliveryQuote.objects.filter(order=order, merchant=merchant).values_list('fee', flat=True).first()
+        if locked is not None:
+            return locked
+        if merchant is None:
+            return FeeService.fee_for_distance(0)
+        try:
+            return FeeService.quote_many(order.customer, [merchant])[0]['fee']
+        except ValidationError:
+            return Decimal('0.00')
+
+    @staticmethod
+    def rebuild_table(max_km=None):
+        """
+        Précalcule les frais de toutes les paires (zone d'une boutique, zone d'un client)
+        à moins de `max_km` l'une de l'autre. Retourne le nombre de paires enregistrées.
+        """
+        from merchants.models import MerchantProfile
+        from users.models import User
+
+        max_km = max_km or _setting('FEE_TABLE_MAX_KM', 30)
+        origins = sorted({
+            FeeService.zone(lat, lng)
+            for lat, lng in MerchantProfile.objects.filter(latitude__isnull=False).values_list('latitude', 'longitude')
+        })
+        destinations = sorted({
+            FeeService.zone(lat, lng)
+            for lat, lng in User.objects.filter(role=User.Role.CUSTOMER, latitude__isnull=False)
+            .values_list('latitude', 'longitude')
+        })
+
+        rows = []
+        if origins and destinations:
+            distances = haversine_matrix([zone_center(z) for z in origins], [zone_center(z) for z in destinations])
+            for i, j in zip(*np.nonzero(distances <= max_km)):
+                distance = float(distances[i, j])
+                rows.append(ZoneFee(
+                    origin_zone=origins[i], destination_zone=destinations[j],
+                    distance_km=Decimal(str(round(distance, 2))), fee=FeeService.fee_for_distance(distance),
+                ))
+
+        with transaction.atomic():
+            ZoneFee.objects.all().delete()
+            ZoneFee.objects.bulk_create(rows, batch_size=5000)
+        FeeService.clear_cache()
+        return len(rows)
@@ -0,0 +1,235 @@
+"""
+Géocodage avec cache à deux niveaux.
+
+Une adresse est normalisée puis hachée ; la clé est cherchée dans un LRU en mémoire,
+puis dans la table `GeocodeCacheEntry`, et seulement ensuite auprès du fournisseur
+(configurable via GEOCODING_PROVIDER). Les échecs sont mis en cache eux aussi
+(cache négatif, durée GEOCODING_NEGATIVE_TTL).
+"""
+from collections import OrderedDict
+from datetime import timedelta
+import hashlib
+import re
+import threading
+import unicodedata
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from core.metrics import metrics
+from .models import GeocodeCacheEntry
+
+_NON_ALNUM_RE = re.compile(r'[^a-z0-9]+')
+
+# Résultat négatif mis en cache (adresse introuvable)
+NOT_FOUND = object()
+
+def normalize_address(address):
+    """
+    Forme canonique d'une adresse : minuscules, sans accents ni ponctuation,
+    espaces compactés. "10, Rue de l'Église " et "10 rue de l eglise" donnent la même clé.
+    """
+    if not address:
+        return ''
+    text = unicodedata.normalize('NFKD', address).encode('ascii', 'ignore').decode('ascii')
+    return _NON_ALNUM_RE.sub(' ', text.lower()).strip()
+
+def address_key(address):
+    return hashlib.sha256(normalize_address(address).encode('utf-8')).hexdigest()
+
+class LocalGeocodingProvider:
+    """
+    Fournisseur local déterministe (développement et tests) : une adresse donne toujours
+    les mêmes coordonnées, dans un rayon d'environ 5 km autour du centre configuré.
+    """
+    center = (48.8566, 2.3522)
+    spread = 0.05
+
+    def geocode(self, normalized_address):
+        if not normalized_address:
+            return None
+        digest = hashlib.sha256(normalized_address.encode('utf-8')).digest()
+        lat_unit = int.from_bytes(digest[:4], 'big') / 0xFFFFFFFF
+        lng_unit = int.from_bytes(digest[4:8], 'big') / 0xFFFFFFFF
+        return {
+            'lat': round(self.center[0] + (lat_unit * 2 - 1) * self.spread, 6),
+            'lng': round(self.center[1] + (lng_unit * 2 - 1) * self.spread, 6),
+        }
+
+    def geocode_many(self, normalized_addresses):
+        return {address: self.geocode(address) for address in normalized_addresses}
+
+class LRUCache:
+    """Cache LRU borné, avec expiration par entrée, sûr entre threads."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= now:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+_memory = LRUCache(getattr(settings, 'GEOCODING_LRU_SIZE', 10000))
+_provider = None
+
+class GeocodingService:
+    """
+    Point d'entrée du géocodage (adresse -> {'lat', 'lng'} ou None).
+    """
+
+    @staticmethod
+    def get_provider():
+        global _provider
+        if _provider is None:
+            _provider = import_string(
+                getattr(settings, 'GEOCODING_PROVIDER', 'delivery.geocoding.LocalGeocodingProvider')
+            )()
+        return _provider
+
+    @staticmethod
+    def clear_memory_cache():
+        _memory.clear()
+
+    @staticmethod
+    def _ttl(found):
+        if found:
+            return timedelta(seconds=getattr(settings, 'GEOCODING_TTL', 30 * 24 * 3600))
+        return timedelta(seconds=getattr(settings, 'GEOCODING_NEGATIVE_TTL', 24 * 3600))
+
+    @staticmethod
+    def geocode(address):
+        return GeocodingService.geocode_many([address])[address]
+
+    @staticmethod
+    def geocode_many(addresses):
+        """
+        Géocode un lot d'adresses. Les doublons (après normalisation) ne sont résolus
+        qu'une fois : une lecture mémoire, une requête en base pour les absents, un appel
+        groupé au fournisseur pour le reste.
+        Retourne {adresse d'origine: {'lat', 'lng'} | None}.
+        """
+        now = timezone.now()
+        keys = {address: address_key(address) for address in addresses}
+        normalized = {keys[address]: normalize_address(address) for address in addresses}
+        resolved = {}
+
+        # 1. LRU en mémoire
+        for key in normalized:
+            value = _memory.get(key, now)
+            if value is not None:
+                resolved[key] = value
+                metrics.inc('geocode_lookups', layer='memory', result='negative' if value is NOT_FOUND else 'hit')
+
+        # 2. Table de cache
+        missing = [key for key in normalized if key not in resolved]
+        if missing:
+            for entry in GeocodeCacheEntry.objects.filter(address_key__in=missing, expires_at__gt=now):
+                value = entry.coordinates or NOT_FOUND
+                resolved[entry.address_key] = value
+                _memory.set(entry.address_key, value, entry.expires_at)
+                metrics.inc('geocode_lookups', layer='database', result='negative' if value is NOT_FOUND else 'hit')
+
+        # 3. Fournisseur, en un seul appel groupé
+        missing = [key for key in normalized if key not in resolved]
+        if missing:
+            results = GeocodingService.get_provider().geocode_many({normalized[key] for key in missing})
+            metrics.inc('geocode_provider_calls', len(missing))
+            entries = []
+            for key in missing:
+                coords = results.get(normalized[key])
+                expires_at = now + GeocodingService._ttl(coords is not None)
+                value = coords or NOT_FOUND
+                resolved[key] = value
+                _memory.set(key, value, expires_at)
+                metrics.inc('geocode_lookups', layer='provider', result='hit' if coords else 'negative')
+                entries.append(GeocodeCacheEntry(
+                    address_key=key,
+                    normalized_address=normalized[key],
+                    latitude=coords['lat'] if coords else None,
+                    longitude=coords['lng'] if coords else None,
+                    expires_at=expires_at,
+                ))
+            GeocodeCacheEntry.objects.bulk_create(
+                entries,
+                update_conflicts=True,
+                unique_fields=['address_key'],
+                update_fields=['normalized_address', 'latitude', 'longitude', 'expires_at'],
+            )
+
+        return {
+            address: (None if resolved[key] is NOT_FOUND else dict(resolved[key]))
+            for address, key in keys.items()
+        }
+
+    @staticmethod
+    def refresh_coordinates(model, pk):
+        """
+        Recalcule latitude/longitude d'une ligne (User, MerchantProfile...) à partir de son adresse.
+        La mise à jour est conditionnée à l'adresse lue : un changement concurrent n'est pas écrasé.
+        """
+        address = model.objects.filter(pk=pk).values_list('address', flat=True).first()
+        if address is None:
+            return
+        coords = GeocodingService.geocode(address) if address else None
+        model.objects.filter(pk=pk, address=address).update(
+            latitude=coords['lat'] if coords else None,
+            longitude=coords['lng'] if coords else None,
+        )
+        if model._meta.label == settings.AUTH_USER_MODEL:
+            # update() n'émet pas post_save : on synchronise l'index des livreurs directement
+            from .spatial import drivers
+            drivers.sync_ids([pk])
+
+    @staticmethod
+    def schedule_refresh(instance):
+        """Planifie le géocodage de l'adresse d'une instance après le commit."""
+        from core.tasks import run_async
+        run_async(GeocodingService.refresh_coordinates, type(instance), instance.pk)
+
+    @staticmethod
+    def backfill_coordinates(queryset, chunk_size=500):
+        """
+        Renseigne en masse les coordonnées manquantes d'un queryset (adresse non vide) :
+        un géocodage groupé et un bulk_update par lot. Retourne le nombre de lignes traitées.
+        """
+        queryset = queryset.filter(latitude__isnull=True).exclude(address='').order_by('pk')
+        processed = 0
+        last_pk = None
+        while True:
+            chunk = queryset.filter(pk__gt=last_pk) if last_pk is not None else queryset
+            rows = list(chunk.only('pk', 'address')[:chunk_size])
+            if not rows:
+                return processed
+            coords = GeocodingService.geocode_many([row.address for row in rows])
+            for row in rows:
+                found = coords[row.address]
+                row.latitude = found['lat'] if found else None
+                row.longitude = found['lng'] if found else None
+            queryset.model.objects.bulk_update(rows, ['latitude', 'longitude'])
+            processed += len(rows)
+            last_pk = rows[-1].pk
@@ -0,0 +1,166 @@
+"""
+Géorepérage des livraisons actives.
+
+À chaque passage (`manage.py evaluate_geofences --interval N`, lancé par un seul
+processus planifié : les points d'ancrage de l'immobilisation sont gardés en mémoire),
+la dernière position (`DriverPosition`) du livreur de chaque livraison active est
+comparée, en un seul calcul vectorisé, à sa cible : le ramassage tant que le colis
+n'est pas récupéré, le dépôt ensuite.
+Sont détectés :
+- l'arrivée au ramassage ou au dépôt (GEOFENCE_PICKUP_RADIUS_M, GEOFENCE_DROPOFF_RADIUS_M) ;
+- l'immobilisation prolongée (moins de GEOFENCE_DWELL_RADIUS_M parcourus depuis
+  GEOFENCE_DWELL_MINUTES).
+Chaque détection est écrite une seule fois dans l'historique (`DeliveryEvent`) ; une
+contrainte unique garantit qu'une arrivée n'est signalée qu'une fois par livreur, même
+si deux passages se chevauchent.
+Avec GEOFENCE_AUTO_PICKUP, l'arrivée au ramassage d'un colis prêt vaut confirmation du
+ramassage ; la remise au client reste soumise au code de livraison.
+"""
+from datetime import timedelta
+from decimal import Decimal
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.metrics import metrics
+from .distance import haversine_pairs
+from .events import DeliveryEventService
+from .models import Delivery, DeliveryEvent
+
+ACTIVE_STATUSES = (
+    Delivery.Status.PENDING, Delivery.Status.READY_FOR_PICKUP,
+    Delivery.Status.PICKED_UP, Delivery.Status.IN_TRANSIT,
+)
+CARRYING_STATUSES = (Delivery.Status.PICKED_UP, Delivery.Status.IN_TRANSIT)
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+def _coordinate(value):
+    return Decimal(f'{value:.6f}')
+
+class GeofenceEvaluator:
+    """
+    Évaluation périodique des géorepères. Garde en mémoire, par livraison, le point
+    d'ancrage servant à mesurer l'immobilisation.
+    """
+
+    def __init__(self):
+        self._anchors = {}  # livraison -> (lat, lng, depuis (timestamp), signalée)
+        self._lock = threading.Lock()
+
+    def _active(self, now):
+        fresh = now - timedelta(seconds=_setting('GEOFENCE_MAX_POSITION_AGE_SECONDS', 120))
+        return list(
+            Delivery.objects.filter(
+                driver__isnull=False, status__in=ACTIVE_STATUSES, driver__position__recorded_at__gte=fresh
+            ).values_list(
+                'id', 'status', 'driver_id',
+                'pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude',
+                'driver__position__latitude', 'driver__position__longitude',
+            )
+        )
+
+    def _reported(self):
+        """Arrivées déjà signalées depuis l'affectation en cours : {(livraison, code)}."""
+        return set(
+            DeliveryEvent.objects.filter(
+                Q(delivery__assigned_at__isnull=True) | Q(at__gte=F('delivery__assigned_at')),
+                code__in=(DeliveryEvent.Code.ARRIVED_PICKUP, DeliveryEvent.Code.ARRIVED_DROPOFF),
+                delivery__status__in=ACTIVE_STATUSES, delivery__driver__isnull=False,
+            ).values_list('delivery_id', 'code')
+        )
+
+    def evaluate(self, now=None):
+        """
+        Un passage sur toutes les livraisons actives.
+        Retourne le nombre d'événements par code : {code: nombre}.
+        """
+        with self._lock:
+            return self._evaluate(now or timezone.now())
+
+    def _evaluate(self, now):
+        start = time.perf_counter()
+        rows = self._active(now)
+        active_ids = {row[0] for row in rows}
+        self._anchors = {key: anchor for key, anchor in self._anchors.items() if key in active_ids}
+        if not rows:
+            return {}
+
+        ids = np.array([row[0] for row in rows])
+        carrying = np.array([row[1] in CARRYING_STATUSES for row in rows])
+        coords = np.array([row[3:] for row in rows], dtype=float)
+        positions = coords[:, 4:6]
+
+        # Arrivée : distance à la cible du moment (NaN si la cible est inconnue : jamais atteinte)
+        targets = np.where(carrying[:, None], coords[:, 2:4], coords[:, 0:2])
+        distance_m = haversine_pairs(positions, targets) * 1000
+        radius_m = np.where(
+            carrying, _setting('GEOFENCE_DROPOFF_RADIUS_M', 75), _setting('GEOFENCE_PICKUP_RADIUS_M', 75)
+        )
+        arrived = distance_m <= radius_m
+
+        # Immobilisation : distance au point d'ancrage ; l'ancre suit le livreur dès qu'il s'en éloigne
+        now_ts = now.timestamp()
+        anchors = [self._anchors.get(delivery_id) for delivery_id in ids.tolist()]
+        anchor_positions = np.array([anchor[:2] if anchor else (np.nan, np.nan) for anchor in anchors], dtype=float)
+        since = np.array([anchor[2] if anchor else now_ts for anchor in anchors])
+        moved = ~(haversine_pairs(positions, anchor_positions) * 1000 <= _setting('GEOFENCE_DWELL_RADIUS_M', 50))
+        since = np.where(moved, now_ts, since)
+        dwelling = (now_ts - since) >= _setting('GEOFENCE_DWELL_MINUTES', 10) * 60
+
+        reported = self._reported()
+        arrivals, events, pickups = [], [], []
+        for i in np.flatnonzero(arrived | dwelling).tolist():
+            delivery_id, status, driver_id = rows[i][:3]
+            lat, lng = positions[i]
+            if arrived[i]:
+                code = DeliveryEvent.Code.ARRIVED_DROPOFF if carrying[i] else DeliveryEvent.Code.ARRIVED_PICKUP
+                if (delivery_id, code) not in reported:
+                    arrivals.append(DeliveryEventService.build(
+                        delivery_id, code, at=now, actor=driver_id, latitude=_coordinate(lat), longitude=_coordinate(lng)
+                    ))
+                    if status == Delivery.Status.READY_FOR_PICKUP:
+                        pickups.append(delivery_id)
+            if dwelling[i] and not anchors[i][3]:
+                events.append(DeliveryEventService.build(
+                    delivery_id, DeliveryEvent.Code.DWELL, at=now, actor=driver_id,
+                    latitude=_coordinate(lat), longitude=_coordinate(lng),
+                ))
+
+        for i, delivery_id in enumerate(ids.tolist()):
+            if moved[i]:
+                self._anchors[delivery_id] = (positions[i][0], positions[i][1], now_ts, False)
+            elif dwelling[i]:
+                self._anchors[delivery_id] = anchors[i][:3] + (True,)
+
+        # Arrivée déjà écrite par un passage concurrent : ignorée par la contrainte unique
+        DeliveryEvent.objects.bulk_create(arrivals, ignore_conflicts=True)
+        DeliveryEventService.record_many(events)
+        if _setting('GEOFENCE_AUTO_PICKUP', False):
+            self._auto_pickup(pickups)
+
+        counts = {}
+        for event in arrivals + events:
+            counts[event.code] = counts.get(event.code, 0) + 1
+        metrics.inc('geofence_events', len(arrivals) + len(events))
+        metrics.observe('geofence_pass_seconds', time.perf_counter() - start)
+        return counts
+
+    @staticmethod
+    def _auto_pickup(delivery_ids):
+        """Le ramassage verrouille la livraison et vérifie son statut : une seule transition."""
+        from .services import DeliveryService
+        for delivery_id in delivery_ids:
+            try:
+                DeliveryService.pickup_package(delivery_id, driver_notes="Ramassage détecté à l'arrivée")
+            except ValidationError:
+                # Transition faite entre-temps (confirmation manuelle) : rien à faire
+                continue
+
+geofences = GeofenceEvaluator()
@@ -1,31 +1,41 @@
 from django.conf import settings
-import math
-import random
 
 class GoogleMapsService:
     """
     Service to handle Google Maps interactions (Geocoding, Distance Matrix).
-    Currently uses MOCK data to avoid API key requirements for development.
+    Geocoding goes through the cached GeocodingService; the provider is set by
+    GEOCODING_PROVIDER (deterministic local provider by default).
     """
     
     @staticmethod
     def geocode_address(address):
         """
-        Mock geocoding: Returns random coordinates near a central point (e.g., Paris or a generic city)
-        In production, this would call Google Maps Geocoding API.
+        Returns {'lat': ..., 'lng': ...} for an address, or None if it cannot be resolved.
         """
-        # Center point (e.g., Downtown)
-        base_lat = 48.8566
-        base_lng = 2.3522
-        
-        # Add random offset
-        lat_offset = random.uniform(-0.05, 0.05)
-        lng_offset = random.uniform(-0.05, 0.05)
-        
-        return {
-            'lat': base_lat + lat_offset,
-            'lng': base_lng + lng_offset
-        }
+        from .geocoding import GeocodingService
+        return GeocodingService.geocode(address)
+
+    @staticmethod
+    def geocode_addresses(addresses):
+        """
+        Batch geocoding: returns {address: coords or None}, resolving duplicates once.
+        """
+        from .geocoding import GeocodingService
+        return GeocodingService.geocode_many(addresses)
+
+    @staticmethod
+    def distance_matrix(origins, destinations, road=False):
+        """
+        Distances in kilometers between every origin and every destination, as an
+        N x M NumPy array (NaN where a point has no coordinates).
+        Points are (lat, lng) pairs or {'lat', 'lng'} dicts. With road=True the
+        configured road-distance provider (DISTANCE_PROVIDER) is used instead of Haversine.
+        """
+        from .distance import as_points, haversine_matrix, get_road_provider
+        origins, destinations = as_points(origins), as_points(destinations)
+        if road:
+            return get_road_provider().matrix(origins, destinations)
+        return haversine_matrix(origins, destinations)
 
     @staticmethod
     def calculate_distance(origin_lat, origin_lng, dest_lat, dest_lng):
@@ -34,24 +44,9 @@ class GoogleMapsService:
         """
         if not all([origin_lat, origin_lng, dest_lat, dest_lng]):
             return 0.0
-        
-        # Convert to float if Decimal
-        origin_lat = float(origin_lat)
-        origin_lng = float(origin_lng)
-        dest_lat = float(dest_lat)
-        dest_lng = float(dest_lng)
-            
-        R = 6371  # Earth radius in km
-        
-        dlat = math.radians(dest_lat - origin_lat)
-        dlng = math.radians(dest_lng - origin_lng)
-        a = math.sin(dlat / 2) * math.sin(dlat / 2) + \
-            math.cos(math.radians(origin_lat)) * math.cos(math.radians(dest_lat)) * \
-            math.sin(dlng / 2) * math.sin(dlng / 2)
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-        distance = R * c
-        
-        return round(distance, 2)
+
+        matrix = GoogleMapsService.distance_matrix([(origin_lat, origin_lng)], [(dest_lat, dest_lng)])
+        return round(float(matrix[0, 0]), 2)
 
     @staticmethod
     def calculate_delivery_cost(distance_km):
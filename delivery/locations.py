@@ -0,0 +1,212 @@
+"""
+Ingestion des positions GPS des livreurs.
+
+Les positions ne touchent plus la ligne `Delivery` : elles sont accumulées dans un
+tampon en mémoire puis écrites par lots (toutes les LOCATION_FLUSH_INTERVAL_MS ou dès
+LOCATION_FLUSH_SIZE positions) : un `bulk_create` dans l'historique `DriverLocation`
+et un seul upsert de la dernière position de chaque livreur dans `DriverPosition`.
+Avec LOCATION_FLUSH_INTERVAL_MS = 0, chaque envoi est écrit immédiatement.
+"""
+from datetime import datetime, timezone as dt_timezone
+import logging
+import threading
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.metrics import metrics
+from .eta import EtaService
+from .models import Delivery, DriverLocation, DriverPosition
+from .spatial import drivers
+from .tracking import TrackingService
+
+logger = logging.getLogger(__name__)
+
+class LocationPing(NamedTuple):
+    driver_id: int
+    latitude: float
+    longitude: float
+    recorded_at: datetime
+    delivery_id: Optional[int] = None
+
+def parse_ping(driver_id, data, now=None):
+    """
+    Valide une position reçue ({'lat', 'lng', 'ts'?, 'delivery'?}) ; `ts` est un
+    horodatage ISO 8601 ou un nombre de secondes depuis l'epoch.
+    """
+    try:
+        latitude, longitude = float(data['lat']), float(data['lng'])
+    except (KeyError, TypeError, ValueError):
+        raise ValidationError("Position invalide : 'lat' et 'lng' sont requis.")
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValidationError("Position hors limites.")
+
+    ts = data.get('ts')
+    if ts is None:
+        recorded_at = now or timezone.now()
+    elif isinstance(ts, (int, float)):
+        recorded_at = datetime.fromtimestamp(ts, tz=dt_timezone.utc)
+    else:
+        recorded_at = parse_datetime(str(ts))
+        if recorded_at is None:
+            raise ValidationError("Horodatage invalide.")
+        if timezone.is_naive(recorded_at):
+            recorded_at = timezone.make_aware(recorded_at)
+
+    delivery_id = data.get('delivery')
+    return LocationPing(driver_id, latitude, longitude, recorded_at, int(delivery_id) if delivery_id else None)
+
+class LocationBuffer:
+    """
+    Tampon de positions partagé par les threads du processus, vidé par un thread
+    de fond (démarré au premier ajout) ou dès qu'il atteint sa taille maximale.
+    """
+
+    def __init__(self):
+        self._pings = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def _interval(self):
+        return getattr(settings, 'LOCATION_FLUSH_INTERVAL_MS', 500) / 1000
+
+    def add(self, pings):
+        with self._lock:
+            self._pings.extend(pings)
+            pending = len(self._pings)
+        metrics.inc('location_pings_received', len(pings))
+
+        interval = self._interval()
+        if interval <= 0 or pending >= getattr(settings, 'LOCATION_FLUSH_SIZE', 5000):
+            self.flush()
+        else:
+            self._ensure_flusher()
+
+    def __len__(self):
+        return len(self._pings)
+
+    def _ensure_flusher(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='location-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self._interval())
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Échec de l'écriture des positions GPS")
+            finally:
+                connection.close()
+
+    def flush(self):
+        """Écrit les positions en attente. Retourne le nombre de positions écrites."""
+        with self._flush_lock:
+            with self._lock:
+                pings, self._pings = self._pings, []
+            if pings:
+                LocationService.write(pings)
+            return len(pings)
+
+buffer = LocationBuffer()
+
+class LocationService:
+    """
+    Chemin d'écriture des positions, séparé du cycle de vie des livraisons.
+    """
+
+    MAX_BATCH = 500
+
+    @staticmethod
+    def ingest(driver, payload):
+        """
+        Accepte une ou plusieurs positions d'un livreur (liste de dicts) et les met en tampon.
+        Les livraisons référencées doivent appartenir au livreur.
+        Retourne le nombre de positions acceptées.
+        """
+        if isinstance(payload, dict):
+            payload = [payload]
+        if len(payload) > getattr(settings, 'LOCATION_MAX_BATCH', LocationService.MAX_BATCH):
+            raise ValidationError("Trop de positions dans un même envoi.")
+
+        now = timezone.now()
+        pings = [parse_ping(driver.pk, item, now) for item in payload]
+        delivery_ids = {ping.delivery_id for ping in pings if ping.delivery_id}
+        if delivery_ids:
+            owned = set(Delivery.objects.filter(id__in=delivery_ids, driver=driver).values_list('id', flat=True))
+            if delivery_ids - owned:
+                raise ValidationError("Livraison inconnue ou non affectée à ce livreur.")
+
+        buffer.add(pings)
+        return len(pings)
+
+    @staticmethod
+    def write(pings):
+        """
+        Écrit un lot : historique complet + dernière position par livreur (un upsert).
+        """
+        DriverLocation.objects.bulk_create([
+            DriverLocation(
+                driver_id=ping.driver_id, delivery_id=ping.delivery_id,
+                latitude=ping.latitude, longitude=ping.longitude, recorded_at=ping.recorded_at,
+            )
+            for ping in pings
+        ], batch_size=2000)
+
+        latest = {}
+        for ping in pings:
+            current = latest.get(ping.driver_id)
+            if current is None or ping.recorded_at >= current.recorded_at:
+                latest[ping.driver_id] = ping
+        # ETA : une seule requête pour les livraisons du lot, puis un calcul par livreur
+        deliveries = Delivery.objects.only(
+            'id', 'status', 'pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude'
+        ).in_bulk({ping.delivery_id for ping in latest.values() if ping.delivery_id})
+
+        positions = [
+            DriverPosition(
+                driver_id=ping.driver_id, delivery_id=ping.delivery_id,
+                latitude=ping.latitude, longitude=ping.longitude, recorded_at=ping.recorded_at,
+                estimated_arrival=(
+                    EtaService.estimate(deliveries[ping.delivery_id], (ping.latitude, ping.longitude), ping.recorded_at)
+                    if ping.delivery_id in deliveries else None
+                ),
+            )
+            for ping in latest.values()
+        ]
+        DriverPosition.objects.bulk_create(
+            positions,
+            update_conflicts=True,
+            unique_fields=['driver'],
+            update_fields=['delivery', 'latitude', 'longitude', 'recorded_at', 'estimated_arrival'],
+        )
+
+        TrackingService.publish_positions({
+            ping.delivery_id: (ping.latitude, ping.longitude, ping.recorded_at, position.estimated_arrival)
+            for ping, position in zip(latest.values(), positions)
+            if ping.delivery_id in deliveries
+        })
+
+        index = drivers.index
+        if index is not None:
+            for ping in latest.values():
+                if ping.driver_id in index:
+                    index.upsert(ping.driver_id, ping.latitude, ping.longitude)
+
+        metrics.inc('location_pings_written', len(pings))
+        metrics.observe('location_flush_size', len(pings))
+
+    @staticmethod
+    def flush():
+        return buffer.flush()
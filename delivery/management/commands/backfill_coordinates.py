@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from merchants.models import MerchantProfile
+from delivery.geocoding import GeocodingService
+
+User = get_user_model()
+
+class Command(BaseCommand):
+    help = 'Renseigne les coordonnées manquantes des utilisateurs et des boutiques à partir de leur adresse'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Adresses géocodées par lot')
+
+    def handle(self, *args, **options):
+        for label, queryset in (('utilisateurs', User.objects.all()), ('boutiques', MerchantProfile.objects.all())):
+            count = GeocodingService.backfill_coordinates(queryset, chunk_size=options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS(f"{count} {label} traités"))
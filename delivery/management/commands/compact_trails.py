@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from delivery.trails import TrailService
+
+class Command(BaseCommand):
+    help = 'Compacte les traces GPS des livraisons terminées et purge les points bruts expirés'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tolerance', type=float, help='Tolérance de simplification (mètres)')
+        parser.add_argument('--retention-days', type=int, help='Durée de conservation des points bruts (jours)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Livraisons compactées par lot')
+
+    def handle(self, *args, **options):
+        compacted = TrailService.compact_finished(options['tolerance'], batch_size=options['batch_size'])
+        purged = TrailService.purge(options['retention_days'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{compacted} traces compactées, {purged} points bruts supprimés"
+        ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from delivery.events import DeliveryEventService
+
+class Command(BaseCommand):
+    help = "Durées des étapes de livraison (affectation, attente au ramassage, trajet) sur les derniers jours"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='Période analysée (jours)')
+
+    def handle(self, *args, **options):
+        for stage, stats in DeliveryEventService.stage_durations(days=options['days']).items():
+            if not stats['count']:
+                self.stdout.write(f"{stage} : aucune donnée")
+                continue
+            self.stdout.write(
+                f"{stage} : {stats['count']} livraisons, moyenne {stats['mean']:.1f} min, "
+                f"médiane {stats['median']:.1f} min, p90 {stats['p90']:.1f} min"
+            )
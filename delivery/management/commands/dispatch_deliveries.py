@@ -0,0 +1,56 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from delivery.dispatch import DispatchService, hungarian, auction
+
+class Command(BaseCommand):
+    help = 'Affecte en lot les livraisons en attente aux livreurs disponibles (affectation optimale)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-km', type=float, default=None, help="Distance d'approche maximale")
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Dispatch par groupes de zones dans un pool de N processus (défaut : DISPATCH_WORKERS ou nombre de cœurs)'
+        )
+        parser.add_argument('--global', dest='global_pass', action='store_true',
+                            help='Un seul passage sur toutes les livraisons, sans partitionnement par zone')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Relance le dispatch toutes les N secondes au lieu de sortir')
+        parser.add_argument(
+            '--benchmark', type=int, metavar='N',
+            help='Mesure les solveurs sur une matrice aléatoire N x N au lieu de dispatcher'
+        )
+
+    def handle(self, *args, **options):
+        if options['benchmark']:
+            return self.benchmark(options['benchmark'])
+
+        while True:
+            start = time.perf_counter()
+            if options['global_pass']:
+                assigned = DispatchService.assign_routes(max_km=options['max_km'])
+                assigned += DispatchService.batch_assign(max_km=options['max_km'])
+            else:
+                assigned = DispatchService.dispatch_sharded(workers=options['workers'], max_km=options['max_km'])
+            self.stdout.write(self.style.SUCCESS(
+                f"{assigned} livraisons affectées en {(time.perf_counter() - start) * 1000:.0f} ms"
+            ))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    def benchmark(self, size):
+        rng = np.random.default_rng(0)
+        drivers = np.column_stack([48.85 + rng.uniform(-0.1, 0.1, size), 2.35 + rng.uniform(-0.15, 0.15, size)])
+        pickups = np.column_stack([48.85 + rng.uniform(-0.1, 0.1, size), 2.35 + rng.uniform(-0.15, 0.15, size)])
+
+        start = time.perf_counter()
+        cost = DispatchService.cost_matrix(drivers, pickups)
+        self.stdout.write(f"Matrice {size}x{size} : {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        for name, solver in (('hongrois', hungarian), ('enchères', auction)):
+            start = time.perf_counter()
+            rows, cols = solver(cost)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"{name} : {elapsed * 1000:.0f} ms, distance totale {cost[rows, cols].sum():.1f} km")
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from delivery.geofence import geofences
+
+class Command(BaseCommand):
+    help = (
+        "Évalue les géorepères (arrivée au ramassage / au dépôt, immobilisation) des livraisons actives ; "
+        "à lancer avec --interval dans un seul processus planifié"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Relance l\'évaluation toutes les N secondes au lieu de sortir')
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.perf_counter()
+            counts = geofences.evaluate()
+            self.stdout.write(
+                f"{sum(counts.values())} événements en {(time.perf_counter() - start) * 1000:.0f} ms"
+            )
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from delivery.routing import RoutePlanner
+
+class Command(BaseCommand):
+    help = 'Regroupe les livraisons compatibles en tournées multi-arrêts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pickup-radius', type=float, help='Distance maximale entre ramassages (km)')
+        parser.add_argument('--dropoff-radius', type=float, help='Distance maximale entre dépôts (km)')
+        parser.add_argument('--window', type=int, help='Écart maximal entre commandes (minutes)')
+        parser.add_argument('--max-deliveries', type=int, help='Livraisons par tournée')
+
+    def handle(self, *args, **options):
+        routes = RoutePlanner.plan(
+            pickup_radius_km=options['pickup_radius'],
+            dropoff_radius_km=options['dropoff_radius'],
+            window_minutes=options['window'],
+            max_deliveries=options['max_deliveries'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(routes)} tournées créées ({sum(route.stops.count() for route in routes) // 2} livraisons)"
+        ))
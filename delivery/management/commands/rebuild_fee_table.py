@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from delivery.fees import FeeService
+
+class Command(BaseCommand):
+    help = 'Précalcule la table des frais de livraison (zone boutique x zone client)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-km', type=float, help='Distance maximale entre les zones')
+
+    def handle(self, *args, **options):
+        count = FeeService.rebuild_table(max_km=options['max_km'])
+        self.stdout.write(self.style.SUCCESS(f"{count} paires de zones enregistrées"))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from delivery.eta import EtaService
+
+class Command(BaseCommand):
+    help = 'Recalcule les profils de vitesse (zone x heure) utilisés pour les estimations de livraison'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Historique pris en compte (jours)')
+        parser.add_argument('--min-samples', type=int, help='Livraisons minimum par profil')
+
+    def handle(self, *args, **options):
+        count = EtaService.rebuild_profiles(days=options['days'], min_samples=options['min_samples'])
+        self.stdout.write(self.style.SUCCESS(f"{count} profils de vitesse enregistrés"))
@@ -0,0 +1,62 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.test.utils import setup_databases, teardown_databases
+from delivery.simulator import DispatchSimulator
+
+class Command(BaseCommand):
+    help = ("Simule une ville (livreurs, boutiques, flux de commandes) sur une base jetable "
+            "et mesure le dispatch : latence d'affectation, kilomètres à vide, requêtes par livraison, débit")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', type=int, default=50)
+        parser.add_argument('--merchants', type=int, default=20)
+        parser.add_argument('--customers', type=int, default=300)
+        parser.add_argument('--orders-per-hour', type=float, default=300)
+        parser.add_argument('--minutes', type=int, default=120, help='Durée du flux de commandes (temps simulé)')
+        parser.add_argument('--tick', type=int, default=30, help='Pas de simulation en secondes')
+        parser.add_argument('--dispatch-every', type=int, default=60, help='Période du dispatch groupé en secondes')
+        parser.add_argument('--speed', type=float, default=25.0, help='Vitesse des livreurs en km/h')
+        parser.add_argument('--radius', type=float, default=8.0, help='Rayon de la ville en km')
+        parser.add_argument('--max-km', type=float, default=None, help="Distance d'approche maximale")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', action='store_true', help='Rapport au format JSON')
+
+    def handle(self, *args, **options):
+        # Base de test vide, créée puis détruite : les résultats ne dépendent que des paramètres
+        databases = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+        try:
+            simulator = DispatchSimulator(
+                drivers=options['drivers'], merchants=options['merchants'], customers=options['customers'],
+                orders_per_hour=options['orders_per_hour'], minutes=options['minutes'],
+                tick_seconds=options['tick'], dispatch_seconds=options['dispatch_every'],
+                speed_kmh=options['speed'], radius_km=options['radius'], max_km=options['max_km'],
+                seed=options['seed'],
+            )
+            simulator.setup()
+            report = simulator.run()
+        finally:
+            teardown_databases(databases, verbosity=0)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        latency, duration = report['assignment_latency_minutes'], report['delivery_time_minutes']
+        self.stdout.write(
+            f"{report['deliveries_completed']}/{report['deliveries_created']} livraisons terminées "
+            f"en {report['simulated_minutes']:.0f} min simulées ({report['wall_seconds']:.1f} s réelles)"
+        )
+        self.stdout.write(
+            f"Affectation (min) : p50 {latency['p50'] or 0:.1f}, p90 {latency['p90'] or 0:.1f}, p99 {latency['p99'] or 0:.1f}"
+        )
+        self.stdout.write(
+            f"Livraison (min) : p50 {duration['p50'] or 0:.1f}, p90 {duration['p90'] or 0:.1f}, p99 {duration['p99'] or 0:.1f}"
+        )
+        self.stdout.write(
+            f"À vide : {report['deadhead_km']:.1f} km ({report['deadhead_km_per_delivery'] or 0:.2f} km/livraison, "
+            f"{(report['deadhead_share'] or 0) * 100:.0f} % des km)"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['queries']} requêtes ({report['queries_per_delivery'] or 0:.1f}/livraison), "
+            f"{report['deliveries_per_second'] or 0:.1f} livraisons/s"
+        ))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from delivery.dispatch import DispatchService
+from delivery.watchdog import WatchdogService
+
+class Command(BaseCommand):
+    help = 'Retire le livreur des livraisons bloquées (ramassage en retard, livreur sans signal) pour les redispatcher'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dispatch', action='store_true',
+                            help='Lance le dispatch par zones juste après la libération')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Relance la surveillance toutes les N secondes au lieu de sortir')
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.perf_counter()
+            counts = WatchdogService.run()
+            message = (
+                f"{counts['pickup_timeout']} ramassages en retard, {counts['driver_silent']} livreurs sans signal, "
+                f"{counts['in_transit_silent']} livraisons en transit signalées"
+            )
+            if options['dispatch'] and counts['pickup_timeout'] + counts['driver_silent']:
+                message += f", {DispatchService.dispatch_sharded()} réaffectées"
+            self.stdout.write(self.style.SUCCESS(f"{message} en {(time.perf_counter() - start) * 1000:.0f} ms"))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
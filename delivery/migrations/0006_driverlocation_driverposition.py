@@ -0,0 +1,41 @@
+# Generated by Django 5.2.8 on 2026-10-19 13:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0005_deliveryroute_routestop'),
+        ('users', '0002_user_latitude_user_longitude'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DriverPosition',
+            fields=[
+                ('driver', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='position', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('recorded_at', models.DateTimeField()),
+                ('delivery', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='delivery.delivery')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DriverLocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('recorded_at', models.DateTimeField()),
+                ('delivery', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='locations', to='delivery.delivery')),
+                ('driver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='locations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['driver', 'recorded_at'], name='delivery_loc_driver_ts_idx'), models.Index(fields=['delivery', 'recorded_at'], name='delivery_loc_delivery_ts_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-19 13:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0006_driverlocation_driverposition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='delivery',
+            name='route_distance_km',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=9, null=True),
+        ),
+        migrations.AddField(
+            model_name='delivery',
+            name='route_polyline',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='delivery',
+            name='trail_compacted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-19 13:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0007_delivery_route_trail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='driverposition',
+            name='estimated_arrival',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='SpeedProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zone', models.CharField(blank=True, max_length=12)),
+                ('hour', models.PositiveSmallIntegerField()),
+                ('speed_kmh', models.FloatField()),
+                ('sample_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('zone', 'hour'), name='delivery_speedprofile_zone_hour')],
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.8 on 2026-10-19 13:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+OPEN_STATUSES = ('PENDING', 'READY', 'PICKED_UP', 'IN_TRANSIT')
+
+
+def create_availabilities(apps, schema_editor):
+    """Les livreurs existants restent disponibles, avec leur charge actuelle."""
+    User = apps.get_model('users', 'User')
+    Delivery = apps.get_model('delivery', 'Delivery')
+    DriverAvailability = apps.get_model('delivery', 'DriverAvailability')
+
+    loads = {}
+    carrying = set()
+    for driver_id, status in Delivery.objects.filter(
+        driver__isnull=False, status__in=OPEN_STATUSES
+    ).values_list('driver_id', 'status'):
+        loads[driver_id] = loads.get(driver_id, 0) + 1
+        if status in ('PICKED_UP', 'IN_TRANSIT'):
+            carrying.add(driver_id)
+
+    DriverAvailability.objects.bulk_create([
+        DriverAvailability(
+            driver_id=driver_id,
+            current_load=loads.get(driver_id, 0),
+            state='CARRYING' if driver_id in carrying else ('TO_PICKUP' if driver_id in loads else 'IDLE'),
+        )
+        for driver_id in User.objects.filter(role='DRIVER').values_list('id', flat=True)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0008_speedprofile_driverposition_eta'),
+        ('users', '0002_user_latitude_user_longitude'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DriverAvailability',
+            fields=[
+                ('driver', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='availability', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('state', models.CharField(choices=[('OFFLINE', 'Hors ligne'), ('IDLE', 'Disponible'), ('TO_PICKUP', 'En route vers le ramassage'), ('CARRYING', 'En livraison'), ('ON_BREAK', 'En pause')], default='IDLE', max_length=20)),
+                ('capacity', models.PositiveSmallIntegerField(default=1)),
+                ('current_load', models.PositiveSmallIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'driver availabilities',
+                'indexes': [models.Index(fields=['state'], name='delivery_avail_state_idx')],
+            },
+        ),
+        migrations.RunPython(create_availabilities, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.8 on 2026-10-19 13:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def tag_open_deliveries(apps, schema_editor):
+    """Zone de ramassage des livraisons pas encore terminées."""
+    from delivery.zones import zone_for
+    Delivery = apps.get_model('delivery', 'Delivery')
+    pending = Delivery.objects.filter(
+        status__in=['PENDING', 'READY', 'PICKED_UP', 'IN_TRANSIT'], pickup_latitude__isnull=False
+    ).only('id', 'pickup_latitude', 'pickup_longitude')
+    batch = []
+    for delivery in pending.iterator(chunk_size=2000):
+        delivery.pickup_zone = zone_for(delivery.pickup_latitude, delivery.pickup_longitude)
+        batch.append(delivery)
+    Delivery.objects.bulk_update(batch, ['pickup_zone'], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0009_driveravailability'),
+        ('orders', '0002_orderitem'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='delivery',
+            name='pickup_zone',
+            field=models.CharField(blank=True, max_length=12),
+        ),
+        migrations.AddIndex(
+            model_name='delivery',
+            index=models.Index(fields=['pickup_zone', 'status'], name='delivery_zone_status_idx'),
+        ),
+        migrations.RunPython(tag_open_deliveries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.8 on 2026-10-19 13:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0010_delivery_pickup_zone'),
+        ('merchants', '0002_merchantprofile_latitude_merchantprofile_longitude'),
+        ('orders', '0002_orderitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeeSurge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zone', models.CharField(max_length=12)),
+                ('multiplier', models.DecimalField(decimal_places=2, max_digits=4)),
+                ('starts_at', models.DateTimeField()),
+                ('ends_at', models.DateTimeField(blank=True, null=True)),
+                ('reason', models.CharField(blank=True, max_length=255)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ZoneFee',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('origin_zone', models.CharField(max_length=12)),
+                ('destination_zone', models.CharField(max_length=12)),
+                ('distance_km', models.DecimalField(decimal_places=2, max_digits=7)),
+                ('fee', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('origin_zone', 'destination_zone'), name='delivery_zonefee_pair')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DeliveryQuote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('origin_zone', models.CharField(blank=True, max_length=12)),
+                ('destination_zone', models.CharField(blank=True, max_length=12)),
+                ('base_fee', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('surge_multiplier', models.DecimalField(decimal_places=2, default=1, max_digits=4)),
+                ('fee', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('quoted_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('merchant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='delivery_quotes', to='merchants.merchantprofile')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='delivery_quotes', to='orders.order')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('order', 'merchant'), name='delivery_quote_order_merchant')],
+            },
+        ),
+    ]
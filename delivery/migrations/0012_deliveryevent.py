@@ -0,0 +1,49 @@
+# Generated by Django 5.2.8 on 2026-10-19 13:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_events(apps, schema_editor):
+    """Reconstitue l'historique des livraisons existantes à partir de leurs horodatages."""
+    Delivery = apps.get_model('delivery', 'Delivery')
+    DeliveryEvent = apps.get_model('delivery', 'DeliveryEvent')
+    columns = (('assigned_at', 2), ('ready_at', 3), ('picked_up_at', 4), ('delivered_at', 5))
+    events = []
+    for row in Delivery.objects.values('id', 'status', *(column for column, _ in columns)).iterator(chunk_size=2000):
+        for column, code in columns:
+            if row[column] and (code != 5 or row['status'] == 'DELIVERED'):
+                events.append(DeliveryEvent(delivery_id=row['id'], code=code, at=row[column]))
+        if len(events) >= 5000:
+            DeliveryEvent.objects.bulk_create(events)
+            events = []
+    DeliveryEvent.objects.bulk_create(events)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0011_fee_quotes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.PositiveSmallIntegerField(choices=[(1, 'Créée'), (2, 'Livreur affecté'), (3, 'Prête pour ramassage'), (4, 'Colis récupéré'), (5, 'Livrée'), (6, 'Annulée'), (7, 'Échouée')])),
+                ('at', models.DateTimeField()),
+                ('latitude', models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True)),
+                ('longitude', models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True)),
+                ('note', models.CharField(blank=True, max_length=255)),
+                ('actor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('delivery', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='delivery.delivery')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['delivery', 'code'], name='delivery_event_delivery_idx'), models.Index(fields=['code', 'at'], name='delivery_event_code_at_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_events, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0012_deliveryevent'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deliveryevent',
+            name='code',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Créée'), (2, 'Livreur affecté'), (3, 'Prête pour ramassage'), (4, 'Colis récupéré'), (5, 'Livrée'), (6, 'Annulée'), (7, 'Échouée'), (8, 'Arrivé au ramassage'), (9, 'Arrivé au dépôt'), (10, 'Immobilisation prolongée')]),
+        ),
+    ]
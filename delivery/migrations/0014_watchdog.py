@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-19 13:42
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0013_geofence_event_codes'),
+        ('orders', '0002_orderitem'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deliveryevent',
+            name='code',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Créée'), (2, 'Livreur affecté'), (3, 'Prête pour ramassage'), (4, 'Colis récupéré'), (5, 'Livrée'), (6, 'Annulée'), (7, 'Échouée'), (8, 'Arrivé au ramassage'), (9, 'Arrivé au dépôt'), (10, 'Immobilisation prolongée'), (11, 'Livreur retiré'), (12, 'Livreur sans signal')]),
+        ),
+        migrations.AddIndex(
+            model_name='delivery',
+            index=models.Index(fields=['status', 'assigned_at'], name='delivery_status_assigned_idx'),
+        ),
+    ]
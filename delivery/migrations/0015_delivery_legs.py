@@ -0,0 +1,42 @@
+# Generated by Django 5.2.8 on 2026-10-19 13:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def tag_merchants(apps, schema_editor):
+    """Livraisons existantes : la boutique du premier article, d'où partait le ramassage."""
+    Delivery = apps.get_model('delivery', 'Delivery')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    first_merchant = OrderItem.objects.filter(order=OuterRef('order')).order_by('id').values('product__merchant')[:1]
+    Delivery.objects.update(merchant=Subquery(first_merchant))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0014_watchdog'),
+        ('merchants', '0002_merchantprofile_latitude_merchantprofile_longitude'),
+        ('orders', '0002_orderitem'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='delivery',
+            name='merchant',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='deliveries', to='merchants.merchantprofile'),
+        ),
+        migrations.AlterField(
+            model_name='delivery',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='orders.order'),
+        ),
+        migrations.RunPython(tag_merchants, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='delivery',
+            constraint=models.UniqueConstraint(fields=('order', 'merchant'), name='delivery_order_merchant_uniq'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:10
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def drop_duplicate_arrivals(apps, schema_editor):
+    """Arrivées écrites deux fois par des passages concurrents : on garde la première."""
+    DeliveryEvent = apps.get_model('delivery', 'DeliveryEvent')
+    arrivals = DeliveryEvent.objects.filter(code__in=[8, 9])
+    first_ids = (
+        arrivals.values('delivery', 'code', 'actor').annotate(first_id=Min('id')).values_list('first_id', flat=True)
+    )
+    arrivals.exclude(id__in=list(first_ids)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0015_delivery_legs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_arrivals, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='deliveryevent',
+            constraint=models.UniqueConstraint(condition=models.Q(('code__in', [8, 9])), fields=('delivery', 'code', 'actor'), name='delivery_event_arrival_once'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0016_arrival_once'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='driverposition',
+            index=models.Index(fields=['recorded_at'], name='delivery_pos_recorded_idx'),
+        ),
+    ]
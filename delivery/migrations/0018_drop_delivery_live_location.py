@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:15
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0017_driver_position_recorded_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='delivery',
+            name='current_latitude',
+        ),
+        migrations.RemoveField(
+            model_name='delivery',
+            name='current_longitude',
+        ),
+        migrations.RemoveField(
+            model_name='delivery',
+            name='last_location_update',
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-19 14:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0018_drop_delivery_live_location'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='driveravailability',
+            index=models.Index(fields=['updated_at'], name='delivery_avail_updated_idx'),
+        ),
+    ]
@@ -12,10 +12,18 @@ class Delivery(models.Model):
         CANCELLED = 'CANCELLED', 'Annulé'
         FAILED = 'FAILED', 'Échoué'
 
-    order = models.OneToOneField(
+    order = models.ForeignKey(
         Order,
         on_delete=models.CASCADE,
-        related_name='delivery'
+        related_name='deliveries'
+    )
+    # Boutique de ramassage : une livraison par boutique d'une commande multi-marchands
+    merchant = models.ForeignKey(
+        'merchants.MerchantProfile',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='deliveries'
     )
     driver = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -52,11 +60,318 @@ class Delivery(models.Model):
     pickup_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     dropoff_latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     dropoff_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    # Zone geohash du point de ramassage, fixée à la création (partitionnement du dispatch)
+    pickup_zone = models.CharField(max_length=12, blank=True)
     
-    # Real-time Driver Location
-    current_latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
-    current_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
-    last_location_update = models.DateTimeField(null=True, blank=True)
+    # La position en direct du livreur est dans DriverPosition (une ligne par livreur)
+
+    # Trajet effectué, compacté une fois la livraison terminée (polyline encodée)
+    route_polyline = models.TextField(blank=True)
+    route_distance_km = models.DecimalField(max_digits=9, decimal_places=2, null=True, blank=True)
+    trail_compacted_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['pickup_zone', 'status'], name='delivery_zone_status_idx'),
+            models.Index(fields=['status', 'assigned_at'], name='delivery_status_assigned_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'merchant'], name='delivery_order_merchant_uniq'),
+        ]
 
     def __str__(self):
         return f"Livraison pour la Commande #{self.order.id} - {self.get_status_display()}"
+
+class GeocodeCacheEntry(models.Model):
+    """
+    Résultat de géocodage mis en cache, indexé par le hachage de l'adresse normalisée.
+    Des coordonnées nulles signifient que l'adresse est introuvable (cache négatif).
+    """
+    address_key = models.CharField(max_length=64, unique=True)
+    normalized_address = models.TextField()
+    latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def coordinates(self):
+        if self.latitude is None or self.longitude is None:
+            return None
+        return {'lat': float(self.latitude), 'lng': float(self.longitude)}
+
+    def __str__(self):
+        return f"{self.normalized_address} -> {self.coordinates}"
+
+class DeliveryRoute(models.Model):
+    """
+    Tournée regroupant plusieurs livraisons compatibles confiées à un même livreur.
+    """
+    class Status(models.TextChoices):
+        PLANNED = 'PLANNED', 'Planifiée'
+        ASSIGNED = 'ASSIGNED', 'Affectée'
+        COMPLETED = 'COMPLETED', 'Terminée'
+        CANCELLED = 'CANCELLED', 'Annulée'
+
+    driver = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='delivery_routes'
+    )
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PLANNED)
+    total_distance_km = models.DecimalField(max_digits=9, decimal_places=2, default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Tournée #{self.id} - {self.get_status_display()}"
+
+class RouteStop(models.Model):
+    """
+    Étape d'une tournée, dans l'ordre de passage : ramassage ou dépôt d'une livraison.
+    """
+    class Kind(models.TextChoices):
+        PICKUP = 'PICKUP', 'Ramassage'
+        DROPOFF = 'DROPOFF', 'Dépôt'
+
+    route = models.ForeignKey(DeliveryRoute, on_delete=models.CASCADE, related_name='stops')
+    delivery = models.ForeignKey(Delivery, on_delete=models.CASCADE, related_name='route_stops')
+    sequence = models.PositiveIntegerField()
+    kind = models.CharField(max_length=10, choices=Kind.choices)
+    latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['route', 'sequence']
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.sequence} - Livraison #{self.delivery_id}"
+
+class DriverLocation(models.Model):
+    """
+    Historique brut des positions GPS envoyées par les livreurs (table en ajout seul,
+    alimentée par lots depuis le tampon d'ingestion).
+    """
+    driver = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='locations'
+    )
+    delivery = models.ForeignKey(
+        Delivery,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='locations'
+    )
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    recorded_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['driver', 'recorded_at'], name='delivery_loc_driver_ts_idx'),
+            models.Index(fields=['delivery', 'recorded_at'], name='delivery_loc_delivery_ts_idx'),
+        ]
+
+class DriverPosition(models.Model):
+    """
+    Dernière position connue de chaque livreur (une ligne par livreur, réécrite à chaque lot).
+    """
+    driver = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='position'
+    )
+    delivery = models.ForeignKey(
+        Delivery,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    recorded_at = models.DateTimeField()
+    # Heure d'arrivée estimée au point de dépôt, recalculée à chaque lot de positions
+    estimated_arrival = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Livreurs silencieux (watchdog) : dernière position antérieure au seuil
+            models.Index(fields=['recorded_at'], name='delivery_pos_recorded_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.driver} @ ({self.latitude}, {self.longitude})"
+
+class SpeedProfile(models.Model):
+    """
+    Vitesse moyenne observée des livraisons par zone et par heure de la journée,
+    recalculée périodiquement. La zone '' porte le profil global de l'heure.
+    """
+    zone = models.CharField(max_length=12, blank=True)
+    hour = models.PositiveSmallIntegerField()
+    speed_kmh = models.FloatField()
+    sample_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['zone', 'hour'], name='delivery_speedprofile_zone_hour'),
+        ]
+
+    def __str__(self):
+        return f"{self.zone or 'global'} {self.hour}h : {self.speed_kmh:.1f} km/h"
+
+class DriverAvailability(models.Model):
+    """
+    Disponibilité d'un livreur pour le dispatch : état, capacité et nombre de
+    livraisons en cours. Recalculée à chaque transition d'une de ses livraisons.
+    """
+    class State(models.TextChoices):
+        OFFLINE = 'OFFLINE', 'Hors ligne'
+        IDLE = 'IDLE', 'Disponible'
+        TO_PICKUP = 'TO_PICKUP', 'En route vers le ramassage'
+        CARRYING = 'CARRYING', 'En livraison'
+        ON_BREAK = 'ON_BREAK', 'En pause'
+
+    driver = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='availability'
+    )
+    state = models.CharField(max_length=20, choices=State.choices, default=State.IDLE)
+    capacity = models.PositiveSmallIntegerField(default=1)
+    current_load = models.PositiveSmallIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'driver availabilities'
+        indexes = [
+            models.Index(fields=['state'], name='delivery_avail_state_idx'),
+            # Rattrapage du pool de dispatch : disponibilités modifiées depuis le dernier passage
+            models.Index(fields=['updated_at'], name='delivery_avail_updated_idx'),
+        ]
+
+    @property
+    def is_dispatchable(self):
+        return self.state not in (self.State.OFFLINE, self.State.ON_BREAK) and self.current_load < self.capacity
+
+    def __str__(self):
+        return f"{self.driver} - {self.get_state_display()} ({self.current_load}/{self.capacity})"
+
+class ZoneFee(models.Model):
+    """
+    Frais de livraison précalculés d'une zone de boutique vers une zone de client
+    (geohash de précision FEE_ZONE_PRECISION), hors majoration.
+    """
+    origin_zone = models.CharField(max_length=12)
+    destination_zone = models.CharField(max_length=12)
+    distance_km = models.DecimalField(max_digits=7, decimal_places=2)
+    fee = models.DecimalField(max_digits=10, decimal_places=2)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['origin_zone', 'destination_zone'], name='delivery_zonefee_pair'),
+        ]
+
+    def __str__(self):
+        return f"{self.origin_zone} -> {self.destination_zone} : {self.fee}"
+
+class FeeSurge(models.Model):
+    """
+    Majoration temporaire des frais au départ d'une zone (préfixe geohash : une
+    majoration sur une cellule s'applique à toutes ses sous-cellules).
+    """
+    zone = models.CharField(max_length=12)
+    multiplier = models.DecimalField(max_digits=4, decimal_places=2)
+    starts_at = models.DateTimeField()
+    ends_at = models.DateTimeField(null=True, blank=True)
+    reason = models.CharField(max_length=255, blank=True)
+
+    def __str__(self):
+        return f"{self.zone} x{self.multiplier}"
+
+class DeliveryQuote(models.Model):
+    """
+    Frais de livraison affichés au client et figés à la validation du panier,
+    une ligne par boutique de la commande.
+    """
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='delivery_quotes')
+    merchant = models.ForeignKey(
+        'merchants.MerchantProfile',
+        on_delete=models.CASCADE,
+        related_name='delivery_quotes'
+    )
+    origin_zone = models.CharField(max_length=12, blank=True)
+    destination_zone = models.CharField(max_length=12, blank=True)
+    base_fee = models.DecimalField(max_digits=10, decimal_places=2)
+    surge_multiplier = models.DecimalField(max_digits=4, decimal_places=2, default=1)
+    fee = models.DecimalField(max_digits=10, decimal_places=2)
+    quoted_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'merchant'], name='delivery_quote_order_merchant'),
+        ]
+
+    def __str__(self):
+        return f"Commande #{self.order_id} / {self.merchant_id} : {self.fee}"
+
+class DeliveryEvent(models.Model):
+    """
+    Historique des livraisons, en ajout seul : une ligne par transition, avec un
+    code court, l'horodatage, l'auteur et, si connue, la position.
+    """
+    class Code(models.IntegerChoices):
+        CREATED = 1, 'Créée'
+        ASSIGNED = 2, 'Livreur affecté'
+        READY = 3, 'Prête pour ramassage'
+        PICKED_UP = 4, 'Colis récupéré'
+        DELIVERED = 5, 'Livrée'
+        CANCELLED = 6, 'Annulée'
+        FAILED = 7, 'Échouée'
+        ARRIVED_PICKUP = 8, 'Arrivé au ramassage'
+        ARRIVED_DROPOFF = 9, 'Arrivé au dépôt'
+        DWELL = 10, 'Immobilisation prolongée'
+        RELEASED = 11, 'Livreur retiré'
+        STALLED = 12, 'Livreur sans signal'
+
+    delivery = models.ForeignKey(Delivery, on_delete=models.CASCADE, related_name='events')
+    code = models.PositiveSmallIntegerField(choices=Code.choices)
+    at = models.DateTimeField()
+    actor = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    note = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['delivery', 'code'], name='delivery_event_delivery_idx'),
+            models.Index(fields=['code', 'at'], name='delivery_event_code_at_idx'),
+        ]
+        constraints = [
+            # Une arrivée (ramassage, dépôt) n'est signalée qu'une fois par livreur
+            models.UniqueConstraint(
+                fields=['delivery', 'code', 'actor'],
+                condition=models.Q(code__in=[8, 9]),
+                name='delivery_event_arrival_once',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Livraison #{self.delivery_id} : {self.get_code_display()} ({self.at})"
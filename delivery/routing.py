@@ -0,0 +1,197 @@
+"""
+Regroupement des livraisons en tournées multi-arrêts.
+
+Les livraisons en attente dont les points de ramassage sont proches, les adresses
+de dépôt voisines et les commandes passées dans la même fenêtre de temps sont
+réunies (au plus ROUTE_MAX_DELIVERIES par tournée). L'ordre des arrêts suit
+une heuristique de voyageur de commerce : plus proche voisin puis 2-opt, sur la
+matrice de distances vectorisée. Tous les ramassages précèdent les dépôts.
+"""
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from core.metrics import metrics
+from core.transactions import transactional_retry
+from .availability import AvailabilityService
+from .events import DeliveryEventService
+from .google_maps import GoogleMapsService
+from .models import Delivery, DeliveryEvent, DeliveryRoute, RouteStop
+from .tracking import TrackingService
+
+def nearest_neighbour_path(dist, start=0):
+    """Chemin ouvert partant de `start`, allant toujours au nœud non visité le plus proche."""
+    n = dist.shape[0]
+    visited = np.zeros(n, dtype=bool)
+    path = [start]
+    visited[start] = True
+    for _ in range(n - 1):
+        candidates = np.where(visited, np.inf, dist[path[-1]])
+        nxt = int(np.argmin(candidates))
+        path.append(nxt)
+        visited[nxt] = True
+    return path
+
+def two_opt(dist, path):
+    """
+    Améliore un chemin ouvert à premier nœud fixe en inversant des segments
+    tant que la longueur diminue.
+    """
+    path = list(path)
+    n = len(path)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, n - 1):
+            for j in range(i + 1, n):
+                a, b = path[i - 1], path[i]
+                c = path[j]
+                d = path[j + 1] if j + 1 < n else None
+                before = dist[a, b] + (dist[c, d] if d is not None else 0)
+                after = dist[a, c] + (dist[b, d] if d is not None else 0)
+                if after < before - 1e-9:
+                    path[i:j + 1] = reversed(path[i:j + 1])
+                    improved = True
+    return path
+
+def path_length(dist, path):
+    return float(sum(dist[a, b] for a, b in zip(path, path[1:])))
+
+class RoutePlanner:
+    """
+    Planification des tournées pour les livraisons qui n'en ont pas encore.
+    """
+
+    @staticmethod
+    def candidates():
+        """Livraisons en attente, sans livreur, géolocalisées et hors de toute tournée active."""
+        return (
+            Delivery.objects.filter(
+                driver__isnull=True,
+                status__in=[Delivery.Status.PENDING, Delivery.Status.READY_FOR_PICKUP],
+                pickup_latitude__isnull=False, dropoff_latitude__isnull=False,
+            )
+            .exclude(route_stops__route__status__in=[DeliveryRoute.Status.PLANNED, DeliveryRoute.Status.ASSIGNED])
+            .select_related('order')
+            .order_by('order__created_at', 'id')
+        )
+
+    @staticmethod
+    def group(deliveries, pickup_radius_km, dropoff_radius_km, window_minutes, max_deliveries):
+        """
+        Partitionne les livraisons en groupes compatibles (listes d'indices), en une
+        passe gloutonne sur les matrices de compatibilité.
+        """
+        pickups = [(d.pickup_latitude, d.pickup_longitude) for d in deliveries]
+        dropoffs = [(d.dropoff_latitude, d.dropoff_longitude) for d in deliveries]
+        created = np.array([d.order.created_at.timestamp() for d in deliveries])
+
+        pickup_dist = GoogleMapsService.distance_matrix(pickups, pickups)
+        dropoff_dist = GoogleMapsService.distance_matrix(dropoffs, dropoffs)
+        compatible = (
+            (pickup_dist <= pickup_radius_km)
+            & (dropoff_dist <= dropoff_radius_km)
+            & (np.abs(created[:, None] - created[None, :]) <= window_minutes * 60)
+        )
+
+        grouped = np.zeros(len(deliveries), dtype=bool)
+        groups = []
+        for seed in range(len(deliveries)):
+            if grouped[seed]:
+                continue
+            members = np.nonzero(compatible[seed] & ~grouped)[0]
+            # Les plus proches du point de dépôt de la livraison de référence d'abord
+            members = members[np.argsort(dropoff_dist[seed, members], kind='stable')][:max_deliveries]
+            grouped[members] = True
+            groups.append(members.tolist())
+        return groups
+
+    @staticmethod
+    def sequence(deliveries):
+        """
+        Ordre des arrêts d'un groupe : [(kind, delivery, lat, lng)], et la longueur totale (km).
+        Les ramassages au même endroit sont fusionnés dans le calcul du trajet.
+        """
+        pickup_points = {}
+        for delivery in deliveries:
+            pickup_points.setdefault((delivery.pickup_latitude, delivery.pickup_longitude), []).append(delivery)
+        pickup_keys = list(pickup_points)
+
+        points = pickup_keys + [(d.dropoff_latitude, d.dropoff_longitude) for d in deliveries]
+        dist = GoogleMapsService.distance_matrix(points, points)
+        n_pickups = len(pickup_keys)
+
+        pickup_order = two_opt(dist, nearest_neighbour_path(dist[:n_pickups, :n_pickups]))
+        last_pickup = pickup_order[-1]
+        # Dépôts : chemin ouvert depuis le dernier ramassage
+        dropoff_nodes = [last_pickup] + list(range(n_pickups, len(points)))
+        sub = dist[np.ix_(dropoff_nodes, dropoff_nodes)]
+        dropoff_order = [dropoff_nodes[i] for i in two_opt(sub, nearest_neighbour_path(sub))[1:]]
+
+        stops = []
+        for node in pickup_order:
+            lat, lng = pickup_keys[node]
+            stops.extend((RouteStop.Kind.PICKUP, delivery, lat, lng) for delivery in pickup_points[pickup_keys[node]])
+        for node in dropoff_order:
+            delivery = deliveries[node - n_pickups]
+            stops.append((RouteStop.Kind.DROPOFF, delivery, delivery.dropoff_latitude, delivery.dropoff_longitude))
+        return stops, path_length(dist, pickup_order + dropoff_order)
+
+    @staticmethod
+    @transactional_retry
+    def plan(pickup_radius_km=None, dropoff_radius_km=None, window_minutes=None, max_deliveries=None):
+        """
+        Crée les tournées (deux livraisons ou plus) et leurs arrêts ordonnés.
+        Les livraisons isolées restent des trajets simples. Retourne les tournées créées.
+        """
+        pickup_radius_km = pickup_radius_km if pickup_radius_km is not None else getattr(settings, 'ROUTE_PICKUP_RADIUS_KM', 0.5)
+        dropoff_radius_km = dropoff_radius_km if dropoff_radius_km is not None else getattr(settings, 'ROUTE_DROPOFF_RADIUS_KM', 3.0)
+        window_minutes = window_minutes if window_minutes is not None else getattr(settings, 'ROUTE_WINDOW_MINUTES', 20)
+        max_deliveries = max_deliveries or getattr(settings, 'ROUTE_MAX_DELIVERIES', 5)
+
+        deliveries = list(RoutePlanner.candidates().select_for_update(skip_locked=True, of=('self',)))
+        if len(deliveries) < 2:
+            return []
+
+        routes, stops = [], []
+        for members in RoutePlanner.group(deliveries, pickup_radius_km, dropoff_radius_km, window_minutes, max_deliveries):
+            if len(members) < 2:
+                continue
+            ordered, length = RoutePlanner.sequence([deliveries[i] for i in members])
+            route = DeliveryRoute(total_distance_km=round(length, 2))
+            routes.append(route)
+            stops.append(ordered)
+
+        DeliveryRoute.objects.bulk_create(routes)
+        RouteStop.objects.bulk_create([
+            RouteStop(route=route, delivery=delivery, sequence=index, kind=kind, latitude=lat, longitude=lng)
+            for route, ordered in zip(routes, stops)
+            for index, (kind, delivery, lat, lng) in enumerate(ordered, start=1)
+        ])
+        metrics.inc('routes_planned', len(routes))
+        metrics.inc('route_deliveries_batched', sum(len(o) for o in stops) // 2)
+        return routes
+
+    @staticmethod
+    @transactional_retry
+    def assign(route_id, driver):
+        """Confie une tournée et toutes ses livraisons à un livreur."""
+        route = DeliveryRoute.objects.select_for_update().get(id=route_id)
+        if route.status != DeliveryRoute.Status.PLANNED:
+            raise ValidationError(f"La tournée #{route_id} n'est plus planifiée.")
+
+        route.driver = driver
+        route.status = DeliveryRoute.Status.ASSIGNED
+        route.save(update_fields=['driver', 'status', 'updated_at'])
+        delivery_ids = list(
+            Delivery.objects.filter(route_stops__route=route, driver__isnull=True).values_list('id', flat=True).distinct()
+        )
+        now = timezone.now()
+        Delivery.objects.filter(id__in=delivery_ids).update(driver=driver, assigned_at=now)
+        DeliveryEventService.record_many([
+            DeliveryEventService.build(delivery_id, DeliveryEvent.Code.ASSIGNED, at=now) for delivery_id in delivery_ids
+        ])
+        AvailabilityService.refresh_many([driver.pk])
+        TrackingService.invalidate(*delivery_ids)
+        return route
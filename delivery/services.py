@@ -1,10 +1,16 @@
 import secrets
-from django.db import transaction
+from core.transactions import transactional_retry
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from django.conf import settings
-from .models import Delivery
-from .google_maps import GoogleMapsService
+from .events import DeliveryEventService
+from .models import Delivery, DeliveryEvent
+from .fees import FeeService
+from .geocoding import GeocodingService
+from .eta import EtaService
+from .zones import zone_for
+from .spatial import drivers
+from .locations import LocationPing, buffer as location_buffer
 
 class DeliveryService:
     """
@@ -12,74 +18,90 @@ class DeliveryService:
     """
 
     @staticmethod
-    @transaction.atomic
-    def create_delivery(order):
+    def _stored_coordinates(instance):
         """
-        Initialise une livraison pour une commande payée.
-        Calcule les frais de livraison et géocode les adresses.
+        Coordonnées précalculées d'un utilisateur ou d'une boutique.
+        Si elles manquent encore, le géocodage est replanifié en arrière-plan.
         """
-        if hasattr(order, 'delivery'):
-            return order.delivery
+        if instance is None or instance.latitude is None:
+            if instance is not None and instance.address:
+                GeocodingService.schedule_refresh(instance)
+            return {'lat': None, 'lng': None}
+        return {'lat': float(instance.latitude), 'lng': float(instance.longitude)}
 
-        # Geocode shipping address (customer)
-        customer_coords = GoogleMapsService.geocode_address(order.customer.address)
-        
-        # Geocode merchant address (pickup location)
-        merchant_profile = order.items.first().product.merchant if order.items.exists() else None
-        merchant_address = merchant_profile.address if merchant_profile else "Default Merchant Location"
-        merchant_coords = GoogleMapsService.geocode_address(merchant_address)
-        
-        # Calculate distance
-        distance_km = GoogleMapsService.calculate_distance(
-            merchant_coords['lat'], merchant_coords['lng'],
-            customer_coords['lat'], customer_coords['lng']
-        )
-        
-        # Calculate delivery fee
-        delivery_fee = GoogleMapsService.calculate_delivery_cost(distance_km)
-
-        delivery = Delivery.objects.create(
-            order=order,
-            status=Delivery.Status.PENDING,
-            delivery_code=secrets.token_hex(4).upper(),
-            shipping_address=order.customer.address,
-            customer_phone=order.customer.phone_number,
-            delivery_fee=delivery_fee,
-            pickup_latitude=merchant_coords['lat'],
-            pickup_longitude=merchant_coords['lng'],
-            dropoff_latitude=customer_coords['lat'],
-            dropoff_longitude=customer_coords['lng']
-        )
-        return delivery
+    @staticmethod
+    @transactional_retry
+    def create_deliveries(order):
+        """
+        Initialise les livraisons d'une commande payée : une par boutique, chacune
+        ramassée chez sa boutique et dispatchée indépendamment (les ramassages se font
+        en parallèle ; la commande est livrée quand la dernière livraison l'est).
+        Le client garde un seul code de livraison pour toute la commande.
+        Les frais sont ceux des devis figés à la validation du panier ; les coordonnées
+        sont celles déjà stockées sur le client et les boutiques (aucun géocodage ni
+        calcul de distance sur le chemin de la requête).
+        """
+        from orders.models import Order
+
+        # Verrou sur la commande : un second appel concurrent attend et ne recrée rien
+        Order.objects.select_for_update().only('id').get(pk=order.pk)
+        existing = list(order.deliveries.all())
+        items = order.items.select_related('product__merchant')
+        merchants = FeeService.merchants_of(item.product for item in items) or [None]
+        done = {delivery.merchant_id for delivery in existing}
+        missing = [merchant for merchant in merchants if getattr(merchant, 'pk', None) not in done]
+        if not missing:
+            return existing
+
+        customer_coords = DeliveryService._stored_coordinates(order.customer)
+        delivery_code = existing[0].delivery_code if existing else secrets.token_hex(4).upper()
+        created = []
+        for merchant in missing:
+            merchant_coords = DeliveryService._stored_coordinates(merchant)
+            created.append(Delivery.objects.create(
+                order=order,
+                merchant=merchant,
+                status=Delivery.Status.PENDING,
+                delivery_code=delivery_code,
+                shipping_address=order.customer.address,
+                customer_phone=order.customer.phone_number,
+                delivery_fee=FeeService.fee_for(order, merchant),
+                pickup_latitude=merchant_coords['lat'],
+                pickup_longitude=merchant_coords['lng'],
+                dropoff_latitude=customer_coords['lat'],
+                dropoff_longitude=customer_coords['lng'],
+                pickup_zone=zone_for(merchant_coords['lat'], merchant_coords['lng'])
+            ))
+        DeliveryEventService.record_many([
+            DeliveryEventService.build(delivery.pk, DeliveryEvent.Code.CREATED)
+            for delivery in created
+        ])
+        return existing + created
 
     @staticmethod
     def find_available_drivers(pickup_lat, pickup_lng, limit=5):
         """
-        Trouve les livreurs disponibles triés par distance du point de ramassage.
+        Trouve les livreurs disponibles triés par distance du point de ramassage
+        (k plus proches voisins via l'index spatial en mémoire).
         """
+        from django.db.models import Q
         from users.models import User
-        
-        drivers = User.objects.filter(role=User.Role.DRIVER, is_active=True)
-        
-        # Calculate distance for each driver (mock: assume drivers have addresses)
-        driver_distances = []
-        for driver in drivers:
-            if driver.address:
-                driver_coords = GoogleMapsService.geocode_address(driver.address)
-                distance = GoogleMapsService.calculate_distance(
-                    pickup_lat, pickup_lng,
-                    driver_coords['lat'], driver_coords['lng']
-                )
-                driver_distances.append((driver, distance))
-        
-        # Sort by distance
-        driver_distances.sort(key=lambda x: x[1])
-        
-        return [d[0] for d in driver_distances[:limit]]
+        from .models import DriverAvailability
+
+        if pickup_lat is None or pickup_lng is None:
+            # Sans point de ramassage : n'importe quel livreur libre (sans ligne de disponibilité = libre)
+            return list(User.objects.filter(
+                Q(availability__isnull=True) | Q(availability__state=DriverAvailability.State.IDLE),
+                role=User.Role.DRIVER, is_active=True, latitude__isnull=False,
+            )[:limit])
+
+        nearest = drivers.nearest(pickup_lat, pickup_lng, k=limit)
+        found = User.objects.in_bulk([driver_id for driver_id, _ in nearest])
+        return [found[driver_id] for driver_id, _ in nearest if driver_id in found]
 
     @staticmethod
-    @transaction.atomic
-    def assign_driver(delivery_id, driver=None):
+    @transactional_retry
+    def assign_driver(delivery_id, driver=None, actor=None):
         """
         Assigne un livreur à une expédition.
         Si driver=None, sélectionne automatiquement le livreur le plus proche.
@@ -100,12 +122,16 @@ class DeliveryService:
             
         delivery.driver = driver
         delivery.assigned_at = timezone.now()
-        delivery.save()
+        delivery.estimated_delivery_time = EtaService.estimate(
+            delivery, EtaService.driver_position(driver), at=delivery.assigned_at
+        )
+        delivery.save(update_fields=['driver', 'assigned_at', 'estimated_delivery_time'])
+        DeliveryEventService.record(delivery, DeliveryEvent.Code.ASSIGNED, at=delivery.assigned_at, actor=actor)
         return delivery
 
     @staticmethod
-    @transaction.atomic
-    def mark_as_ready(delivery_id, merchant_notes=""):
+    @transactional_retry
+    def mark_as_ready(delivery_id, merchant_notes="", actor=None):
         """
         Le marchand indique que le colis est prêt à être récupéré.
         """
@@ -117,11 +143,12 @@ class DeliveryService:
         delivery.status = Delivery.Status.READY_FOR_PICKUP
         delivery.ready_at = timezone.now()
         delivery.merchant_notes = merchant_notes
-        delivery.save()
+        delivery.save(update_fields=['status', 'ready_at', 'merchant_notes'])
+        DeliveryEventService.record(delivery, DeliveryEvent.Code.READY, at=delivery.ready_at, actor=actor)
         return delivery
 
     @staticmethod
-    @transaction.atomic
+    @transactional_retry
     def pickup_package(delivery_id, driver_notes=""):
         """
         Le livreur confirme qu'il a récupéré le colis chez le marchand.
@@ -131,22 +158,22 @@ class DeliveryService:
         if delivery.status != Delivery.Status.READY_FOR_PICKUP:
             raise ValidationError(f"Le colis n'est pas encore prêt pour le ramassage.")
             
-        if not delivery.driver:
+        if delivery.driver_id is None:
             raise ValidationError(f"Aucun livreur n'est assigné à cette livraison.")
 
-        delivery.status = Delivery.Status.PICKED_UP
+        # Le ramassage fait passer directement en transit (une seule écriture)
+        delivery.status = Delivery.Status.IN_TRANSIT
         delivery.picked_up_at = timezone.now()
         delivery.driver_notes = driver_notes
-        delivery.save()
-        
-        # On passe automatiquement en transit
-        delivery.status = Delivery.Status.IN_TRANSIT
-        delivery.save()
-        
+        delivery.estimated_delivery_time = EtaService.estimate(delivery, at=delivery.picked_up_at)
+        delivery.save(update_fields=['status', 'picked_up_at', 'driver_notes', 'estimated_delivery_time'])
+        DeliveryEventService.record(
+            delivery, DeliveryEvent.Code.PICKED_UP, at=delivery.picked_up_at, actor=delivery.driver_id
+        )
         return delivery
 
     @staticmethod
-    @transaction.atomic
+    @transactional_retry
     def complete_delivery(delivery_id, otp_code):
         """
         Finalise la livraison après vérification du code de sécurité.
@@ -159,45 +186,94 @@ class DeliveryService:
         if delivery.delivery_code != otp_code:
             raise ValidationError("Code de livraison incorrect.")
 
+        return DeliveryService._deliver(delivery, actor=delivery.driver_id)
+
+    @staticmethod
+    @transactional_retry
+    def force_complete(delivery_id, actor=None):
+        """
+        Clôture manuelle d'une livraison, sans code (support, démo) : même chemin que la
+        remise au client (historique, clôture de la commande, versement aux boutiques).
+        """
+        delivery = Delivery.objects.select_for_update().get(id=delivery_id)
+
+        if delivery.status in [Delivery.Status.DELIVERED, Delivery.Status.CANCELLED]:
+            raise ValidationError(f"La livraison #{delivery_id} est déjà terminée.")
+
+        return DeliveryService._deliver(delivery, actor=actor)
+
+    @staticmethod
+    def _deliver(delivery, actor=None):
+        """
+        Passe une livraison verrouillée à livrée (frais retenus par la plateforme si elle
+        n'avait pas de livreur), puis tente de clôturer sa commande.
+        """
         delivery.status = Delivery.Status.DELIVERED
         delivery.delivered_at = timezone.now()
-        delivery.save()
-        
-        # Mettre à jour le statut de la commande également
+        delivery.save(update_fields=['status', 'delivered_at'])
+        DeliveryEventService.record(delivery, DeliveryEvent.Code.DELIVERED, at=delivery.delivered_at, actor=actor)
+
+        if delivery.driver_id is None:
+            # Aucun livreur à payer : les frais de cette livraison reviennent à la plateforme
+            from finance.services import FinanceService
+            FinanceService.retain_delivery_fee(delivery.order_id, delivery.merchant_id)
+        DeliveryService._close_order(delivery.order_id)
+        return delivery
+
+    @staticmethod
+    def _close_order(order_id):
+        """
+        Clôture la commande quand sa dernière livraison est terminée : livrée (versement
+        aux boutiques dont la livraison est arrivée) si au moins une l'est, annulée
+        (remboursement du reste du séquestre) si toutes ont été annulées. La commande est
+        verrouillée : deux livraisons terminées en même temps ne la clôturent qu'une fois.
+        """
         from orders.models import Order
-        order = delivery.order
-        order.status = Order.Status.DELIVERED
-        order.save()
-        
-        # Déclenchement du versement au marchand (Logique financière)
         from finance.services import FinanceService
-        FinanceService.settle_merchant_payout(order)
-        
-        return delivery
+        order = Order.objects.select_for_update().get(id=order_id)
+        if order.status in [Order.Status.DELIVERED, Order.Status.CANCELLED]:
+            return False
+        if order.deliveries.exclude(status__in=[Delivery.Status.DELIVERED, Delivery.Status.CANCELLED]).exists():
+            return False
+
+        paid = order.status in [Order.Status.PAID, Order.Status.SHIPPED]
+        if order.deliveries.filter(status=Delivery.Status.DELIVERED).exists():
+            order.status = Order.Status.DELIVERED
+            order.save()
+            # Déclenchement du versement aux marchands (Logique financière)
+            FinanceService.settle_merchant_payout(order)
+        else:
+            order.status = Order.Status.CANCELLED
+            order.save()
+            if paid:
+                FinanceService.refund_order(order)
+        return True
 
     @staticmethod
-    @transaction.atomic
     def update_driver_location(delivery_id, latitude, longitude):
         """
-        Met à jour la position actuelle du livreur.
+        Enregistre la position actuelle du livreur.
+        Ni verrou ni écriture sur la livraison : la position passe par le tampon
+        d'ingestion (`delivery.locations`) et la dernière position connue se lit
+        dans `DriverPosition`.
         """
-        delivery = Delivery.objects.select_for_update().get(id=delivery_id)
-        
+        delivery = Delivery.objects.only('id', 'status', 'driver').get(id=delivery_id)
+
         if delivery.status not in [Delivery.Status.PICKED_UP, Delivery.Status.IN_TRANSIT]:
             raise ValidationError("Le suivi de localisation n'est actif que pendant le transport.")
-        
-        delivery.current_latitude = latitude
-        delivery.current_longitude = longitude
-        delivery.last_location_update = timezone.now()
-        delivery.save()
-        
+        if delivery.driver_id is None:
+            raise ValidationError("Aucun livreur n'est affecté à cette livraison.")
+
+        location_buffer.add([LocationPing(delivery.driver_id, float(latitude), float(longitude), timezone.now(), delivery.id)])
         return delivery
 
     @staticmethod
-    @transaction.atomic
-    def cancel_delivery(delivery_id, reason=""):
+    @transactional_retry
+    def cancel_delivery(delivery_id, reason="", actor=None):
         """
-        Annule une livraison.
+        Annule une livraison. Le motif est conservé dans l'historique ; la part de sa
+        boutique est remboursée et la commande est clôturée si c'était sa dernière
+        livraison en cours.
         """
         delivery = Delivery.objects.select_for_update().get(id=delivery_id)
         
@@ -205,7 +281,11 @@ class DeliveryService:
             raise ValidationError("Cette livraison ne peut plus être annulée.")
             
         delivery.status = Delivery.Status.CANCELLED
-        delivery.driver_notes = f"ANNULATION: {reason}"
-        delivery.save()
-        
+        delivery.save(update_fields=['status'])
+        DeliveryEventService.record(delivery, DeliveryEvent.Code.CANCELLED, actor=actor, note=reason)
+
+        # La part de la boutique (marchandises et frais de livraison) revient au client
+        from finance.services import FinanceService
+        FinanceService.refund_merchant_share(delivery.order_id, delivery.merchant_id)
+        DeliveryService._close_order(delivery.order_id)
         return delivery
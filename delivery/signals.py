@@ -0,0 +1,48 @@
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from users.models import User
+from .availability import AvailabilityService
+from .models import Delivery
+from .spatial import drivers
+from .tracking import TrackingService
+
+@receiver(post_save, sender=User)
+def sync_driver_index(sender, instance, **kwargs):
+    """
+    Tient le pool de dispatch à jour (position, activation, changement de rôle).
+    """
+    transaction.on_commit(lambda: drivers.sync_ids([instance.pk]))
+
+@receiver(post_delete, sender=User)
+def remove_from_driver_index(sender, instance, **kwargs):
+    if drivers.index is not None:
+        drivers.index.remove(instance.pk)
+
+@receiver(post_save, sender=Delivery)
+def refresh_tracking_state(sender, instance, created, **kwargs):
+    """
+    Un changement de la livraison (statut, livreur, ETA) invalide l'état de suivi en cache.
+    """
+    if not created:
+        TrackingService.invalidate(instance.id)
+
+def _snapshot(instance):
+    # __dict__ : ne déclenche pas de requête pour un champ différé (.only())
+    return instance.__dict__.get('driver_id'), instance.__dict__.get('status')
+
+@receiver(post_init, sender=Delivery)
+def remember_assignment(sender, instance, **kwargs):
+    instance._assignment = _snapshot(instance)
+
+@receiver(post_save, sender=Delivery)
+def refresh_driver_availability(sender, instance, created, **kwargs):
+    """
+    Une affectation, un changement de livreur ou de statut modifie la charge des
+    livreurs concernés (l'ancien et le nouveau).
+    """
+    previous_driver, previous_status = instance._assignment
+    current = _snapshot(instance)
+    if created or current != (previous_driver, previous_status):
+        AvailabilityService.refresh_many({previous_driver, current[0]})
+    instance._assignment = current
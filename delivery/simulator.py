@@ -0,0 +1,237 @@
+"""
+Simulateur de dispatch.
+
+Génère une ville synthétique (livreurs, boutiques et clients tirés autour d'un
+centre) et un flux de commandes de Poisson, puis fait tourner les vrais services
+(`DeliveryService`, `DispatchService`, tampon des positions) pas à pas sur une
+horloge simulée : préparation en boutique, dispatch groupé périodique, trajets
+des livreurs à vitesse constante, ramassage et remise au client.
+Tous les tirages viennent d'un générateur initialisé par `seed` : sur une base
+vide, deux passages identiques produisent les mêmes affectations, ce qui permet
+de comparer une optimisation du dispatch avant / après.
+Les horodatages écrits en base restent ceux de l'horloge réelle ; les durées du
+rapport sont mesurées sur l'horloge simulée.
+"""
+from decimal import Decimal
+import time
+
+import numpy as np
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from catalog.models import Product
+from finance.models import Wallet
+from merchants.models import MerchantProfile
+from orders.models import Order, OrderItem
+from users.models import User
+from .dispatch import DispatchService
+from .distance import haversine_pairs
+from .locations import LocationPing, buffer as location_buffer
+from .models import Delivery
+from .services import DeliveryService
+from .spatial import drivers as driver_pool
+
+KM_PER_DEGREE = 111.32
+
+# Phases d'un livreur (l'arrivée fait passer de « en route » à « sur place »)
+IDLE, TO_PICKUP, AT_PICKUP, TO_DROPOFF, AT_DROPOFF = range(5)
+
+class QueryCounter:
+    """Compte les requêtes SQL exécutées (branché par `connection.execute_wrapper`)."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+def _percentiles(values):
+    if not values:
+        return {'p50': None, 'p90': None, 'p99': None}
+    p50, p90, p99 = np.percentile(np.array(values, dtype=float), [50, 90, 99])
+    return {'p50': float(p50), 'p90': float(p90), 'p99': float(p99)}
+
+class DispatchSimulator:
+    """
+    Une simulation : `setup()` peuple la base (vide), `run()` déroule le scénario
+    et retourne le rapport.
+    """
+
+    def __init__(self, drivers=50, merchants=20, customers=300, orders_per_hour=300, minutes=120,
+                 tick_seconds=30, dispatch_seconds=60, prep_minutes=(5, 15), speed_kmh=25.0,
+                 radius_km=8.0, center=(14.6928, -17.4467), max_km=None, seed=0, drain_minutes=120):
+        self.driver_count = drivers
+        self.merchant_count = merchants
+        self.customer_count = customers
+        self.orders_per_second = orders_per_hour / 3600
+        self.duration = minutes * 60
+        self.drain = drain_minutes * 60
+        self.tick = tick_seconds
+        self.dispatch_every = max(1, round(dispatch_seconds / tick_seconds))
+        self.prep = (prep_minutes[0] * 60, prep_minutes[1] * 60)
+        self.step_km = speed_kmh * tick_seconds / 3600
+        self.radius_km = radius_km
+        self.center = center
+        self.max_km = max_km
+        self.rng = np.random.default_rng(seed)
+
+    def _points(self, count):
+        """Points uniformes dans un disque de `radius_km` autour du centre : tableau (count, 2)."""
+        distance = self.radius_km * np.sqrt(self.rng.random(count))
+        angle = self.rng.random(count) * 2 * np.pi
+        lat = self.center[0] + distance * np.cos(angle) / KM_PER_DEGREE
+        lng = self.center[1] + distance * np.sin(angle) / (KM_PER_DEGREE * np.cos(np.radians(self.center[0])))
+        return np.round(np.column_stack([lat, lng]), 6)
+
+    @staticmethod
+    def _users(prefix, role, points):
+        User.objects.bulk_create([
+            User(username=f'{prefix}-{i}', password='!', role=role, address=f'{prefix} {i}',
+                 latitude=Decimal(f'{lat:.6f}'), longitude=Decimal(f'{lng:.6f}'))
+            for i, (lat, lng) in enumerate(points.tolist())
+        ], batch_size=2000)
+        return list(User.objects.filter(username__startswith=f'{prefix}-').order_by('id').values_list('id', flat=True))
+
+    def setup(self):
+        """
+        Ville synthétique, créée en masse (sans signaux ni géocodage) ; seuls les
+        marchands reçoivent un portefeuille, pour les versements à la livraison.
+        """
+        self.driver_ids = self._users('sim-driver', User.Role.DRIVER, self._points(self.driver_count))
+        self.customer_ids = self._users('sim-customer', User.Role.CUSTOMER, self._points(self.customer_count))
+        shops = self._points(self.merchant_count)
+        owners = self._users('sim-merchant', User.Role.MERCHANT, shops)
+        MerchantProfile.objects.bulk_create([
+            MerchantProfile(user_id=owner, store_name=f'Boutique {i}', slug=f'sim-boutique-{i}', address=f'Boutique {i}',
+                            latitude=Decimal(f'{lat:.6f}'), longitude=Decimal(f'{lng:.6f}'))
+            for i, (owner, (lat, lng)) in enumerate(zip(owners, shops.tolist()))
+        ])
+        Wallet.objects.bulk_create([Wallet(user_id=owner) for owner in owners])
+        merchants = MerchantProfile.objects.filter(user_id__in=owners).order_by('id')
+        Product.objects.bulk_create([
+            Product(merchant=merchant, name=f'Article {merchant.pk}', slug=f'sim-article-{merchant.pk}',
+                    sku=f'SIM-{merchant.pk}', price=Decimal('1000.00'))
+            for merchant in merchants
+        ])
+        self.products = list(Product.objects.filter(merchant__in=merchants).order_by('id'))
+
+        self.positions = np.array(
+            User.objects.filter(id__in=self.driver_ids).order_by('id').values_list('latitude', 'longitude'), dtype=float
+        ).reshape(-1, 2)
+        self.phase = np.full(self.driver_count, IDLE)
+        self.targets = np.zeros((self.driver_count, 2))
+        self.jobs = [None] * self.driver_count     # livraison en cours de chaque livreur
+        self.driver_index = {driver_id: i for i, driver_id in enumerate(self.driver_ids)}
+        driver_pool.reset()
+
+    def _arrivals(self, now):
+        """Nouvelles commandes du pas (loi de Poisson), une livraison par boutique."""
+        for _ in range(self.rng.poisson(self.orders_per_second * self.tick)):
+            customer_id = self.customer_ids[self.rng.integers(len(self.customer_ids))]
+            product = self.products[self.rng.integers(len(self.products))]
+            order = Order.objects.create(customer_id=customer_id, total_price=product.price, status=Order.Status.PAID)
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+            for delivery in DeliveryService.create_deliveries(order):
+                self.created[delivery.id] = now
+                self.ready_at[delivery.id] = now + self.rng.uniform(*self.prep)
+                self.unassigned.add(delivery.id)
+
+    def _prepare(self, now):
+        for delivery_id in sorted(d for d, at in self.ready_at.items() if at <= now):
+            DeliveryService.mark_as_ready(delivery_id)
+            del self.ready_at[delivery_id]
+            self.ready.add(delivery_id)
+
+    def _dispatch(self, now):
+        if not self.unassigned:
+            return
+        DispatchService.batch_assign(max_km=self.max_km)
+        assigned = Delivery.objects.filter(id__in=self.unassigned, driver__isnull=False).values_list(
+            'id', 'driver_id', 'pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude',
+            'delivery_code',
+        )
+        for delivery_id, driver_id, *coords, code in assigned.order_by('id'):
+            i = self.driver_index[driver_id]
+            self.unassigned.discard(delivery_id)
+            self.assignment_latency.append(now - self.created[delivery_id])
+            self.jobs[i] = (delivery_id, (float(coords[2]), float(coords[3])), code)
+            self.targets[i] = (float(coords[0]), float(coords[1]))
+            self.phase[i] = TO_PICKUP
+
+    def _move(self, now):
+        """Fait avancer les livreurs en route et traite les arrivées."""
+        moving = np.flatnonzero((self.phase == TO_PICKUP) | (self.phase == TO_DROPOFF))
+        if moving.size:
+            remaining = haversine_pairs(self.positions[moving], self.targets[moving])
+            travelled = np.minimum(remaining, self.step_km)
+            fraction = np.where(remaining > 0, travelled / np.where(remaining > 0, remaining, 1), 1)[:, None]
+            self.positions[moving] += (self.targets[moving] - self.positions[moving]) * fraction
+            self.deadhead_km += float(travelled[self.phase[moving] == TO_PICKUP].sum())
+            self.loaded_km += float(travelled[self.phase[moving] == TO_DROPOFF].sum())
+            arrived = moving[travelled >= remaining]
+            self.positions[arrived] = self.targets[arrived]
+            self.phase[arrived] += 1
+
+        pings = []
+        for i in np.flatnonzero(self.phase != IDLE).tolist():
+            delivery_id, dropoff, code = self.jobs[i]
+            lat, lng = self.positions[i].tolist()
+            if self.phase[i] == AT_PICKUP and delivery_id in self.ready:
+                DeliveryService.pickup_package(delivery_id)
+                self.phase[i], self.targets[i] = TO_DROPOFF, dropoff
+            elif self.phase[i] == AT_DROPOFF:
+                DeliveryService.complete_delivery(delivery_id, code)
+                self.completion_time.append(now - self.created[delivery_id])
+                self.phase[i], self.jobs[i] = IDLE, None
+            elif self.phase[i] == TO_DROPOFF:
+                # Colis à bord : la position passe par le service de livraison
+                DeliveryService.update_driver_location(delivery_id, lat, lng)
+                continue
+            pings.append(LocationPing(self.driver_ids[i], lat, lng, timezone.now(), delivery_id))
+        if pings:
+            location_buffer.add(pings)
+        location_buffer.flush()
+
+    def run(self):
+        """Déroule le scénario puis la vidange (plus de nouvelles commandes) ; retourne le rapport."""
+        self.created, self.ready_at, self.ready, self.unassigned = {}, {}, set(), set()
+        self.assignment_latency, self.completion_time = [], []
+        self.deadhead_km = self.loaded_km = 0.0
+
+        counter = QueryCounter()
+        start = time.perf_counter()
+        # Positions écrites une fois par pas simulé (flush explicite), jamais par le thread de fond
+        with override_settings(LOCATION_FLUSH_INTERVAL_MS=10 ** 9, LOCATION_FLUSH_SIZE=10 ** 9), \
+                connection.execute_wrapper(counter):
+            tick = 0
+            while True:
+                now = tick * self.tick
+                if now >= self.duration and (now >= self.duration + self.drain or len(self.completion_time) == len(self.created)):
+                    break
+                if now < self.duration:
+                    self._arrivals(now)
+                self._prepare(now)
+                if tick % self.dispatch_every == 0:
+                    self._dispatch(now)
+                self._move(now)
+                tick += 1
+        elapsed = time.perf_counter() - start
+
+        created, completed = len(self.created), len(self.completion_time)
+        return {
+            'simulated_minutes': now / 60,
+            'deliveries_created': created,
+            'deliveries_assigned': len(self.assignment_latency),
+            'deliveries_completed': completed,
+            'assignment_latency_minutes': {k: v and v / 60 for k, v in _percentiles(self.assignment_latency).items()},
+            'delivery_time_minutes': {k: v and v / 60 for k, v in _percentiles(self.completion_time).items()},
+            'deadhead_km': self.deadhead_km,
+            'deadhead_km_per_delivery': self.deadhead_km / completed if completed else None,
+            'deadhead_share': self.deadhead_km / (self.deadhead_km + self.loaded_km) if self.loaded_km else None,
+            'queries': counter.count,
+            'queries_per_delivery': counter.count / created if created else None,
+            'wall_seconds': elapsed,
+            'deliveries_per_second': completed / elapsed if elapsed else None,
+        }
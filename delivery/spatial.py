@@ -0,0 +1,290 @@
+"""
+Index spatial en mémoire pour la recherche des livreurs les plus proches.
+
+Les positions sont réparties dans une grille de cellules de DRIVER_INDEX_CELL_DEGREES
+degrés : une recherche ne parcourt que les anneaux de cellules autour du point,
+en s'arrêtant dès qu'aucune cellule plus lointaine ne peut contenir un meilleur candidat.
+Les mises à jour (déplacement, mise hors ligne) sont incrémentales.
+"""
+from datetime import timedelta
+import heapq
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+EARTH_RADIUS_KM = 6371
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+class GridIndex:
+    """
+    Points (clé -> latitude, longitude) rangés par cellule de grille, sûr entre threads.
+    """
+
+    def __init__(self, cell_degrees=0.0025):
+        self.cell_degrees = cell_degrees
+        self._cells = {}
+        self._positions = {}
+        self._lock = threading.RLock()
+
+    def _cell(self, lat, lng):
+        return (math.floor(lat / self.cell_degrees), math.floor(lng / self.cell_degrees))
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def position(self, key):
+        return self._positions.get(key)
+
+    def items(self):
+        """Copie des positions : [(clé, latitude, longitude)]."""
+        with self._lock:
+            return [(key, lat, lng) for key, (lat, lng) in self._positions.items()]
+
+    def upsert(self, key, lat, lng):
+        lat, lng = float(lat), float(lng)
+        cell = self._cell(lat, lng)
+        with self._lock:
+            previous = self._positions.get(key)
+            if previous is not None:
+                old_cell = self._cell(*previous)
+                if old_cell != cell:
+                    self._discard_from_cell(old_cell, key)
+            self._positions[key] = (lat, lng)
+            self._cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        with self._lock:
+            previous = self._positions.pop(key, None)
+            if previous is not None:
+                self._discard_from_cell(self._cell(*previous), key)
+
+    def clear(self):
+        with self._lock:
+            self._cells.clear()
+            self._positions.clear()
+
+    def _discard_from_cell(self, cell, key):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(key)
+            if not members:
+                del self._cells[cell]
+
+    def _ring(self, center, radius):
+        ci, cj = center
+        if radius == 0:
+            yield center
+            return
+        for j in range(cj - radius, cj + radius + 1):
+            yield (ci - radius, j)
+            yield (ci + radius, j)
+        for i in range(ci - radius + 1, ci + radius):
+            yield (i, cj - radius)
+            yield (i, cj + radius)
+
+    def _min_distance_outside(self, lat, radius):
+        """Distance minimale (km) d'un point situé au-delà de `radius` anneaux."""
+        edge_lat = min(90.0, abs(lat) + (radius + 1) * self.cell_degrees)
+        return radius * self.cell_degrees * KM_PER_DEGREE * math.cos(math.radians(edge_lat))
+
+    def nearest(self, lat, lng, k=1, max_km=None):
+        """
+        Les `k` points les plus proches, triés : [(clé, distance_km)].
+        """
+        lat, lng = float(lat), float(lng)
+        with self._lock:
+            if not self._positions or k <= 0:
+                return []
+            center = self._cell(lat, lng)
+            best = []  # tas max sur la distance : (-distance, clé)
+            scanned = 0
+            radius = 0
+            while scanned < len(self._positions):
+                if 8 * radius > len(self._cells):
+                    # Anneaux plus grands que le nombre de cellules occupées : parcours direct du reste
+                    remaining = (
+                        key for cell, members in self._cells.items()
+                        if max(abs(cell[0] - center[0]), abs(cell[1] - center[1])) >= radius
+                        for key in members
+                    )
+                    self._collect(best, k, lat, lng, remaining)
+                    break
+                for cell in self._ring(center, radius):
+                    members = self._cells.get(cell)
+                    if members:
+                        scanned += len(members)
+                        self._collect(best, k, lat, lng, members)
+                if len(best) == k and -best[0][0] <= self._min_distance_outside(lat, radius):
+                    break
+                if max_km is not None and self._min_distance_outside(lat, radius) > max_km:
+                    break
+                radius += 1
+
+        results = sorted(((key, -neg) for neg, key in best), key=lambda item: item[1])
+        if max_km is not None:
+            results = [item for item in results if item[1] <= max_km]
+        return results
+
+    def _collect(self, best, k, lat, lng, keys):
+        for key in keys:
+            plat, plng = self._positions[key]
+            distance = haversine_km(lat, lng, plat, plng)
+            if len(best) < k:
+                heapq.heappush(best, (-distance, key))
+            elif distance < -best[0][0]:
+                heapq.heapreplace(best, (-distance, key))
+
+    def within(self, lat, lng, radius_km):
+        """
+        Points situés à moins de `radius_km`, triés par distance : [(clé, distance_km)].
+        """
+        lat, lng = float(lat), float(lng)
+        dlat = radius_km / KM_PER_DEGREE
+        dlng = dlat / max(math.cos(math.radians(min(90.0, abs(lat) + dlat))), 1e-6)
+        min_i, min_j = self._cell(lat - dlat, lng - dlng)
+        max_i, max_j = self._cell(lat + dlat, lng + dlng)
+
+        results = []
+        with self._lock:
+            if (max_i - min_i + 1) * (max_j - min_j + 1) > len(self._cells):
+                cells = [
+                    members for (i, j), members in self._cells.items()
+                    if min_i <= i <= max_i and min_j <= j <= max_j
+                ]
+            else:
+                cells = [
+                    self._cells[(i, j)]
+                    for i in range(min_i, max_i + 1) for j in range(min_j, max_j + 1)
+                    if (i, j) in self._cells
+                ]
+            for members in cells:
+                for key in members:
+                    distance = haversine_km(lat, lng, *self._positions[key])
+                    if distance <= radius_km:
+                        results.append((key, distance))
+        results.sort(key=lambda item: item[1])
+        return results
+
+class DriverLocator:
+    """
+    Pool de dispatch : livreurs actifs, disponibles (voir `availability`) et
+    géolocalisés, à leur dernière position GPS ou à défaut aux coordonnées de leur
+    adresse (clé = ID utilisateur). Chargé depuis la base au premier usage puis
+    reconstruit toutes les DRIVER_INDEX_REFRESH_SECONDS ; entre deux reconstructions,
+    `sync_ids` applique les changements du processus au fil de l'eau et `catch_up`
+    (au début de chaque passe de dispatch) ceux écrits par les autres processus.
+    """
+
+    def __init__(self):
+        self.index = None
+        self._loaded_at = 0
+        self._synced_at = None
+        self._lock = threading.Lock()
+
+    def _refresh_seconds(self):
+        return getattr(settings, 'DRIVER_INDEX_REFRESH_SECONDS', 300)
+
+    @staticmethod
+    def _dispatchable():
+        """Livreurs dispatchables : (id, lat GPS, lng GPS, lat adresse, lng adresse)."""
+        from django.db.models import F, Q
+        from users.models import User
+        from .models import DriverAvailability
+        paused = [DriverAvailability.State.OFFLINE, DriverAvailability.State.ON_BREAK]
+        return User.objects.filter(role=User.Role.DRIVER, is_active=True).filter(
+            Q(availability__isnull=True)
+            | (Q(availability__current_load__lt=F('availability__capacity')) & ~Q(availability__state__in=paused))
+        ).values_list('id', 'position__latitude', 'position__longitude', 'latitude', 'longitude')
+
+    @staticmethod
+    def _locate(row):
+        driver_id, live_lat, live_lng, lat, lng = row
+        if live_lat is not None:
+            return driver_id, live_lat, live_lng
+        if lat is not None and lng is not None:
+            return driver_id, lat, lng
+        return driver_id, None, None
+
+    def rebuild(self):
+        synced_at = timezone.now()
+        index = GridIndex(getattr(settings, 'DRIVER_INDEX_CELL_DEGREES', 0.0025))
+        for row in self._dispatchable().iterator(chunk_size=5000):
+            driver_id, lat, lng = self._locate(row)
+            if lat is not None:
+                index.upsert(driver_id, lat, lng)
+        self.index = index
+        self._loaded_at = time.monotonic()
+        self._synced_at = synced_at
+        return index
+
+    def get_index(self):
+        with self._lock:
+            if self.index is None or time.monotonic() - self._loaded_at > self._refresh_seconds():
+                self.rebuild()
+            return self.index
+
+    def reset(self):
+        with self._lock:
+            self.index = None
+
+    def sync_ids(self, user_ids):
+        """Reporte dans le pool l'état des utilisateurs donnés (position, rôle, activité, disponibilité)."""
+        index = self.index
+        if index is None:
+            return
+        user_ids = set(user_ids)
+        located = set()
+        for row in self._dispatchable().filter(pk__in=user_ids):
+            driver_id, lat, lng = self._locate(row)
+            if lat is not None:
+                index.upsert(driver_id, lat, lng)
+                located.add(driver_id)
+        for user_id in user_ids - located:
+            index.remove(user_id)
+
+    def catch_up(self):
+        """
+        Reporte dans le pool les positions et disponibilités écrites depuis le dernier
+        rattrapage, quel que soit le processus qui les a reçues (index sur
+        `DriverPosition.recorded_at` et `DriverAvailability.updated_at`). La marge
+        DRIVER_INDEX_SYNC_OVERLAP_SECONDS couvre les positions horodatées avant leur
+        écriture (tampon d'ingestion). Retourne le nombre de livreurs relus.
+        """
+        from .models import DriverAvailability, DriverPosition
+
+        with self._lock:
+            if self.index is None or time.monotonic() - self._loaded_at > self._refresh_seconds():
+                self.rebuild()
+                return 0
+            since = self._synced_at - timedelta(seconds=getattr(settings, 'DRIVER_INDEX_SYNC_OVERLAP_SECONDS', 30))
+            self._synced_at = timezone.now()
+        changed = set(DriverPosition.objects.filter(recorded_at__gte=since).values_list('driver_id', flat=True))
+        changed.update(DriverAvailability.objects.filter(updated_at__gte=since).values_list('driver_id', flat=True))
+        changed = sorted(changed)
+        for start in range(0, len(changed), 2000):
+            self.sync_ids(changed[start:start + 2000])
+        return len(changed)
+
+    def candidates(self):
+        """Livreurs du pool : [(id, latitude, longitude)]."""
+        return self.get_index().items()
+
+    def nearest(self, lat, lng, k=5, max_km=None):
+        return self.get_index().nearest(lat, lng, k=k, max_km=max_km)
+
+    def within(self, lat, lng, radius_km):
+        return self.get_index().within(lat, lng, radius_km)
+
+drivers = DriverLocator()
@@ -1,3 +1,930 @@
-from django.test import TestCase
+import asyncio
+from datetime import timedelta
+from decimal import Decimal
+import itertools
+import json
+import random
 
-# Create your tests here.
+import numpy as np
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from core.metrics import metrics
+from catalog.models import Inventory, Product
+from finance.models import EscrowHolding
+from finance.services import FinanceService
+from merchants.models import MerchantProfile
+from orders.models import Order
+from orders.services import OrderService
+from users.models import User
+from users.services import UserService
+from .google_maps import GoogleMapsService
+from .geofence import GeofenceEvaluator
+from .geocoding import GeocodingService, normalize_address
+from .dispatch import DispatchService, hungarian
+from .eta import EtaService
+from .events import DeliveryEventService
+from .fees import FeeService, zone_center
+from .models import (
+    Delivery, DeliveryEvent, DeliveryRoute, DriverAvailability, DriverLocation, DriverPosition, FeeSurge,
+    GeocodeCacheEntry, RouteStop, SpeedProfile, ZoneFee,
+)
+from .routing import RoutePlanner, two_opt
+from .services import DeliveryService
+from .simulator import DispatchSimulator
+from .spatial import GridIndex, drivers, haversine_km
+from .tracking import TrackingHub, TrackingService, check_tracking_cache, tracking_cache
+from .trails import TrailService, decode_polyline, encode_polyline
+from .watchdog import WatchdogService
+from .zones import bounds, neighbors, zone_for
+
+class GeocodingCacheTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        GeocodingService.clear_memory_cache()
+
+    def test_normalized_addresses_share_one_entry(self):
+        self.assertEqual(normalize_address(" 10, Rue de l'Église "), '10 rue de l eglise')
+
+        first = GeocodingService.geocode("10, Rue de l'Église")
+        second = GeocodingService.geocode("10 rue de l eglise")
+        self.assertEqual(first, second)
+        self.assertEqual(GeocodeCacheEntry.objects.count(), 1)
+        self.assertEqual(metrics.counter('geocode_provider_calls'), 1)
+        self.assertEqual(metrics.counter('geocode_lookups', layer='memory', result='hit'), 1)
+
+    def test_batch_deduplicates_and_falls_back_to_database(self):
+        addresses = ['5 Rue de Rivoli', '5 rue de rivoli', '12 Avenue Foch', '']
+        results = GeocodingService.geocode_many(addresses)
+
+        self.assertEqual(results['5 Rue de Rivoli'], results['5 rue de rivoli'])
+        self.assertIsNone(results[''])
+        self.assertEqual(metrics.counter('geocode_provider_calls'), 3)
+
+        GeocodingService.clear_memory_cache()
+        self.assertEqual(GeocodingService.geocode_many(addresses), results)
+        self.assertEqual(metrics.counter('geocode_provider_calls'), 3)
+        self.assertEqual(metrics.counter('geocode_lookups', layer='database', result='negative'), 1)
+
+@override_settings(ASYNC_TASKS_EAGER=True)
+class StoredCoordinatesTests(TestCase):
+    def setUp(self):
+        GeocodingService.clear_memory_cache()
+        drivers.reset()
+
+    def test_address_change_refreshes_coordinates_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            user = User.objects.create_user(username='client', password='x', address='5 Rue de Rivoli')
+        user.refresh_from_db()
+        expected = GeocodingService.geocode('5 Rue de Rivoli')
+        self.assertAlmostEqual(float(user.latitude), expected['lat'], places=6)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            UserService.update_address(user, '12 Avenue Foch')
+        user.refresh_from_db()
+        self.assertAlmostEqual(float(user.longitude), GeocodingService.geocode('12 Avenue Foch')['lng'], places=6)
+
+    def test_direct_save_of_a_new_address_refreshes_coordinates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            seller = User.objects.create_user(username='seller', password='x', role=User.Role.MERCHANT)
+            store = seller.merchant_profile
+            store.address = '5 Rue de Rivoli'
+            store.save()
+        store.refresh_from_db()
+        self.assertAlmostEqual(float(store.latitude), GeocodingService.geocode('5 Rue de Rivoli')['lat'], places=6)
+
+        # Comme depuis l'admin : un save() complet, sans passer par le service
+        seller.address = '12 Avenue Foch'
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            seller.save()
+            self.assertIsNone(User.objects.get(pk=seller.pk).latitude)
+        self.assertEqual(len(callbacks), 2)
+        seller.refresh_from_db()
+        self.assertAlmostEqual(float(seller.latitude), GeocodingService.geocode('12 Avenue Foch')['lat'], places=6)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            seller.save()
+        self.assertEqual(len(callbacks), 1)  # adresse inchangée : seul le pool des livreurs est resynchronisé
+
+    def test_backfill_fills_missing_coordinates(self):
+        User.objects.bulk_create([
+            User(username=f'driver{i}', role=User.Role.DRIVER, address=f'{i} Rue de Rivoli') for i in range(3)
+        ] + [User(username='noaddress', role=User.Role.DRIVER)])
+
+        self.assertEqual(GeocodingService.backfill_coordinates(User.objects.all(), chunk_size=2), 3)
+        self.assertFalse(User.objects.exclude(address='').filter(latitude__isnull=True).exists())
+        self.assertEqual(len(DeliveryService.find_available_drivers(48.8566, 2.3522, limit=5)), 3)
+
+class GridIndexTests(SimpleTestCase):
+    def setUp(self):
+        rng = random.Random(7)
+        self.points = {
+            i: (48.8566 + rng.uniform(-0.1, 0.1), 2.3522 + rng.uniform(-0.1, 0.1)) for i in range(2000)
+        }
+        self.index = GridIndex(cell_degrees=0.005)
+        for key, (lat, lng) in self.points.items():
+            self.index.upsert(key, lat, lng)
+
+    def brute_force(self, lat, lng):
+        return sorted(
+            ((key, haversine_km(lat, lng, *point)) for key, point in self.points.items()),
+            key=lambda item: item[1]
+        )
+
+    def test_nearest_and_radius_match_brute_force(self):
+        for lat, lng in [(48.8566, 2.3522), (48.95, 2.45), (49.5, 3.0)]:
+            expected = self.brute_force(lat, lng)
+            self.assertEqual([key for key, _ in self.index.nearest(lat, lng, k=10)], [key for key, _ in expected[:10]])
+            self.assertEqual(
+                [key for key, _ in self.index.within(lat, lng, 2.0)],
+                [key for key, distance in expected if distance <= 2.0]
+            )
+
+    def test_incremental_moves_and_removals(self):
+        self.index.upsert(0, 10.0, 10.0)
+        self.assertEqual(self.index.nearest(10.0, 10.0, k=1)[0][0], 0)
+        self.index.remove(0)
+        self.assertNotIn(0, self.index)
+        self.assertEqual(len(self.index), 1999)
+        self.assertEqual(self.index.nearest(10.0, 10.0, k=1, max_km=50), [])
+
+class DistanceMatrixTests(SimpleTestCase):
+    def test_matrix_matches_scalar_haversine(self):
+        origins = [(48.8566, 2.3522), {'lat': Decimal('45.764043'), 'lng': Decimal('4.835659')}]
+        destinations = [(43.296482, 5.36978), (48.8566, 2.3522), (None, None)]
+        matrix = GoogleMapsService.distance_matrix(origins, destinations)
+
+        self.assertEqual(matrix.shape, (2, 3))
+        self.assertAlmostEqual(matrix[0, 0], haversine_km(48.8566, 2.3522, 43.296482, 5.36978), places=3)
+        self.assertAlmostEqual(matrix[0, 1], 0, places=3)
+        self.assertTrue(np.isnan(matrix[1, 2]))
+        self.assertEqual(GoogleMapsService.calculate_distance(48.8566, 2.3522, 43.296482, 5.36978), round(matrix[0, 0], 2))
+
+        road = GoogleMapsService.distance_matrix(origins, destinations, road=True)
+        self.assertAlmostEqual(road[1, 0], matrix[1, 0] * 1.3, places=6)
+
+class BatchDispatchTests(TestCase):
+    def setUp(self):
+        drivers.reset()
+        customer = User.objects.create_user(username='client', password='x')
+        self.orders = [Order.objects.create(customer=customer, total_price=Decimal('10.00')) for _ in range(2)]
+
+    def driver(self, name, lng):
+        return User.objects.create_user(
+            username=name, password='x', role=User.Role.DRIVER, latitude=Decimal('0'), longitude=Decimal(lng)
+        )
+
+    def test_solver_is_optimal_on_small_matrices(self):
+        rng = np.random.default_rng(3)
+        for n, m in [(3, 3), (2, 4), (4, 2)]:
+            cost = rng.uniform(0, 10, (n, m))
+            rows, cols = hungarian(cost)
+            if n <= m:
+                best = min(sum(cost[i, p[i]] for i in range(n)) for p in itertools.permutations(range(m), n))
+            else:
+                best = min(sum(cost[p[j], j] for j in range(m)) for p in itertools.permutations(range(n), m))
+            self.assertAlmostEqual(cost[rows, cols].sum(), best)
+
+    def test_batch_beats_greedy_and_skips_busy_drivers(self):
+        # Ramassages à 0 et 0,03 degré ; le plus proche du premier est aussi nécessaire au second
+        first, second = [
+            Delivery.objects.create(order=order, pickup_latitude=Decimal('0'), pickup_longitude=Decimal(lng))
+            for order, lng in zip(self.orders, ['0', '0.03'])
+        ]
+        near = self.driver('near', '0.01')
+        far = self.driver('far', '-0.015')
+        busy = self.driver('busy', '0.03')
+        Delivery.objects.create(
+            order=Order.objects.create(customer=busy, total_price=Decimal('1.00')),
+            driver=busy, status=Delivery.Status.IN_TRANSIT
+        )
+
+        self.assertEqual(DispatchService.batch_assign(), 2)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.driver, second.driver), (far, near))
+        self.assertEqual(DispatchService.batch_assign(), 0)
+
+class DriverAvailabilityTests(TestCase):
+    def setUp(self):
+        drivers.reset()
+        self.customer = User.objects.create_user(username='client', password='x')
+        self.driver = User.objects.create_user(
+            username='rider', password='x', role=User.Role.DRIVER, latitude=Decimal('48.85'), longitude=Decimal('2.35')
+        )
+
+    def delivery(self):
+        return Delivery.objects.create(
+            order=Order.objects.create(customer=self.customer, total_price=Decimal('10.00')),
+            pickup_latitude=Decimal('48.851'), pickup_longitude=Decimal('2.351'),
+            dropoff_latitude=Decimal('48.86'), dropoff_longitude=Decimal('2.36'),
+        )
+
+    def test_driver_leaves_the_pool_while_busy(self):
+        self.assertIn(self.driver.id, drivers.get_index())
+        with self.captureOnCommitCallbacks(execute=True):
+            delivery = DeliveryService.assign_driver(self.delivery().id)
+        self.assertEqual(delivery.driver, self.driver)
+        self.assertEqual(self.driver.availability.state, DriverAvailability.State.TO_PICKUP)
+        self.assertNotIn(self.driver.id, drivers.get_index())
+        self.assertEqual(DispatchService.batch_assign(), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            DeliveryService.cancel_delivery(delivery.id)
+        self.driver.availability.refresh_from_db()
+        self.assertEqual((self.driver.availability.state, self.driver.availability.current_load), ('IDLE', 0))
+        self.assertIn(self.driver.id, drivers.get_index())
+
+    def test_driver_on_break_is_not_dispatched(self):
+        self.client.force_login(self.driver)
+        url = reverse('delivery:availability_api')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, json.dumps({'state': 'ON_BREAK'}), content_type='application/json')
+        self.assertEqual(response.json()['state'], 'ON_BREAK')
+        self.assertNotIn(self.driver.id, drivers.get_index())
+        self.delivery()
+        self.assertEqual(DispatchService.batch_assign(), 0)
+
+    def test_dispatch_pass_catches_up_with_other_processes(self):
+        newcomer = User.objects.create_user(username='newcomer', password='x', role=User.Role.DRIVER)
+        drivers.rebuild()
+        self.assertNotIn(newcomer.id, drivers.get_index())
+
+        # Écritures d'un autre processus (ingestion, API) : aucun sync_ids dans celui-ci
+        now = timezone.now()
+        DriverPosition.objects.create(driver=newcomer, latitude=48.851, longitude=2.351, recorded_at=now)
+        DriverAvailability.objects.update_or_create(
+            driver=self.driver, defaults={'state': DriverAvailability.State.OFFLINE}
+        )
+        self.assertEqual([driver_id for driver_id, _, _ in DispatchService.available_drivers()], [newcomer.id])
+
+    def test_fallback_without_pickup_only_returns_idle_drivers(self):
+        busy = User.objects.create_user(
+            username='busy', password='x', role=User.Role.DRIVER, latitude=Decimal('48.85'), longitude=Decimal('2.35')
+        )
+        DriverAvailability.objects.create(driver=busy, state=DriverAvailability.State.CARRYING, current_load=1)
+        self.assertEqual(DeliveryService.find_available_drivers(None, None), [self.driver])
+
+class ZoneDispatchTests(TestCase):
+    PARIS, LYON = (48.8566, 2.3522), (45.7640, 4.8357)
+
+    def setUp(self):
+        drivers.reset()
+        self.customer = User.objects.create_user(username='client', password='x')
+
+    def delivery(self, lat, lng):
+        return Delivery.objects.create(
+            order=Order.objects.create(customer=self.customer, total_price=Decimal('10.00')),
+            pickup_latitude=Decimal(str(lat)), pickup_longitude=Decimal(str(lng)), pickup_zone=zone_for(lat, lng),
+        )
+
+    def driver(self, name, lat, lng):
+        return User.objects.create_user(
+            username=name, password='x', role=User.Role.DRIVER,
+            latitude=Decimal(str(lat)), longitude=Decimal(str(lng)),
+        )
+
+    def test_neighbors_surround_the_zone(self):
+        zone = zone_for(*self.PARIS)
+        lat_min, lat_max, lng_min, lng_max = bounds(zone)
+        around = {
+            zone_for(lat_min + dlat * (lat_max - lat_min), lng_min + dlng * (lng_max - lng_min))
+            for dlat in (-0.5, 0.5, 1.5) for dlng in (-0.5, 0.5, 1.5)
+        }
+        self.assertEqual(neighbors(zone), around - {zone})
+
+    def test_each_zone_group_uses_its_own_drivers(self):
+        paris = self.delivery(*self.PARIS)
+        lyon = self.delivery(*self.LYON)
+        # Livreur de la zone voisine, juste de l'autre côté de la frontière de la cellule
+        lat_min = bounds(paris.pickup_zone)[0]
+        neighbor = self.driver('voisin', lat_min - 0.001, self.PARIS[1])
+        lyon_driver = self.driver('lyonnais', *self.LYON)
+
+        groups = DispatchService.zone_groups()
+        self.assertEqual(sorted(groups), sorted({paris.pickup_zone[:4], lyon.pickup_zone[:4]}))
+        self.assertEqual(DispatchService.batch_assign(zones=[lyon.pickup_zone]), 1)
+        self.assertEqual(DispatchService.dispatch_sharded(workers=1), 1)
+        paris.refresh_from_db()
+        lyon.refresh_from_db()
+        self.assertEqual((paris.driver, lyon.driver), (neighbor, lyon_driver))
+
+class FeeQuoteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        FeeService.clear_cache()
+        seller = User.objects.create_user(username='seller', password='x', role=User.Role.MERCHANT)
+        MerchantProfile.objects.filter(user=seller).update(latitude=Decimal('48.850000'), longitude=Decimal('2.350000'))
+        self.merchant = MerchantProfile.objects.get(user=seller)
+        self.customer = User.objects.create_user(username='client', password='x', address='12 Avenue Foch')
+        User.objects.filter(pk=self.customer.pk).update(latitude=Decimal('48.880000'), longitude=Decimal('2.290000'))
+        self.customer.refresh_from_db()
+        self.product = Product.objects.create(merchant=self.merchant, name='Mil', price=Decimal('20.00'), sku='MIL-1')
+        Inventory.objects.update_or_create(product=self.product, defaults={'quantity': 10})
+
+    def test_quote_shown_in_cart_is_the_fee_charged(self):
+        origin, destination = FeeService.zone(48.85, 2.35), FeeService.zone(48.88, 2.29)
+        expected = FeeService.fee_for_distance(haversine_km(*zone_center(origin), *zone_center(destination)))
+
+        self.client.force_login(self.customer)
+        response = self.client.get(reverse('delivery:quotes_api'), {'merchant': self.merchant.id})
+        self.assertEqual(response.json()['total'], str(expected))
+
+        # Une majoration décidée après l'affichage ne change pas le devis affiché, même
+        # si la commande arrive sur un autre processus (cache local vide)
+        FeeSurge.objects.create(zone=origin[:4], multiplier=Decimal('1.50'), starts_at=timezone.now())
+        FeeService.clear_cache()
+        cache.clear()
+        computed = metrics.counter('fee_quotes_computed')
+        order = OrderService.place_order(
+            self.customer, [{'product_id': self.product.id, 'quantity': 1}], quote_token=response.json()['token']
+        )
+        self.assertEqual(metrics.counter('fee_quotes_computed'), computed)
+        self.assertEqual(order.delivery_quotes.get().fee, expected)
+        [delivery] = DeliveryService.create_deliveries(order)
+        self.assertEqual(delivery.delivery_fee, expected)
+
+        cache.clear()
+        self.assertEqual(FeeService.quote_many(self.customer, [self.merchant])[0]['fee'], (expected * Decimal('1.5')).quantize(Decimal('0.01')))
+
+    def test_checkout_rejects_quotes_that_no_longer_apply(self):
+        [quote] = FeeService.quote_many(self.customer, [self.merchant])
+        token = FeeService.sign(self.customer, [quote])
+        items = [{'product_id': self.product.id, 'quantity': 1}]
+        other = User.objects.create_user(username='autre', password='x', address='1 Rue de Lyon')
+        User.objects.filter(pk=other.pk).update(latitude=Decimal('48.880000'), longitude=Decimal('2.290000'))
+        other.refresh_from_db()
+
+        for customer, shown in [(other, token), (self.customer, token[:-2] + 'xx'), (self.customer, FeeService.sign(self.customer, []))]:
+            with self.assertRaisesMessage(ValidationError, "veuillez les confirmer à nouveau"):
+                OrderService.place_order(customer, items, quote_token=shown)
+
+        # Adresse changée après l'affichage : les frais montrés ne valent plus
+        User.objects.filter(pk=self.customer.pk).update(
+            address='3 Quai de Bercy', latitude=Decimal('48.800000'), longitude=Decimal('2.400000')
+        )
+        self.customer.refresh_from_db()
+        with self.assertRaisesMessage(ValidationError, "veuillez les confirmer à nouveau"):
+            OrderService.place_order(self.customer, items, quote_token=token)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Inventory.objects.get(product=self.product).quantity, 10)
+
+        # Le panier réaffiche des frais à jour, dont le jeton est accepté
+        self.client.force_login(self.customer)
+        self.client.post(reverse('orders:add_to_cart', args=[self.product.id]), {'quantity': 1})
+        response = self.client.post(reverse('orders:checkout'), {'quote_token': token})
+        self.assertRedirects(response, reverse('orders:cart'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+        cart = self.client.get(reverse('orders:cart'))
+        self.client.post(reverse('orders:checkout'), {'quote_token': cart.context['quote_token']})
+        self.assertEqual(Order.objects.get().delivery_fee, cart.context['delivery_fee'])
+
+    def test_rebuilt_table_serves_zone_pairs(self):
+        self.assertEqual(FeeService.rebuild_table(), 1)
+        pair = ZoneFee.objects.get()
+        self.assertEqual(FeeService.base_fee(pair.origin_zone, pair.destination_zone), pair.fee)
+        self.assertEqual(FeeService.base_fee('', pair.destination_zone), FeeService.fee_for_distance(0))
+
+    def test_customer_without_coordinates_is_geocoded_or_refused(self):
+        User.objects.filter(pk=self.customer.pk).update(latitude=None, longitude=None)
+        self.customer.refresh_from_db()
+        coords = GeocodingService.geocode('12 Avenue Foch')
+        [quote] = FeeService.quote_many(self.customer, [self.merchant])
+        self.assertEqual(quote['destination_zone'], FeeService.zone(coords['lat'], coords['lng']))
+
+        User.objects.filter(pk=self.customer.pk).update(address='')
+        self.customer.refresh_from_db()
+        with self.assertRaises(ValidationError):
+            OrderService.place_order(self.customer, [{'product_id': self.product.id, 'quantity': 1}])
+        self.assertFalse(Order.objects.exists())
+
+class SplitDeliveryTests(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user(username='client', password='x')
+        User.objects.filter(pk=self.customer.pk).update(latitude=Decimal('48.860000'), longitude=Decimal('2.340000'))
+        self.customer.refresh_from_db()
+        self.products = []
+        for i, (lat, lng) in enumerate([('48.850000', '2.350000'), ('48.870000', '2.300000')]):
+            seller = User.objects.create_user(username=f'seller{i}', password='x', role=User.Role.MERCHANT)
+            MerchantProfile.objects.filter(user=seller).update(latitude=Decimal(lat), longitude=Decimal(lng))
+            product = Product.objects.create(
+                merchant=seller.merchant_profile, name=f'Article {i}', price=Decimal('10.00'), sku=f'ART-{i}'
+            )
+            Inventory.objects.update_or_create(product=product, defaults={'quantity': 5})
+            self.products.append(product)
+        self.order = OrderService.place_order(
+            self.customer, [{'product_id': product.id, 'quantity': 1} for product in self.products]
+        )
+
+    def test_one_leg_per_merchant_and_order_closes_on_last_leg(self):
+        legs = DeliveryService.create_deliveries(self.order)
+        self.assertEqual(len(legs), 2)
+        self.assertEqual({leg.merchant_id for leg in legs}, {product.merchant_id for product in self.products})
+        self.assertEqual({leg.pickup_longitude for leg in legs}, {2.35, 2.3})
+        self.assertEqual(len({leg.delivery_code for leg in legs}), 1)
+        self.assertEqual(DeliveryService.create_deliveries(self.order), legs)
+
+        driver = User.objects.create_user(username='rider', password='x', role=User.Role.DRIVER)
+        Delivery.objects.filter(order=self.order).update(driver=driver, status=Delivery.Status.IN_TRANSIT)
+        first, second = legs
+        DeliveryService.complete_delivery(first.id, first.delivery_code)
+        self.order.refresh_from_db()
+        self.assertNotEqual(self.order.status, Order.Status.DELIVERED)
+        DeliveryService.complete_delivery(second.id, second.delivery_code)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.Status.DELIVERED)
+
+    def test_cancelled_leg_is_refunded_and_not_paid_out(self):
+        FinanceService.deposit_funds(self.customer.wallet, Decimal('5000.00'))
+        OrderService.fulfill_order(self.order.id)
+        delivered, cancelled = self.order.deliveries.order_by('id')
+        driver = User.objects.create_user(username='rider', password='x', role=User.Role.DRIVER)
+        Delivery.objects.filter(order=self.order).update(driver=driver, status=Delivery.Status.IN_TRANSIT)
+
+        DeliveryService.complete_delivery(delivered.id, delivered.delivery_code)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.Status.PAID)
+
+        # L'annulation de la dernière livraison en cours clôture la commande
+        DeliveryService.cancel_delivery(cancelled.id, reason='Rupture')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.Status.DELIVERED)
+        holdings = {
+            (h.merchant_id, h.kind): h.status for h in EscrowHolding.objects.filter(order=self.order)
+        }
+        self.assertEqual(holdings, {
+            (delivered.merchant_id, EscrowHolding.Kind.GOODS): EscrowHolding.Status.RELEASED,
+            (delivered.merchant_id, EscrowHolding.Kind.DELIVERY_FEE): EscrowHolding.Status.HELD,
+            (cancelled.merchant_id, EscrowHolding.Kind.GOODS): EscrowHolding.Status.REFUNDED,
+            (cancelled.merchant_id, EscrowHolding.Kind.DELIVERY_FEE): EscrowHolding.Status.REFUNDED,
+        })
+        self.assertEqual(cancelled.merchant.user.wallet.balance, Decimal('0.00'))
+        self.assertEqual(FinanceService.release_escrow(), {'released': 0, 'refunded': 0})
+
+        self.customer.wallet.refresh_from_db()
+        refunded = self.products[1].price + self.order.delivery_quotes.get(merchant=cancelled.merchant).fee
+        self.assertEqual(self.customer.wallet.balance, Decimal('5000.00') - self.order.total_price + refunded)
+
+    def test_manual_delivery_goes_through_the_service(self):
+        FinanceService.deposit_funds(self.customer.wallet, Decimal('5000.00'))
+        OrderService.fulfill_order(self.order.id)
+        OrderService.mark_as_delivered(self.order.id, actor=self.customer)
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.Status.DELIVERED)
+        self.assertEqual(
+            DeliveryEvent.objects.filter(delivery__order=self.order, code=DeliveryEvent.Code.DELIVERED).count(), 2
+        )
+        held = EscrowHolding.objects.filter(order=self.order, kind=EscrowHolding.Kind.GOODS)
+        self.assertFalse(held.exclude(status=EscrowHolding.Status.RELEASED).exists())
+        # Remises sans livreur : les frais reviennent à la plateforme au lieu de rester en séquestre
+        fees = EscrowHolding.objects.filter(order=self.order, kind=EscrowHolding.Kind.DELIVERY_FEE)
+        self.assertEqual(fees.count(), 2)
+        self.assertFalse(fees.exclude(status=EscrowHolding.Status.RELEASED).exists())
+        self.assertEqual(FinanceService.release_escrow(), {'released': 0, 'refunded': 0})
+        for product in self.products:
+            wallet = product.merchant.user.wallet
+            wallet.refresh_from_db()
+            self.assertEqual(wallet.balance, product.price)
+
+    def test_cancelling_a_paid_order_cancels_and_refunds_its_legs(self):
+        FinanceService.deposit_funds(self.customer.wallet, Decimal('5000.00'))
+        OrderService.fulfill_order(self.order.id)
+        self.assertEqual(DispatchService.unassigned().count(), 2)
+
+        OrderService.cancel_order(self.order.id, reason='Client absent')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.Status.CANCELLED)
+        self.assertFalse(self.order.deliveries.exclude(status=Delivery.Status.CANCELLED).exists())
+        self.assertFalse(DispatchService.unassigned().exists())
+        self.assertFalse(EscrowHolding.objects.filter(order=self.order).exclude(status=EscrowHolding.Status.REFUNDED).exists())
+        self.customer.wallet.refresh_from_db()
+        self.assertEqual(self.customer.wallet.balance, Decimal('5000.00'))
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).inventory.quantity, 5)
+
+    def test_partly_delivered_order_cannot_be_cancelled(self):
+        FinanceService.deposit_funds(self.customer.wallet, Decimal('5000.00'))
+        OrderService.fulfill_order(self.order.id)
+        delivered, other = self.order.deliveries.order_by('id')
+        Delivery.objects.filter(pk=delivered.pk).update(status=Delivery.Status.IN_TRANSIT)
+        DeliveryService.complete_delivery(delivered.id, delivered.delivery_code)
+
+        with self.assertRaises(ValidationError):
+            OrderService.cancel_order(self.order.id)
+        self.customer.wallet.refresh_from_db()
+        self.assertEqual(self.customer.wallet.balance, Decimal('5000.00') - self.order.total_price)
+        self.assertEqual(Delivery.objects.get(pk=other.pk).status, Delivery.Status.PENDING)
+
+        # Une livraison restée ouverte d'une commande annulée n'est jamais dispatchée
+        Order.objects.filter(pk=self.order.pk).update(status=Order.Status.CANCELLED)
+        self.assertFalse(DispatchService.unassigned().exists())
+
+class DeliveryEventTests(TestCase):
+    def setUp(self):
+        self.driver = User.objects.create_user(username='rider', password='x', role=User.Role.DRIVER)
+        customer = User.objects.create_user(username='client', password='x')
+        self.orders = [Order.objects.create(customer=customer, total_price=Decimal('10.00')) for _ in range(3)]
+
+    def test_transition_is_one_update_and_one_insert(self):
+        delivery = Delivery.objects.create(
+            order=self.orders[0], driver=self.driver, status=Delivery.Status.READY_FOR_PICKUP, driver_notes='Sonner deux fois'
+        )
+        with CaptureQueriesContext(connection) as queries:
+            DeliveryService.pickup_package(delivery.id, driver_notes='Sonner deux fois')
+        statements = [query['sql'] for query in queries.captured_queries]
+        self.assertEqual(sum(sql.startswith('UPDATE "delivery_delivery"') for sql in statements), 1)
+        self.assertEqual(sum(sql.startswith('INSERT INTO "delivery_deliveryevent"') for sql in statements), 1)
+        self.assertEqual(delivery.events.get().code, DeliveryEvent.Code.PICKED_UP)
+
+        DeliveryService.cancel_delivery(delivery.id, reason='Client absent')
+        delivery.refresh_from_db()
+        self.assertEqual(delivery.driver_notes, 'Sonner deux fois')
+        self.assertEqual(delivery.events.get(code=DeliveryEvent.Code.CANCELLED).note, 'Client absent')
+
+    def test_stage_durations_from_history(self):
+        start = timezone.now() - timedelta(hours=3)
+        events = []
+        for order, (wait, ride) in zip(self.orders, [(5, 20), (10, 30), (30, 40)]):
+            delivery = Delivery.objects.create(order=order)
+            events += [
+                DeliveryEventService.build(delivery.id, DeliveryEvent.Code.READY, at=start),
+                DeliveryEventService.build(delivery.id, DeliveryEvent.Code.PICKED_UP, at=start + timedelta(minutes=wait)),
+                DeliveryEventService.build(delivery.id, DeliveryEvent.Code.DELIVERED, at=start + timedelta(minutes=wait + ride)),
+            ]
+        DeliveryEventService.record_many(events)
+
+        stats = DeliveryEventService.stage_durations(days=1)
+        self.assertEqual(stats['ready_to_pickup']['count'], 3)
+        self.assertAlmostEqual(stats['ready_to_pickup']['mean'], 15)
+        self.assertAlmostEqual(stats['pickup_to_delivered']['median'], 30)
+        self.assertEqual(stats['assign']['count'], 0)
+
+@override_settings(GEOFENCE_AUTO_PICKUP=True, GEOFENCE_MAX_POSITION_AGE_SECONDS=3600, GEOFENCE_DWELL_MINUTES=10)
+class GeofenceTests(TestCase):
+    def setUp(self):
+        self.driver = User.objects.create_user(username='rider', password='x', role=User.Role.DRIVER)
+        customer = User.objects.create_user(username='client', password='x')
+        self.delivery = Delivery.objects.create(
+            order=Order.objects.create(customer=customer, total_price=Decimal('10.00')),
+            driver=self.driver, status=Delivery.Status.READY_FOR_PICKUP, assigned_at=timezone.now(),
+            pickup_latitude=Decimal('48.850000'), pickup_longitude=Decimal('2.350000'),
+            dropoff_latitude=Decimal('48.870000'), dropoff_longitude=Decimal('2.350000'),
+        )
+        self.evaluator = GeofenceEvaluator()
+        self.now = timezone.now()
+
+    def move(self, lat, lng):
+        DriverPosition.objects.update_or_create(
+            driver=self.driver, defaults={'latitude': lat, 'longitude': lng, 'recorded_at': self.now}
+        )
+
+    def evaluate(self, minutes=0):
+        return self.evaluator.evaluate(self.now + timedelta(minutes=minutes))
+
+    def test_arrivals_and_dwell_are_reported_once(self):
+        self.move(48.8502, 2.3501)
+        self.assertEqual(self.evaluate(), {DeliveryEvent.Code.ARRIVED_PICKUP: 1})
+        self.delivery.refresh_from_db()
+        self.assertEqual(self.delivery.status, Delivery.Status.IN_TRANSIT)
+
+        self.move(48.86, 2.35)
+        self.assertEqual(self.evaluate(1), {})
+        self.assertEqual(self.evaluate(12), {DeliveryEvent.Code.DWELL: 1})
+        self.assertEqual(self.evaluate(20), {})
+
+        self.move(48.8701, 2.3499)
+        self.assertEqual(self.evaluate(21), {DeliveryEvent.Code.ARRIVED_DROPOFF: 1})
+        self.assertEqual(self.evaluate(22), {})
+        self.delivery.refresh_from_db()
+        self.assertEqual(self.delivery.status, Delivery.Status.IN_TRANSIT)
+        self.assertEqual(
+            list(self.delivery.events.values_list('code', flat=True).order_by('id')),
+            [DeliveryEvent.Code.ARRIVED_PICKUP, DeliveryEvent.Code.PICKED_UP,
+             DeliveryEvent.Code.DWELL, DeliveryEvent.Code.ARRIVED_DROPOFF],
+        )
+
+    @override_settings(GEOFENCE_AUTO_PICKUP=False)
+    def test_overlapping_passes_write_one_arrival(self):
+        class Overlapping(GeofenceEvaluator):
+            def _reported(self):
+                return set()  # l'autre passage n'a pas encore validé son écriture
+
+        self.move(48.8502, 2.3501)
+        self.evaluate()
+        Overlapping().evaluate(self.now)
+        self.assertEqual(self.delivery.events.filter(code=DeliveryEvent.Code.ARRIVED_PICKUP).count(), 1)
+
+class WatchdogTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.customer = User.objects.create_user(username='client', password='x')
+        self.drivers = [
+            User.objects.create_user(username=f'rider{i}', password='x', role=User.Role.DRIVER) for i in range(3)
+        ]
+
+    def delivery(self, driver, status, minutes_ago):
+        at = self.now - timedelta(minutes=minutes_ago)
+        DriverPosition.objects.update_or_create(
+            driver=driver, defaults={'latitude': Decimal('48.85'), 'longitude': Decimal('2.35'), 'recorded_at': at}
+        )
+        return Delivery.objects.create(
+            order=Order.objects.create(customer=self.customer, total_price=Decimal('10.00')),
+            driver=driver, status=status, assigned_at=at, ready_at=at,
+        )
+
+    def test_stalled_deliveries_are_released_and_in_transit_ones_flagged(self):
+        late = self.delivery(self.drivers[0], Delivery.Status.READY_FOR_PICKUP, 30)
+        # Le livreur en retard émet toujours : il est retiré mais reste en ligne
+        DriverPosition.objects.filter(driver=self.drivers[0]).update(recorded_at=self.now)
+        fresh = self.delivery(self.drivers[1], Delivery.Status.PENDING, 2)
+        carried = self.delivery(self.drivers[2], Delivery.Status.IN_TRANSIT, 15)
+
+        counts = WatchdogService.run(self.now)
+        self.assertEqual(counts, {'pickup_timeout': 1, 'driver_silent': 0, 'in_transit_silent': 1})
+        late.refresh_from_db()
+        self.assertIsNone(late.driver_id)
+        self.assertEqual(late.status, Delivery.Status.READY_FOR_PICKUP)
+        self.assertTrue(late.events.filter(code=DeliveryEvent.Code.RELEASED).exists())
+        self.assertNotEqual(self.drivers[0].availability.state, DriverAvailability.State.OFFLINE)
+        fresh.refresh_from_db()
+        self.assertEqual(fresh.driver_id, self.drivers[1].pk)
+        self.assertEqual(carried.events.filter(code=DeliveryEvent.Code.STALLED).count(), 1)
+
+        # Rien de neuf : le livreur en transit n'est pas signalé une seconde fois
+        self.assertEqual(WatchdogService.run(self.now), {'pickup_timeout': 0, 'driver_silent': 0, 'in_transit_silent': 0})
+
+    def test_silent_driver_is_released_in_batches(self):
+        for _ in range(3):
+            self.delivery(self.drivers[0], Delivery.Status.PENDING, 15)
+        counts = WatchdogService.run(self.now, batch_size=2)
+        self.assertEqual(counts['driver_silent'], 3)
+        self.assertFalse(Delivery.objects.filter(driver=self.drivers[0]).exists())
+        self.assertEqual(DeliveryEvent.objects.filter(code=DeliveryEvent.Code.RELEASED).count(), 3)
+        self.assertEqual(DriverAvailability.objects.get(driver=self.drivers[0]).state, DriverAvailability.State.OFFLINE)
+
+class RoutePlannerTests(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user(username='client', password='x')
+
+    def delivery(self, pickup, dropoff):
+        return Delivery.objects.create(
+            order=Order.objects.create(customer=self.customer, total_price=Decimal('10.00')),
+            pickup_latitude=Decimal(pickup[0]), pickup_longitude=Decimal(pickup[1]),
+            dropoff_latitude=Decimal(dropoff[0]), dropoff_longitude=Decimal(dropoff[1]),
+        )
+
+    def test_two_opt_untangles_a_path(self):
+        points = [(0, 0), (0, 0.03), (0, 0.01), (0, 0.04), (0, 0.02)]
+        dist = GoogleMapsService.distance_matrix(points, points)
+        self.assertEqual(two_opt(dist, [0, 1, 2, 3, 4]), [0, 2, 4, 1, 3])
+
+    def test_nearby_deliveries_share_a_route(self):
+        shop = ('48.850000', '2.350000')
+        first = self.delivery(shop, ('48.860000', '2.350000'))
+        second = self.delivery(shop, ('48.855000', '2.351000'))
+        alone = self.delivery(('48.900000', '2.450000'), ('48.700000', '2.300000'))
+
+        routes = RoutePlanner.plan()
+        self.assertEqual(len(routes), 1)
+        stops = list(routes[0].stops.values_list('kind', 'delivery'))
+        self.assertEqual(stops, [
+            (RouteStop.Kind.PICKUP, first.id), (RouteStop.Kind.PICKUP, second.id),
+            (RouteStop.Kind.DROPOFF, second.id), (RouteStop.Kind.DROPOFF, first.id),
+        ])
+        self.assertEqual(RoutePlanner.plan(), [])
+
+        driver = User.objects.create_user(username='rider', password='x', role=User.Role.DRIVER)
+        RoutePlanner.assign(routes[0].id, driver)
+        self.assertEqual(set(Delivery.objects.filter(driver=driver)), {first, second})
+        self.assertFalse(alone.route_stops.exists())
+
+    def test_planned_routes_are_dispatched_whole(self):
+        drivers.reset()
+        shop = ('48.850000', '2.350000')
+        first = self.delivery(shop, ('48.860000', '2.350000'))
+        second = self.delivery(shop, ('48.855000', '2.351000'))
+        [route] = RoutePlanner.plan()
+        User.objects.create_user(
+            username='rider', password='x', role=User.Role.DRIVER, latitude=Decimal('48.85'), longitude=Decimal('2.35')
+        )
+
+        self.assertEqual(DispatchService.batch_assign(), 0)
+        self.assertEqual(DispatchService.dispatch_sharded(workers=1), 2)
+        route.refresh_from_db()
+        self.assertEqual(route.status, DeliveryRoute.Status.ASSIGNED)
+        self.assertEqual(set(Delivery.objects.filter(driver=route.driver)), {first, second})
+
+@override_settings(LOCATION_FLUSH_INTERVAL_MS=0)
+class LocationIngestionTests(TestCase):
+    def setUp(self):
+        self.driver = User.objects.create_user(username='rider', password='x', role=User.Role.DRIVER)
+        customer = User.objects.create_user(username='client', password='x')
+        self.delivery = Delivery.objects.create(
+            order=Order.objects.create(customer=customer, total_price=Decimal('10.00')),
+            driver=self.driver, status=Delivery.Status.IN_TRANSIT,
+        )
+
+    def test_batched_upload_appends_history_and_keeps_latest_position(self):
+        self.client.force_login(self.driver)
+        pings = [
+            {'lat': 48.85, 'lng': 2.35, 'ts': '2026-01-01T10:00:05Z', 'delivery': self.delivery.id},
+            {'lat': 48.86, 'lng': 2.36, 'ts': '2026-01-01T10:00:10Z', 'delivery': self.delivery.id},
+            {'lat': 48.84, 'lng': 2.34, 'ts': '2026-01-01T10:00:00Z'},
+        ]
+        response = self.client.post(
+            reverse('delivery:locations_api'), json.dumps({'pings': pings}), content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(DriverLocation.objects.filter(driver=self.driver).count(), 3)
+        position = DriverPosition.objects.get(driver=self.driver)
+        self.assertEqual((position.latitude, position.longitude, position.delivery_id), (48.86, 2.36, self.delivery.id))
+
+        response = self.client.post(
+            reverse('delivery:locations_api'), json.dumps([{'lat': 120, 'lng': 2}]), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_delivery_location_update_lands_in_driver_position(self):
+        DeliveryService.update_driver_location(self.delivery.id, 48.87, 2.37)
+
+        self.assertEqual(DriverPosition.objects.get(driver=self.driver).latitude, 48.87)
+
+class TrailCompactionTests(TestCase):
+    def test_polyline_round_trip(self):
+        points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+        self.assertEqual(encode_polyline(points), '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        self.assertEqual(decode_polyline('_p~iF~ps|U_ulLnnqC_mqNvxq`@'), points)
+
+    @override_settings(TRAIL_COMPACT_DELAY_SECONDS=0)
+    def test_finished_trail_is_simplified_then_raw_points_purged(self):
+        driver = User.objects.create_user(username='rider', password='x', role=User.Role.DRIVER)
+        customer = User.objects.create_user(username='client', password='x')
+        delivery = Delivery.objects.create(
+            order=Order.objects.create(customer=customer, total_price=Decimal('10.00')),
+            driver=driver, status=Delivery.Status.DELIVERED,
+        )
+        # Un angle droit : 20 points vers l'est puis 20 vers le nord, avec un bruit de ~1 m
+        rng = np.random.default_rng(0)
+        legs = [(48.85, 2.35 + i * 0.0005) for i in range(21)] + [(48.85 + i * 0.0005, 2.36) for i in range(1, 21)]
+        old = timezone.now() - timedelta(days=30)
+        DriverLocation.objects.bulk_create([
+            DriverLocation(
+                driver=driver, delivery=delivery, latitude=lat + rng.normal(0, 1e-5), longitude=lng,
+                recorded_at=old + timedelta(seconds=i)
+            )
+            for i, (lat, lng) in enumerate(legs)
+        ])
+
+        self.assertEqual(TrailService.compact_finished(), 1)
+        delivery.refresh_from_db()
+        self.assertEqual(len(decode_polyline(delivery.route_polyline)), 3)
+        self.assertAlmostEqual(float(delivery.route_distance_km), 1.84, delta=0.05)
+
+        self.assertEqual(TrailService.purge(retention_days=7), 41)
+        self.client.force_login(customer)
+        response = self.client.get(reverse('delivery:route_api', args=[delivery.id]))
+        self.assertEqual(len(response.json()['points']), 3)
+
+class EtaTests(TestCase):
+    def setUp(self):
+        EtaService.clear_cache()
+        self.customer = User.objects.create_user(username='client', password='x')
+        self.pickup = (Decimal('48.850000'), Decimal('2.350000'))
+
+    def delivery(self, **fields):
+        return Delivery.objects.create(
+            order=Order.objects.create(customer=self.customer, total_price=Decimal('10.00')),
+            pickup_latitude=self.pickup[0], pickup_longitude=self.pickup[1],
+            dropoff_latitude=Decimal('48.900000'), dropoff_longitude=Decimal('2.350000'),
+            **fields
+        )
+
+    @override_settings(ETA_MIN_SAMPLES=3)
+    def test_profiles_learned_from_history_drive_the_estimate(self):
+        start = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=1)
+        for _ in range(3):
+            self.delivery(
+                status=Delivery.Status.DELIVERED, route_distance_km=Decimal('10.00'),
+                picked_up_at=start, delivered_at=start + timedelta(minutes=20),
+            )
+        self.assertEqual(EtaService.rebuild_profiles(), 2)
+        zone = zone_for(*self.pickup)
+        hour = timezone.localtime(start).hour
+        self.assertAlmostEqual(SpeedProfile.objects.get(zone=zone, hour=hour).speed_kmh, 30.0)
+
+        in_transit = self.delivery(status=Delivery.Status.IN_TRANSIT)
+        at = start + timedelta(days=1)
+        eta = EtaService.estimate(in_transit, at=at)
+        expected_km = haversine_km(48.85, 2.35, 48.9, 2.35) * 1.3
+        self.assertAlmostEqual((eta - at).total_seconds() / 60, expected_km / 30 * 60, places=3)
+
+    @override_settings(LOCATION_FLUSH_INTERVAL_MS=0)
+    def test_each_location_flush_refreshes_the_eta(self):
+        driver = User.objects.create_user(username='rider', password='x', role=User.Role.DRIVER)
+        delivery = self.delivery(status=Delivery.Status.READY_FOR_PICKUP, driver=driver)
+        delivery = DeliveryService.pickup_package(delivery.id)
+        self.assertIsNotNone(delivery.estimated_delivery_time)
+
+        DeliveryService.update_driver_location(delivery.id, 48.899, 2.35)
+        position = DriverPosition.objects.get(driver=driver)
+        self.assertLess(position.estimated_arrival, delivery.estimated_delivery_time)
+
+@override_settings(LOCATION_FLUSH_INTERVAL_MS=0)
+class TrackingTests(TestCase):
+    def setUp(self):
+        tracking_cache().clear()
+        self.driver = User.objects.create_user(username='rider', password='x', role=User.Role.DRIVER)
+        self.customer = User.objects.create_user(username='client', password='x')
+        self.delivery = Delivery.objects.create(
+            order=Order.objects.create(customer=self.customer, total_price=Decimal('10.00')),
+            driver=self.driver, status=Delivery.Status.IN_TRANSIT,
+            dropoff_latitude=Decimal('48.900000'), dropoff_longitude=Decimal('2.350000'),
+        )
+        self.url = reverse('delivery:tracking_api', args=[self.delivery.id])
+
+    def test_unchanged_poll_is_served_from_cache_with_304(self):
+        self.client.force_login(self.customer)
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+
+        loads = metrics.counter('tracking_state_loads')
+        second = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(metrics.counter('tracking_state_loads'), loads)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            DeliveryService.update_driver_location(self.delivery.id, 48.88, 2.35)
+        moved = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(moved.status_code, 200)
+        self.assertEqual((moved.json()['lat'], moved.json()['lng']), (48.88, 2.35))
+        self.assertIsNotNone(moved.json()['eta'])
+        self.assertEqual(metrics.counter('tracking_state_loads'), loads)
+
+        self.client.force_login(User.objects.create_user(username='other', password='x'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    async def test_stream_emits_state_and_ends_when_delivered(self):
+        await Delivery.objects.filter(id=self.delivery.id).aupdate(status=Delivery.Status.DELIVERED)
+        await self.async_client.aforce_login(self.customer)
+        response = await self.async_client.get(reverse('delivery:tracking_stream', args=[self.delivery.id]))
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(body.count('event: tracking'), 1)
+        self.assertIn('"status": "DELIVERED"', body)
+
+    @override_settings(TRACKING_SSE_POLL_SECONDS=3600)
+    def test_hub_reads_shared_state_once_per_poll_for_all_streams(self):
+        other = Delivery.objects.create(
+            order=self.delivery.order, driver=self.driver, status=Delivery.Status.IN_TRANSIT,
+            dropoff_latitude=Decimal('48.900000'), dropoff_longitude=Decimal('2.350000'),
+        )
+        TrackingService.get(self.delivery.id)
+        TrackingService.get(other.id)
+        hub, loop = TrackingHub(), asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        async def subscribe(delivery_id):
+            return hub.subscribe(delivery_id)
+
+        streams = [loop.run_until_complete(subscribe(delivery_id)) for delivery_id in (self.delivery.id, self.delivery.id, other.id)]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertCountEqual(hub.poll(), [self.delivery.id, other.id])
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(hub.poll(), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            TrackingService.invalidate(other.id)
+        for _, event in streams:
+            event.clear()
+        changed = hub.poll()
+        self.assertEqual(changed, [other.id])
+        hub.notify(changed)
+        loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual([event.is_set() for _, event in streams], [False, False, True])
+
+    def test_tracking_state_lives_in_a_shared_cache(self):
+        self.assertEqual(check_tracking_cache(None), [])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual([warning.id for warning in check_tracking_cache(None)], ['delivery.W001'])
+
+class DispatchSimulatorTests(TestCase):
+    def tearDown(self):
+        drivers.reset()
+
+    def test_every_simulated_order_is_delivered(self):
+        simulator = DispatchSimulator(drivers=6, merchants=3, customers=20, orders_per_hour=60, minutes=20, seed=1)
+        simulator.setup()
+        report = simulator.run()
+
+        self.assertGreater(report['deliveries_created'], 0)
+        self.assertEqual(report['deliveries_completed'], report['deliveries_created'])
+        self.assertEqual(Delivery.objects.exclude(status=Delivery.Status.DELIVERED).count(), 0)
+        self.assertEqual(Order.objects.filter(status=Order.Status.DELIVERED).count(), report['deliveries_created'])
+        self.assertGreater(report['deadhead_km'], 0)
+        self.assertIsNotNone(report['assignment_latency_minutes']['p90'])
@@ -0,0 +1,232 @@
+"""
+État de suivi des livraisons pour les clients.
+
+Un état compact par livraison (statut, position, ETA, horodatage de mise à jour) est
+gardé dans le cache TRACKING_CACHE_ALIAS ('tracking'), partagé entre les processus
+(Redis en production via REDIS_URL, table de cache en base à défaut) : une position
+ingérée ou une invalidation dans un worker est vue par tous les autres. Le chemin
+d'ingestion des positions met l'état à jour et réveille les flux SSE abonnés du
+processus ; pour ceux des autres processus, chaque processus fait un seul relevé
+groupé des livraisons suivies toutes les TRACKING_SSE_POLL_SECONDS. Un changement de
+statut l'invalide. Les requêtes de suivi ne lisent la base qu'en cas d'absence dans
+le cache.
+"""
+import asyncio
+from datetime import datetime, timezone as dt_timezone
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.db import close_old_connections, transaction
+
+from core.metrics import metrics
+from .models import Delivery, DriverPosition
+
+logger = logging.getLogger(__name__)
+
+# Backends propres à un processus : l'état n'y serait pas partagé entre les workers
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+def _key(delivery_id):
+    return f'delivery:tracking:{delivery_id}'
+
+def _alias():
+    alias = getattr(settings, 'TRACKING_CACHE_ALIAS', 'tracking')
+    return alias if alias in settings.CACHES else 'default'
+
+def tracking_cache():
+    return caches[_alias()]
+
+@checks.register(checks.Tags.caches)
+def check_tracking_cache(app_configs, **kwargs):
+    """Le suivi en direct suppose un cache partagé entre les processus."""
+    backend = settings.CACHES[_alias()]['BACKEND']
+    if backend in PROCESS_LOCAL_BACKENDS:
+        return [checks.Warning(
+            f"Le cache de suivi '{_alias()}' ({backend}) est propre à chaque processus.",
+            hint="Configurez TRACKING_CACHE_ALIAS vers un cache partagé (base de données, Redis, Memcached) "
+                 "ou servez le suivi depuis un seul processus.",
+            id='delivery.W001',
+        )]
+    return []
+
+class TrackingHub:
+    """
+    Abonnements en mémoire des flux SSE du processus : `notify` (appelable depuis
+    n'importe quel thread) réveille les boucles asyncio en attente sur la livraison.
+    Les changements venus d'un autre processus sont détectés par un seul relevé groupé
+    de l'état partagé (`get_many`) toutes les TRACKING_SSE_POLL_SECONDS, quel que soit
+    le nombre de flux ouverts : les flux eux-mêmes ne lisent l'état qu'une fois réveillés.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._seen = {}
+        self._poller = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, delivery_id):
+        event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._subscribers.setdefault(delivery_id, set()).add((loop, event))
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll_forever, name='tracking-poller', daemon=True)
+                self._poller.start()
+        return loop, event
+
+    def unsubscribe(self, delivery_id, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(delivery_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[delivery_id]
+                    self._seen.pop(delivery_id, None)
+
+    def notify(self, delivery_ids):
+        with self._lock:
+            targets = [sub for delivery_id in delivery_ids for sub in self._subscribers.get(delivery_id, ())]
+        for loop, event in targets:
+            loop.call_soon_threadsafe(event.set)
+
+    def poll(self):
+        """Un relevé groupé de l'état partagé ; retourne les livraisons suivies dont l'état a changé."""
+        with self._lock:
+            delivery_ids = list(self._subscribers)
+        if not delivery_ids:
+            return []
+        states = tracking_cache().get_many([_key(delivery_id) for delivery_id in delivery_ids])
+        metrics.inc('tracking_polls')
+        changed = []
+        with self._lock:
+            for delivery_id in delivery_ids:
+                state = states.get(_key(delivery_id))
+                # Un état absent (invalidé) réveille aussi les flux : ils le rechargeront
+                marker = (state['status'], state['updated']) if state else None
+                if delivery_id not in self._seen or self._seen[delivery_id] != marker:
+                    self._seen[delivery_id] = marker
+                    changed.append(delivery_id)
+        return changed
+
+    def _poll_forever(self):
+        while True:
+            time.sleep(getattr(settings, 'TRACKING_SSE_POLL_SECONDS', 1))
+            with self._lock:
+                if not self._subscribers:
+                    self._poller = None
+                    return
+            try:
+                changed = self.poll()
+            except Exception:
+                logger.exception("Échec du relevé de l'état de suivi partagé")
+                continue
+            finally:
+                close_old_connections()
+            if changed:
+                self.notify(changed)
+
+hub = TrackingHub()
+
+class TrackingService:
+    """
+    Lecture et diffusion de l'état de suivi.
+    """
+
+    @staticmethod
+    def _ttl():
+        return getattr(settings, 'TRACKING_CACHE_SECONDS', 300)
+
+    @staticmethod
+    def load(delivery_id):
+        """Construit l'état depuis la base (livraison + dernière position du livreur)."""
+        delivery = (
+            Delivery.objects.select_related('order')
+            .only('id', 'status', 'driver_id', 'order__customer_id', 'estimated_delivery_time',
+                  'assigned_at', 'ready_at', 'picked_up_at', 'delivered_at')
+            .filter(id=delivery_id).first()
+        )
+        if delivery is None:
+            return None
+        position = None
+        if delivery.driver_id and delivery.status in (Delivery.Status.PICKED_UP, Delivery.Status.IN_TRANSIT):
+            position = DriverPosition.objects.filter(driver_id=delivery.driver_id, delivery_id=delivery_id).first()
+
+        moments = [
+            moment for moment in (
+                delivery.assigned_at, delivery.ready_at, delivery.picked_up_at, delivery.delivered_at,
+                position.recorded_at if position else None,
+            ) if moment
+        ]
+        eta = (position.estimated_arrival if position and position.estimated_arrival else delivery.estimated_delivery_time)
+        state = {
+            'delivery': delivery.id,
+            'status': delivery.status,
+            'customer_id': delivery.order.customer_id,
+            'driver_id': delivery.driver_id,
+            'lat': position.latitude if position else None,
+            'lng': position.longitude if position else None,
+            'eta': eta.isoformat() if eta else None,
+            'updated': max(moments).timestamp() if moments else 0,
+        }
+        tracking_cache().set(_key(delivery_id), state, TrackingService._ttl())
+        metrics.inc('tracking_state_loads')
+        return state
+
+    @staticmethod
+    def get(delivery_id):
+        state = tracking_cache().get(_key(delivery_id))
+        if state is None:
+            return TrackingService.load(delivery_id)
+        metrics.inc('tracking_cache_hits')
+        return state
+
+    @staticmethod
+    def etag(state):
+        return f'"{state["delivery"]}-{state["status"]}-{int(state["updated"] * 1000)}"'
+
+    @staticmethod
+    def public(state):
+        """Représentation renvoyée au client (sans les champs d'autorisation)."""
+        updated = datetime.fromtimestamp(state['updated'], tz=dt_timezone.utc) if state['updated'] else None
+        return {
+            'delivery': state['delivery'],
+            'status': state['status'],
+            'lat': state['lat'],
+            'lng': state['lng'],
+            'eta': state['eta'],
+            'last_location_update': updated.isoformat() if updated else None,
+        }
+
+    @staticmethod
+    def publish_positions(positions):
+        """
+        Applique un lot de positions ({delivery_id: (lat, lng, recorded_at, eta)}) aux états
+        déjà en cache et réveille les abonnés SSE. Les états absents seront chargés à la demande.
+        """
+        cache = tracking_cache()
+        states = cache.get_many([_key(delivery_id) for delivery_id in positions])
+        updated = {}
+        for delivery_id, (lat, lng, recorded_at, eta) in positions.items():
+            state = states.get(_key(delivery_id))
+            if state is None or recorded_at.timestamp() <= state['updated']:
+                continue
+            state.update(lat=lat, lng=lng, eta=eta.isoformat() if eta else state['eta'], updated=recorded_at.timestamp())
+            updated[_key(delivery_id)] = state
+        if updated:
+            cache.set_many(updated, TrackingService._ttl())
+        hub.notify(list(positions))
+
+    @staticmethod
+    def invalidate(*delivery_ids):
+        """Après un changement de statut (au commit) : l'état sera rechargé depuis la base."""
+        def apply():
+            tracking_cache().delete_many([_key(delivery_id) for delivery_id in delivery_ids])
+            hub.notify(delivery_ids)
+        transaction.on_commit(apply)
@@ -0,0 +1,172 @@
+"""
+Compaction et rétention des traces GPS.
+
+Une fois la livraison terminée, sa trace brute (`DriverLocation`) est simplifiée
+par Douglas–Peucker (tolérance TRAIL_TOLERANCE_METERS) et stockée sur la livraison
+sous forme de polyline encodée, avec la distance parcourue calculée sur la trace
+complète. Les points bruts plus anciens que LOCATION_RETENTION_DAYS sont ensuite
+supprimés, sauf ceux des livraisons pas encore compactées.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from core.metrics import metrics
+from .distance import EARTH_RADIUS_KM, haversine_pairs
+from .models import Delivery, DriverLocation
+
+FINISHED_STATUSES = (Delivery.Status.DELIVERED, Delivery.Status.CANCELLED, Delivery.Status.FAILED)
+
+def douglas_peucker(points, tolerance_m):
+    """
+    Indices des points conservés d'une trace (N, 2) en degrés : les écarts à la
+    trace simplifiée restent inférieurs à `tolerance_m` mètres.
+    Version itérative ; les distances d'un segment sont calculées en un seul calcul
+    vectorisé, dans une projection équirectangulaire locale.
+    """
+    points = np.asarray(points, dtype=float)
+    n = len(points)
+    if n <= 2:
+        return np.arange(n)
+
+    meters_per_degree = np.pi * EARTH_RADIUS_KM * 1000 / 180
+    cos_lat = np.cos(np.radians(points[:, 0].mean()))
+    xy = np.column_stack([points[:, 1] * cos_lat, points[:, 0]]) * meters_per_degree
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = xy[end] - xy[start]
+        inner = xy[start + 1:end] - xy[start]
+        length = np.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(inner[:, 0], inner[:, 1])
+        else:
+            distances = np.abs(segment[0] * inner[:, 1] - segment[1] * inner[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance_m:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return np.nonzero(keep)[0]
+
+def _encode_value(value):
+    value = ~(value << 1) if value < 0 else value << 1
+    chunks = []
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+    return ''.join(chunks)
+
+def encode_polyline(points, precision=5):
+    """Encode une suite de (lat, lng) au format polyline de Google."""
+    factor = 10 ** precision
+    result = []
+    previous_lat = previous_lng = 0
+    for lat, lng in points:
+        lat, lng = int(round(lat * factor)), int(round(lng * factor))
+        result.append(_encode_value(lat - previous_lat))
+        result.append(_encode_value(lng - previous_lng))
+        previous_lat, previous_lng = lat, lng
+    return ''.join(result)
+
+def decode_polyline(encoded, precision=5):
+    """Décode une polyline en liste de (lat, lng)."""
+    factor = 10 ** precision
+    points = []
+    index = lat = lng = 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        points.append((lat / factor, lng / factor))
+    return points
+
+def trail_length_km(points):
+    """Longueur (km) d'une trace (N, 2) en degrés."""
+    points = np.asarray(points, dtype=float)
+    if len(points) < 2:
+        return 0.0
+    return float(haversine_pairs(points[:-1], points[1:]).sum())
+
+class TrailService:
+    """
+    Compaction des traces des livraisons terminées et purge de l'historique brut.
+    """
+
+    @staticmethod
+    def compact(delivery, tolerance_m=None):
+        """Simplifie et enregistre la trace d'une livraison. Retourne le nombre de points conservés."""
+        tolerance_m = tolerance_m if tolerance_m is not None else getattr(settings, 'TRAIL_TOLERANCE_METERS', 10)
+        raw = np.array(
+            DriverLocation.objects.filter(delivery=delivery)
+            .order_by('recorded_at', 'id')
+            .values_list('latitude', 'longitude'),
+            dtype=float,
+        ).reshape(-1, 2)
+
+        kept = raw[douglas_peucker(raw, tolerance_m)] if len(raw) else raw
+        Delivery.objects.filter(pk=delivery.pk).update(
+            route_polyline=encode_polyline(kept),
+            route_distance_km=round(trail_length_km(raw), 2),
+            trail_compacted_at=timezone.now(),
+        )
+        metrics.inc('trail_points_raw', len(raw))
+        metrics.inc('trail_points_kept', len(kept))
+        return len(kept)
+
+    @staticmethod
+    def compact_finished(tolerance_m=None, batch_size=500):
+        """Compacte les traces des livraisons terminées qui ne l'ont pas encore été."""
+        # Laisse au tampon d'ingestion le temps d'écrire les dernières positions
+        settled = timezone.now() - timedelta(seconds=getattr(settings, 'TRAIL_COMPACT_DELAY_SECONDS', 60))
+        pending = Delivery.objects.filter(
+            Q(delivered_at__isnull=True) | Q(delivered_at__lt=settled),
+            status__in=FINISHED_STATUSES, trail_compacted_at__isnull=True,
+        ).only('id').order_by('id')
+
+        compacted = 0
+        while True:
+            batch = list(pending[:batch_size])
+            for delivery in batch:
+                TrailService.compact(delivery, tolerance_m)
+            compacted += len(batch)
+            if len(batch) < batch_size:
+                return compacted
+
+    @staticmethod
+    def purge(retention_days=None, batch_size=10000):
+        """
+        Supprime les points bruts plus anciens que la rétention, par lots.
+        Les points d'une livraison non encore compactée sont conservés.
+        """
+        retention_days = retention_days if retention_days is not None else getattr(settings, 'LOCATION_RETENTION_DAYS', 7)
+        cutoff = timezone.now() - timedelta(days=retention_days)
+        expired = DriverLocation.objects.filter(recorded_at__lt=cutoff).filter(
+            Q(delivery__isnull=True) | Q(delivery__trail_compacted_at__isnull=False)
+        )
+        deleted = 0
+        while True:
+            ids = list(expired.values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            deleted += DriverLocation.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,13 @@
+from django.urls import path
+from . import views
+
+app_name = 'delivery'
+
+urlpatterns = [
+    path('api/locations/', views.driver_locations_api, name='locations_api'),
+    path('api/quotes/', views.delivery_quotes_api, name='quotes_api'),
+    path('api/availability/', views.driver_availability_api, name='availability_api'),
+    path('api/<int:delivery_id>/route/', views.delivery_route_api, name='route_api'),
+    path('api/<int:delivery_id>/tracking/', views.delivery_tracking_api, name='tracking_api'),
+    path('api/<int:delivery_id>/tracking/stream/', views.delivery_tracking_stream, name='tracking_stream'),
+]
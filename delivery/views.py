@@ -1,3 +1,205 @@
-from django.shortcuts import render
+import asyncio
+import json
 
-# Create your views here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import ValidationError
+from django.http import JsonResponse, Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.views.decorators.http import require_GET, require_POST
+from users.models import User
+from .availability import AvailabilityService
+from .fees import FeeService
+from .locations import LocationService
+from .models import Delivery
+from .tracking import TrackingService, hub
+from .trails import decode_polyline
+
+@login_required
+@require_POST
+def driver_locations_api(request):
+    """
+    Réception des positions GPS d'un livreur, une ou plusieurs par requête :
+    {"pings": [{"lat": .., "lng": .., "ts": .., "delivery": ..}, ...]}.
+    """
+    if request.user.role != User.Role.DRIVER:
+        return JsonResponse({'error': "Réservé aux livreurs."}, status=403)
+
+    try:
+        payload = json.loads(request.body)
+        pings = payload['pings'] if isinstance(payload, dict) and 'pings' in payload else payload
+        if not isinstance(pings, (list, dict)):
+            raise ValidationError("Format de positions invalide.")
+        accepted = LocationService.ingest(request.user, pings)
+    except (ValueError, KeyError):
+        return JsonResponse({'error': "Corps JSON invalide."}, status=400)
+    except ValidationError as exc:
+        return JsonResponse({'error': exc.messages[0]}, status=400)
+
+    return JsonResponse({'accepted': accepted}, status=202)
+
+@login_required
+@require_POST
+def driver_availability_api(request):
+    """
+    Passage en ligne, hors ligne ou en pause d'un livreur : {"state": "IDLE" | "OFFLINE" | "ON_BREAK"}.
+    """
+    if request.user.role != User.Role.DRIVER:
+        return JsonResponse({'error': "Réservé aux livreurs."}, status=403)
+
+    try:
+        availability = AvailabilityService.set_state(request.user, json.loads(request.body).get('state'))
+    except (ValueError, AttributeError):
+        return JsonResponse({'error': "Corps JSON invalide."}, status=400)
+    except ValidationError as exc:
+        return JsonResponse({'error': exc.messages[0]}, status=400)
+
+    return JsonResponse({
+        'state': availability.state,
+        'current_load': availability.current_load,
+        'capacity': availability.capacity,
+    })
+
+@login_required
+@require_GET
+def delivery_quotes_api(request):
+    """
+    Devis de livraison vers l'adresse du client, pour les boutiques données
+    (?merchant=<id>, répétable) ou, à défaut, celles du panier, avec le jeton signé
+    à renvoyer à la validation de la commande.
+    """
+    from catalog.models import Product
+    from merchants.models import MerchantProfile
+    from orders.cart import Cart
+
+    if not request.user.address:
+        return JsonResponse({'error': "Renseignez une adresse de livraison."}, status=400)
+    try:
+        merchant_ids = [int(value) for value in request.GET.getlist('merchant')]
+    except ValueError:
+        return JsonResponse({'error': "Boutique invalide."}, status=400)
+
+    if merchant_ids:
+        found = MerchantProfile.objects.in_bulk(merchant_ids)
+        merchants = [found[merchant_id] for merchant_id in dict.fromkeys(merchant_ids) if merchant_id in found]
+    else:
+        products = Product.objects.filter(id__in=Cart(request).product_ids()).select_related('merchant')
+        merchants = FeeService.merchants_of(products)
+
+    try:
+        quotes = FeeService.quote_many(request.user, merchants)
+    except ValidationError as exc:
+        return JsonResponse({'error': exc.messages[0]}, status=400)
+    return JsonResponse({
+        'quotes': [
+            {
+                'merchant': quote['merchant'],
+                'fee': str(quote['fee']),
+                'base_fee': str(quote['base_fee']),
+                'surge_multiplier': str(quote['surge_multiplier']),
+                'quoted_at': quote['quoted_at'].isoformat(),
+            }
+            for quote in quotes
+        ],
+        'total': str(sum((quote['fee'] for quote in quotes), 0)),
+        'token': FeeService.sign(request.user, quotes),
+    })
+
+def _visible_delivery(request, delivery_id):
+    """Livraison visible par le client de la commande, son livreur ou l'équipe."""
+    delivery = get_object_or_404(Delivery.objects.select_related('order'), id=delivery_id)
+    if not (request.user.is_staff or request.user.id in (delivery.order.customer_id, delivery.driver_id)):
+        raise Http404
+    return delivery
+
+@login_required
+def delivery_route_api(request, delivery_id):
+    """
+    Trajet effectué d'une livraison terminée (trace compactée) et distance parcourue.
+    """
+    delivery = _visible_delivery(request, delivery_id)
+    return JsonResponse({
+        'delivery': delivery.id,
+        'distance_km': float(delivery.route_distance_km) if delivery.route_distance_km is not None else None,
+        'polyline': delivery.route_polyline,
+        'points': decode_polyline(delivery.route_polyline),
+    })
+
+# Au-delà de ces statuts, le flux de suivi se termine
+_FINAL_STATUSES = (Delivery.Status.DELIVERED, Delivery.Status.CANCELLED, Delivery.Status.FAILED)
+
+def _can_track(user, state):
+    return state is not None and (user.is_staff or user.id in (state['customer_id'], state['driver_id']))
+
+@login_required
+def delivery_tracking_api(request, delivery_id):
+    """
+    Suivi en direct : statut, position et ETA au format JSON compact.
+    Servi depuis le cache de suivi ; ETag/Last-Modified permettent de répondre 304
+    aux interrogations sans changement.
+    """
+    state = TrackingService.get(delivery_id)
+    if not _can_track(request.user, state):
+        raise Http404
+
+    etag = TrackingService.etag(state)
+    last_modified = int(state['updated']) or None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = JsonResponse(TrackingService.public(state))
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+async def delivery_tracking_stream(request, delivery_id):
+    """
+    Suivi en direct par Server-Sent Events (à servir sous ASGI) : un événement à chaque
+    nouvelle position ou changement de statut, un commentaire de maintien sinon.
+    Réveillé aussitôt par les changements du processus, au relevé groupé suivant du
+    hub pour ceux des autres workers ; aucune lecture de l'état entre deux réveils.
+    """
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'error': "Authentification requise."}, status=401)
+    state = await sync_to_async(TrackingService.get)(delivery_id)
+    if not _can_track(user, state):
+        raise Http404
+
+    keepalive = getattr(settings, 'TRACKING_SSE_KEEPALIVE_SECONDS', 15)
+
+    async def events():
+        subscription = hub.subscribe(delivery_id)
+        _, event = subscription
+        last_etag = None
+        try:
+            while True:
+                current = await sync_to_async(TrackingService.get)(delivery_id)
+                if current is None:
+                    return
+                etag = TrackingService.etag(current)
+                if etag != last_etag:
+                    last_etag = etag
+                    payload = json.dumps(TrackingService.public(current))
+                    yield f"event: tracking\nid: {etag[1:-1]}\ndata: {payload}\n\n"
+                if current['status'] in _FINAL_STATUSES:
+                    return
+                # L'état n'est relu qu'au réveil (ce processus ou relevé groupé du hub)
+                while True:
+                    try:
+                        await asyncio.wait_for(event.wait(), timeout=keepalive)
+                        break
+                    except asyncio.TimeoutError:
+                        yield ": keep-alive\n\n"
+                event.clear()
+        finally:
+            hub.unsubscribe(delivery_id, subscription)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,127 @@
+"""
+Surveillance des livraisons bloquées.
+
+Un passage (`manage.py watch_deliveries`) repère par lots, sur les index
+(statut, affectation) des livraisons et (horodatage) des dernières positions,
+les livraisons :
+- prêtes et affectées depuis plus de WATCHDOG_PICKUP_MINUTES sans ramassage ;
+- affectées à un livreur dont la dernière position date de plus de
+  WATCHDOG_SILENCE_MINUTES.
+Leur livreur est retiré (et mis hors ligne s'il est silencieux et n'a plus rien en
+cours) : elles
+quittent leur tournée éventuelle et repartent dans le dispatch groupé. Une livraison en transit dont le livreur ne
+donne plus signe de vie ne peut pas être réaffectée (il a le colis) : elle est
+signalée une fois dans l'historique.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from core.metrics import metrics
+from core.transactions import transactional_retry
+from .availability import AvailabilityService
+from .events import DeliveryEventService
+from .dispatch import ROUTED_STATUSES
+from .models import Delivery, DeliveryEvent, DriverAvailability, RouteStop
+from .tracking import TrackingService
+
+ASSIGNED_STATUSES = (Delivery.Status.PENDING, Delivery.Status.READY_FOR_PICKUP)
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+class WatchdogService:
+    """
+    Détection et libération des livraisons bloquées.
+    """
+
+    @staticmethod
+    def stalled_pickups(now):
+        cutoff = now - timedelta(minutes=_setting('WATCHDOG_PICKUP_MINUTES', 20))
+        return Delivery.objects.filter(
+            status=Delivery.Status.READY_FOR_PICKUP, assigned_at__lt=cutoff, ready_at__lt=cutoff, driver__isnull=False
+        )
+
+    @staticmethod
+    def silent_drivers(now):
+        """Livraisons pas encore ramassées dont le livreur (déjà suivi par GPS) n'émet plus."""
+        cutoff = now - timedelta(minutes=_setting('WATCHDOG_SILENCE_MINUTES', 10))
+        return Delivery.objects.filter(
+            status__in=ASSIGNED_STATUSES, assigned_at__lt=cutoff, driver__position__recorded_at__lt=cutoff
+        )
+
+    @staticmethod
+    def silent_in_transit(now):
+        """Livraisons en transit sans position récente, pas encore signalées depuis la dernière position."""
+        cutoff = now - timedelta(minutes=_setting('WATCHDOG_SILENCE_MINUTES', 10))
+        reported = DeliveryEvent.objects.filter(
+            delivery=OuterRef('pk'), code=DeliveryEvent.Code.STALLED, at__gte=OuterRef('driver__position__recorded_at')
+        )
+        return Delivery.objects.filter(
+            status=Delivery.Status.IN_TRANSIT, driver__position__recorded_at__lt=cutoff
+        ).exclude(Exists(reported))
+
+    @staticmethod
+    @transactional_retry
+    def release(queryset, reason, now, batch_size):
+        """
+        Retire le livreur d'au plus `batch_size` livraisons du queryset (une mise à jour
+        conditionnelle, un insert d'événements). Seul un livreur silencieux
+        (`driver_silent`) sans autre course est mis hors ligne : celui qui tarde à
+        ramasser mais émet toujours reste disponible. Retourne le nombre de livraisons libérées.
+        """
+        rows = list(
+            queryset.select_for_update(skip_locked=True, of=('self',)).order_by('assigned_at')
+            .values_list('id', 'driver_id')[:batch_size]
+        )
+        if not rows:
+            return 0
+        ids = [delivery_id for delivery_id, _ in rows]
+        driver_ids = {driver_id for _, driver_id in rows}
+        Delivery.objects.filter(id__in=ids, status__in=ASSIGNED_STATUSES).update(
+            driver=None, assigned_at=None, estimated_delivery_time=None
+        )
+        # Sorties de leur tournée, sinon le dispatch groupé ne les reprendrait jamais
+        RouteStop.objects.filter(delivery_id__in=ids, route__status__in=ROUTED_STATUSES).delete()
+        DeliveryEventService.record_many([
+            DeliveryEventService.build(delivery_id, DeliveryEvent.Code.RELEASED, at=now, actor=None,
+                                       note=f'{reason} (livreur #{driver_id})')
+            for delivery_id, driver_id in rows
+        ])
+
+        AvailabilityService.refresh_many(driver_ids)
+        if reason == 'driver_silent':
+            DriverAvailability.objects.filter(driver_id__in=driver_ids, current_load=0).update(
+                state=DriverAvailability.State.OFFLINE, updated_at=now
+            )
+        TrackingService.invalidate(*ids)
+        return len(rows)
+
+    @staticmethod
+    def run(now=None, batch_size=None):
+        """
+        Un passage complet. Retourne {'pickup_timeout': n, 'driver_silent': n, 'in_transit_silent': n}.
+        """
+        now = now or timezone.now()
+        batch_size = batch_size or _setting('WATCHDOG_BATCH_SIZE', 1000)
+        counts = {}
+        for reason, finder in (('pickup_timeout', WatchdogService.stalled_pickups),
+                               ('driver_silent', WatchdogService.silent_drivers)):
+            released = 0
+            while True:
+                count = WatchdogService.release(finder(now), reason, now, batch_size)
+                released += count
+                if count < batch_size:
+                    break
+            counts[reason] = released
+            metrics.inc('watchdog_released', released, reason=reason)
+
+        flagged = list(WatchdogService.silent_in_transit(now).values_list('id', 'driver_id'))
+        DeliveryEventService.record_many([
+            DeliveryEventService.build(delivery_id, DeliveryEvent.Code.STALLED, at=now, actor=driver_id)
+            for delivery_id, driver_id in flagged
+        ])
+        counts['in_transit_silent'] = len(flagged)
+        return counts
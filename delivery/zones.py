@@ -0,0 +1,74 @@
+"""
+Découpage géographique en zones : cellules geohash de précision ZONE_GEOHASH_PRECISION
+(5 caractères, environ 4,9 km x 4,9 km par défaut). Un préfixe plus court désigne
+le groupe de zones voisines (une ville) traité par un même worker de dispatch.
+"""
+from django.conf import settings
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+def geohash(lat, lng, precision=5):
+    """Geohash d'un point (chaîne de `precision` caractères)."""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    lat, lng = float(lat), float(lng)
+    chars = []
+    bits = bit_count = 0
+    even = True
+    while len(chars) < precision:
+        interval, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = bit_count = 0
+    return ''.join(chars)
+
+def zone_for(lat, lng):
+    """Zone d'un point, ou '' si les coordonnées sont inconnues."""
+    if lat is None or lng is None:
+        return ''
+    return geohash(lat, lng, getattr(settings, 'ZONE_GEOHASH_PRECISION', 5))
+
+def bounds(zone):
+    """Emprise d'une cellule geohash : (lat_min, lat_max, lng_min, lng_max)."""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in zone:
+        bits = _BASE32.index(char)
+        for shift in range(4, -1, -1):
+            interval = lng_range if even else lat_range
+            mid = (interval[0] + interval[1]) / 2
+            if bits >> shift & 1:
+                interval[0] = mid
+            else:
+                interval[1] = mid
+            even = not even
+    return lat_range[0], lat_range[1], lng_range[0], lng_range[1]
+
+def neighbors(zone):
+    """Les (au plus) 8 cellules adjacentes, de même précision."""
+    lat_min, lat_max, lng_min, lng_max = bounds(zone)
+    height, width = lat_max - lat_min, lng_max - lng_min
+    lat, lng = (lat_min + lat_max) / 2, (lng_min + lng_max) / 2
+    result = set()
+    for dlat in (-1, 0, 1):
+        for dlng in (-1, 0, 1):
+            neighbor_lat = lat + dlat * height
+            if (dlat or dlng) and -90 < neighbor_lat < 90:
+                neighbor_lng = (lng + dlng * width + 180) % 360 - 180
+                result.add(geohash(neighbor_lat, neighbor_lng, len(zone)))
+    return result
+
+def with_neighbors(zones):
+    """Zones données et toutes leurs voisines."""
+    result = set(zones)
+    for zone in zones:
+        result |= neighbors(zone)
+    return result
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Wallet, Transaction, Commission
+from .models import Wallet, Transaction, Commission, ReconciliationRun, WalletDrift, DailyFinanceRollup, DailySalesRollup, EscrowHolding, DailyDriverEarningsRollup
 
 @admin.register(Commission)
 class CommissionAdmin(admin.ModelAdmin):
@@ -8,7 +8,8 @@ class CommissionAdmin(admin.ModelAdmin):
 
 @admin.register(Wallet)
 class WalletAdmin(admin.ModelAdmin):
-    list_display = ('user', 'balance', 'updated_at')
+    list_display = ('__str__', 'kind', 'merchant', 'balance', 'updated_at')
+    list_filter = ('kind',)
     search_fields = ('user__username', 'user__email')
     readonly_fields = ('updated_at',)
 
@@ -18,3 +19,44 @@ class TransactionAdmin(admin.ModelAdmin):
     list_filter = ('transaction_type', 'status', 'label', 'timestamp')
     search_fields = ('reference', 'wallet__user__username', 'order__id', 'description')
     readonly_fields = ('reference', 'timestamp')
+
+class WalletDriftInline(admin.TabularInline):
+    model = WalletDrift
+    extra = 0
+    readonly_fields = ('wallet', 'balance', 'ledger_balance', 'difference', 'first_transaction_id', 'last_transaction_id')
+    can_delete = False
+
+@admin.register(ReconciliationRun)
+class ReconciliationRunAdmin(admin.ModelAdmin):
+    list_display = ('id', 'status', 'is_full', 'wallets_checked', 'transactions_checked', 'drift_count', 'started_at', 'finished_at')
+    list_filter = ('status', 'is_full')
+    readonly_fields = ('started_at', 'finished_at')
+    inlines = [WalletDriftInline]
+
+@admin.register(DailyFinanceRollup)
+class DailyFinanceRollupAdmin(admin.ModelAdmin):
+    list_display = ('date', 'merchant', 'label', 'transaction_type', 'total_amount', 'transaction_count')
+    list_filter = ('label', 'transaction_type', 'date')
+    search_fields = ('merchant__store_name',)
+    date_hierarchy = 'date'
+
+@admin.register(DailySalesRollup)
+class DailySalesRollupAdmin(admin.ModelAdmin):
+    list_display = ('date', 'merchant', 'order_count', 'item_count', 'sales_total')
+    list_filter = ('date',)
+    search_fields = ('merchant__store_name',)
+    date_hierarchy = 'date'
+
+@admin.register(EscrowHolding)
+class EscrowHoldingAdmin(admin.ModelAdmin):
+    list_display = ('order', 'merchant', 'kind', 'amount', 'status', 'created_at', 'settled_at')
+    list_filter = ('status', 'kind')
+    search_fields = ('order__id', 'merchant__store_name')
+    readonly_fields = ('created_at', 'settled_at')
+
+@admin.register(DailyDriverEarningsRollup)
+class DailyDriverEarningsRollupAdmin(admin.ModelAdmin):
+    list_display = ('date', 'driver', 'delivery_count', 'earnings_total')
+    list_filter = ('date',)
+    search_fields = ('driver__username',)
+    date_hierarchy = 'date'
@@ -0,0 +1,123 @@
+"""
+Rémunération des livreurs.
+
+Les frais de livraison payés par le client restent en séquestre (`EscrowHolding` de
+nature DELIVERY_FEE, un par boutique de la commande) jusqu'à ce que la livraison de
+cette boutique soit terminée. La passe de paie (`manage.py pay_drivers`) verse par lots
+les frais des livraisons terminées : un transfert multi-jambes par lot (chaque
+portefeuille livreur n'est mis à jour qu'une fois, une transaction détaillée par
+livraison) et, dans la même transaction, l'agrégat journalier par livreur
+(`DailyDriverEarningsRollup`) sur lequel se lisent les récapitulatifs.
+"""
+from decimal import Decimal
+import logging
+
+from django.db.models import DateTimeField, OuterRef, Subquery, Sum
+from django.utils import timezone
+from core.transactions import transactional_retry
+from delivery.models import Delivery
+from .models import DailyDriverEarningsRollup, EscrowHolding, Transaction, Wallet
+from .rollups import RollupService
+from .services import FinanceService, TransferLeg
+
+logger = logging.getLogger(__name__)
+
+class EarningsService:
+    """
+    Paie des livreurs et récapitulatifs de gains.
+    """
+
+    DEFAULT_BATCH_SIZE = 1000
+
+    @staticmethod
+    def _payable(limit):
+        """
+        Frais en séquestre dont la livraison est terminée, avec la livraison et son livreur
+        (verrouillés). Un livreur sans portefeuille est écarté : ses frais restent en
+        séquestre sans bloquer les lots suivants, et seront payés dès que le portefeuille existe.
+        """
+        delivered = Delivery.objects.filter(
+            order=OuterRef('order'), merchant=OuterRef('merchant'),
+            status=Delivery.Status.DELIVERED, driver__isnull=False, driver__wallet__isnull=False,
+        )
+        queryset = (
+            EscrowHolding.objects.filter(kind=EscrowHolding.Kind.DELIVERY_FEE)
+            .annotate(
+                delivery_id=Subquery(delivered.values('id')[:1]),
+                driver_id=Subquery(delivered.values('driver')[:1]),
+                delivered_at=Subquery(delivered.values('delivered_at')[:1], output_field=DateTimeField()),
+            )
+            .filter(delivery_id__isnull=False)
+            .order_by('id')
+        )
+        return FinanceService._held(queryset, limit)
+
+    @staticmethod
+    @transactional_retry
+    def pay_batch(limit=DEFAULT_BATCH_SIZE):
+        """
+        Verse un lot de frais de livraison aux livreurs.
+        Retourne (séquestres lus, livraisons payées).
+        """
+        holdings = EarningsService._payable(limit)
+        if not holdings:
+            return 0, 0
+        wallets = Wallet.objects.in_bulk({h.driver_id for h in holdings}, field_name='user_id')
+
+        legs, paid, rollup = [], [], {}
+        for holding in holdings:
+            wallet = wallets.get(holding.driver_id)
+            if wallet is None:
+                logger.error(f"Portefeuille manquant pour le livreur {holding.driver_id}")
+                continue
+            order = holding.order
+            legs.append(TransferLeg(holding.escrow_wallet, -holding.amount, order=order,
+                                    description=f"Libération des frais de livraison commande #{order.id}"))
+            legs.append(TransferLeg(wallet, holding.amount, order=order,
+                                    description=f"Livraison #{holding.delivery_id} (commande #{order.id})"))
+            paid.append(holding.id)
+
+            day = timezone.localdate(holding.delivered_at or timezone.now())
+            totals = rollup.setdefault((day, holding.driver_id), {'delivery_count': 0, 'earnings_total': Decimal('0.00')})
+            totals['delivery_count'] += 1
+            totals['earnings_total'] += holding.amount
+
+        if legs:
+            FinanceService.multi_leg_transfer(legs, label=Transaction.Label.DRIVER_EARNING)
+        EscrowHolding.objects.filter(id__in=paid).update(
+            status=EscrowHolding.Status.RELEASED, settled_at=timezone.now()
+        )
+        RollupService._merge(DailyDriverEarningsRollup, rollup)
+        return len(holdings), len(paid)
+
+    @staticmethod
+    def run(batch_size=DEFAULT_BATCH_SIZE):
+        """Passe complète, lot par lot. Retourne le nombre de livraisons payées."""
+        total = 0
+        while True:
+            scanned, paid = EarningsService.pay_batch(batch_size)
+            total += paid
+            # Fin sur le nombre de lignes lues : un lot en partie ignoré n'arrête pas la passe
+            if scanned < batch_size:
+                return total
+
+    @staticmethod
+    def driver_summary(driver, date_from=None, date_to=None):
+        """
+        Gains versés à un livreur (bornes de dates incluses), lus sur l'agrégat journalier :
+        {'deliveries': n, 'earnings': Decimal, 'days': [{'date', 'deliveries', 'earnings'}]}.
+        """
+        rows = DailyDriverEarningsRollup.objects.filter(driver=driver)
+        if date_from:
+            rows = rows.filter(date__gte=date_from)
+        if date_to:
+            rows = rows.filter(date__lte=date_to)
+        totals = rows.aggregate(deliveries=Sum('delivery_count'), earnings=Sum('earnings_total'))
+        return {
+            'deliveries': totals['deliveries'] or 0,
+            'earnings': totals['earnings'] or Decimal('0.00'),
+            'days': [
+                {'date': day, 'deliveries': count, 'earnings': amount}
+                for day, count, amount in rows.order_by('-date').values_list('date', 'delivery_count', 'earnings_total')
+            ],
+        }
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from finance.earnings import EarningsService
+
+class Command(BaseCommand):
+    help = 'Verse aux livreurs les frais de livraison des livraisons terminées'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=EarningsService.DEFAULT_BATCH_SIZE,
+                            help='Nombre de livraisons par transaction')
+
+    def handle(self, *args, **options):
+        paid = EarningsService.run(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Paie des livreurs : {paid} livraisons versées"))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from finance.reconciliation import ReconciliationService
+
+class Command(BaseCommand):
+    help = 'Vérifie que le solde de chaque portefeuille correspond à ses transactions COMPLETED'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Ignore les checkpoints et ré-agrège tout l\'historique')
+        parser.add_argument('--chunk-size', type=int, default=ReconciliationService.DEFAULT_CHUNK_SIZE,
+                            help='Nombre d\'IDs de portefeuilles par requête groupée')
+        parser.add_argument('--workers', type=int, default=1, help='Nombre de tranches traitées en parallèle')
+
+    def handle(self, *args, **options):
+        run = ReconciliationService.run(
+            full=options['full'],
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+        )
+
+        for drift in run.drifts.select_related('wallet__user', 'wallet__merchant').order_by('wallet_id'):
+            self.stdout.write(self.style.WARNING(
+                f"Écart portefeuille #{drift.wallet_id} ({drift.wallet.owner_name}) : "
+                f"solde={drift.balance} ledger={drift.ledger_balance} écart={drift.difference} "
+                f"transactions [{drift.first_transaction_id} .. {drift.last_transaction_id}]"
+            ))
+
+        style = self.style.WARNING if run.drift_count else self.style.SUCCESS
+        self.stdout.write(style(
+            f"Réconciliation #{run.id} terminée : {run.wallets_checked} portefeuilles, "
+            f"{run.transactions_checked} transactions, {run.drift_count} écarts"
+        ))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from finance.rollups import RollupService, TRANSACTIONS, ORDER_ITEMS
+
+class Command(BaseCommand):
+    help = 'Met à jour les agrégats journaliers (transactions et ventes) à partir du filigrane'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backfill', action='store_true', help='Reconstruit les agrégats par plages de dates')
+        parser.add_argument('--from', dest='date_from', help='Premier jour à reconstruire (AAAA-MM-JJ)')
+        parser.add_argument('--to', dest='date_to', help='Dernier jour à reconstruire (AAAA-MM-JJ)')
+        parser.add_argument('--days-per-chunk', type=int, default=7, help='Taille des plages de dates en backfill')
+        parser.add_argument('--workers', type=int, default=1, help='Plages reconstruites en parallèle')
+        parser.add_argument('--batch-size', type=int, default=RollupService.DEFAULT_BATCH_SIZE,
+                            help='Nombre d\'IDs par lot incrémental')
+
+    def handle(self, *args, **options):
+        date_from = parse_date(options['date_from']) if options['date_from'] else None
+        date_to = parse_date(options['date_to']) if options['date_to'] else None
+        if (options['date_from'] or options['date_to']) and not options['backfill']:
+            raise CommandError("--from/--to ne s'utilisent qu'avec --backfill.")
+
+        for source in (TRANSACTIONS, ORDER_ITEMS):
+            if options['backfill']:
+                chunks = RollupService.backfill(
+                    source, date_from, date_to,
+                    days_per_chunk=options['days_per_chunk'],
+                    workers=options['workers'],
+                )
+                self.stdout.write(self.style.SUCCESS(f"{source.name} : {chunks} plages reconstruites"))
+            else:
+                batches = RollupService.run_incremental(source, batch_size=options['batch_size'])
+                self.stdout.write(self.style.SUCCESS(f"{source.name} : {batches} lots intégrés"))
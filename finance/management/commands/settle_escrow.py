@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from finance.services import FinanceService
+
+class Command(BaseCommand):
+    help = 'Libère le séquestre des commandes livrées (versements) et annulées (remboursements)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Nombre de séquestres par transaction')
+
+    def handle(self, *args, **options):
+        released = refunded = 0
+        while True:
+            result = FinanceService.release_escrow(limit=options['batch_size'])
+            if not result['released'] and not result['refunded']:
+                break
+            released += result['released']
+            refunded += result['refunded']
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Séquestre libéré : {released} versements, {refunded} remboursements"
+        ))
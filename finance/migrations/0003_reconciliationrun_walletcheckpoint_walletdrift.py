@@ -0,0 +1,51 @@
+# Generated by Django 5.2.8 on 2026-10-19 13:03
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0002_commission_transaction_description_transaction_label_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconciliationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('RUNNING', 'En cours'), ('COMPLETED', 'Terminé'), ('FAILED', 'Échoué')], default='RUNNING', max_length=20)),
+                ('is_full', models.BooleanField(default=False)),
+                ('wallets_checked', models.PositiveIntegerField(default=0)),
+                ('transactions_checked', models.PositiveBigIntegerField(default=0)),
+                ('drift_count', models.PositiveIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WalletCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ledger_balance', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('last_transaction_id', models.BigIntegerField(default=0)),
+                ('reconciled_at', models.DateTimeField(auto_now=True)),
+                ('wallet', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoint', to='finance.wallet')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WalletDrift',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('ledger_balance', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('difference', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('first_transaction_id', models.BigIntegerField(blank=True, null=True)),
+                ('last_transaction_id', models.BigIntegerField(blank=True, null=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='drifts', to='finance.reconciliationrun')),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='drifts', to='finance.wallet')),
+            ],
+        ),
+    ]
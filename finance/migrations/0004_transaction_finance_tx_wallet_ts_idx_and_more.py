@@ -0,0 +1,22 @@
+# Generated by Django 5.2.8 on 2026-10-19 13:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0003_reconciliationrun_walletcheckpoint_walletdrift'),
+        ('orders', '0002_orderitem'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['wallet', 'timestamp', 'id'], name='finance_tx_wallet_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['label', 'status', 'timestamp'], name='finance_tx_label_ts_idx'),
+        ),
+    ]
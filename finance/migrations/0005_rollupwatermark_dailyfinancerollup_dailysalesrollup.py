@@ -0,0 +1,55 @@
+# Generated by Django 5.2.8 on 2026-10-19 13:06
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0004_transaction_finance_tx_wallet_ts_idx_and_more'),
+        ('merchants', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyFinanceRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('label', models.CharField(blank=True, choices=[('ORDER_PAYMENT', 'Paiement de commande'), ('MERCHANT_PAYOUT', 'Versement marchand'), ('COMMISSION', 'Commission plateforme'), ('WALLET_DEPOSIT', 'Rechargement portefeuille'), ('MANUAL_ADJUSTMENT', 'Ajustement manuel')], default='', max_length=50)),
+                ('transaction_type', models.CharField(choices=[('DEPOSIT', 'Dépôt'), ('WITHDRAWAL', 'Retrait'), ('PAYMENT', 'Paiement'), ('REFUND', 'Remboursement'), ('TRANSFER', 'Transfert')], max_length=20)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('transaction_count', models.PositiveIntegerField(default=0)),
+                ('merchant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='finance_rollups', to='merchants.merchantprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['merchant', 'date'], name='finance_rollup_merchant_idx')],
+                'constraints': [models.UniqueConstraint(fields=('date', 'merchant', 'label', 'transaction_type'), name='finance_rollup_unique_key')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('item_count', models.PositiveIntegerField(default=0)),
+                ('sales_total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('merchant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to='merchants.merchantprofile')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'merchant'), name='finance_sales_rollup_unique_key')],
+            },
+        ),
+    ]
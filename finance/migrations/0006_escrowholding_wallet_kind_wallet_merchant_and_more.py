@@ -0,0 +1,80 @@
+# Generated by Django 5.2.8 on 2026-10-19 13:09
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0005_rollupwatermark_dailyfinancerollup_dailysalesrollup'),
+        ('merchants', '0001_initial'),
+        ('orders', '0002_orderitem'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EscrowHolding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('status', models.CharField(choices=[('HELD', 'En séquestre'), ('RELEASED', 'Versé'), ('REFUNDED', 'Remboursé')], default='HELD', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('settled_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='wallet',
+            name='kind',
+            field=models.CharField(choices=[('USER', 'Utilisateur'), ('ESCROW', 'Séquestre'), ('PLATFORM', 'Plateforme')], default='USER', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='wallet',
+            name='merchant',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='escrow_wallets', to='merchants.merchantprofile'),
+        ),
+        migrations.AlterField(
+            model_name='dailyfinancerollup',
+            name='label',
+            field=models.CharField(blank=True, choices=[('ORDER_PAYMENT', 'Paiement de commande'), ('MERCHANT_PAYOUT', 'Versement marchand'), ('COMMISSION', 'Commission plateforme'), ('WALLET_DEPOSIT', 'Rechargement portefeuille'), ('MANUAL_ADJUSTMENT', 'Ajustement manuel'), ('ORDER_REFUND', 'Remboursement de commande')], default='', max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='label',
+            field=models.CharField(blank=True, choices=[('ORDER_PAYMENT', 'Paiement de commande'), ('MERCHANT_PAYOUT', 'Versement marchand'), ('COMMISSION', 'Commission plateforme'), ('WALLET_DEPOSIT', 'Rechargement portefeuille'), ('MANUAL_ADJUSTMENT', 'Ajustement manuel'), ('ORDER_REFUND', 'Remboursement de commande')], max_length=50, null=True),
+        ),
+        migrations.AlterField(
+            model_name='wallet',
+            name='user',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='wallet', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='wallet',
+            constraint=models.UniqueConstraint(condition=models.Q(('merchant__isnull', True), ('user__isnull', True)), fields=('kind',), name='finance_unique_system_wallet'),
+        ),
+        migrations.AddConstraint(
+            model_name='wallet',
+            constraint=models.UniqueConstraint(condition=models.Q(('merchant__isnull', False), ('user__isnull', True)), fields=('kind', 'merchant'), name='finance_unique_merchant_escrow_wallet'),
+        ),
+        migrations.AddField(
+            model_name='escrowholding',
+            name='escrow_wallet',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='holdings', to='finance.wallet'),
+        ),
+        migrations.AddField(
+            model_name='escrowholding',
+            name='merchant',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='escrow_holdings', to='merchants.merchantprofile'),
+        ),
+        migrations.AddField(
+            model_name='escrowholding',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='escrow_holdings', to='orders.order'),
+        ),
+        migrations.AddIndex(
+            model_name='escrowholding',
+            index=models.Index(fields=['status', 'order'], name='finance_escrow_status_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.8 on 2026-10-19 13:48
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0006_escrowholding_wallet_kind_wallet_merchant_and_more'),
+        ('merchants', '0002_merchantprofile_latitude_merchantprofile_longitude'),
+        ('orders', '0003_order_delivery_fee'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyDriverEarningsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('delivery_count', models.PositiveIntegerField(default=0)),
+                ('earnings_total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='escrowholding',
+            name='kind',
+            field=models.CharField(choices=[('GOODS', 'Marchandises'), ('DELIVERY_FEE', 'Frais de livraison')], default='GOODS', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='dailyfinancerollup',
+            name='label',
+            field=models.CharField(blank=True, choices=[('ORDER_PAYMENT', 'Paiement de commande'), ('MERCHANT_PAYOUT', 'Versement marchand'), ('COMMISSION', 'Commission plateforme'), ('WALLET_DEPOSIT', 'Rechargement portefeuille'), ('MANUAL_ADJUSTMENT', 'Ajustement manuel'), ('ORDER_REFUND', 'Remboursement de commande'), ('DRIVER_EARNING', 'Rémunération livreur')], default='', max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='label',
+            field=models.CharField(blank=True, choices=[('ORDER_PAYMENT', 'Paiement de commande'), ('MERCHANT_PAYOUT', 'Versement marchand'), ('COMMISSION', 'Commission plateforme'), ('WALLET_DEPOSIT', 'Rechargement portefeuille'), ('MANUAL_ADJUSTMENT', 'Ajustement manuel'), ('ORDER_REFUND', 'Remboursement de commande'), ('DRIVER_EARNING', 'Rémunération livreur')], max_length=50, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='escrowholding',
+            index=models.Index(fields=['kind', 'status'], name='finance_escrow_kind_idx'),
+        ),
+        migrations.AddField(
+            model_name='dailydriverearningsrollup',
+            name='driver',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='earnings_rollups', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='dailydriverearningsrollup',
+            index=models.Index(fields=['driver', 'date'], name='finance_driver_rollup_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailydriverearningsrollup',
+            constraint=models.UniqueConstraint(fields=('date', 'driver'), name='finance_driver_rollup_unique_key'),
+        ),
+    ]
@@ -5,16 +5,54 @@ from orders.models import Order
 from decimal import Decimal
 
 class Wallet(models.Model):
+    class Kind(models.TextChoices):
+        USER = 'USER', 'Utilisateur'
+        ESCROW = 'ESCROW', 'Séquestre'
+        PLATFORM = 'PLATFORM', 'Plateforme'
+
     user = models.OneToOneField(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
-        related_name='wallet'
+        related_name='wallet',
+        null=True,
+        blank=True
+    )
+    kind = models.CharField(max_length=20, choices=Kind.choices, default=Kind.USER)
+    # Sous-compte de séquestre propre à un marchand (optionnel)
+    merchant = models.ForeignKey(
+        'merchants.MerchantProfile',
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='escrow_wallets'
     )
     balance = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['kind'],
+                condition=models.Q(user__isnull=True, merchant__isnull=True),
+                name='finance_unique_system_wallet'
+            ),
+            models.UniqueConstraint(
+                fields=['kind', 'merchant'],
+                condition=models.Q(user__isnull=True, merchant__isnull=False),
+                name='finance_unique_merchant_escrow_wallet'
+            ),
+        ]
+
+    @property
+    def owner_name(self):
+        if self.user_id:
+            return self.user.username
+        if self.merchant_id:
+            return f"{self.get_kind_display()} {self.merchant.store_name}"
+        return self.get_kind_display()
+
     def __str__(self):
-        return f"Wallet of {self.user.username} - {self.balance}"
+        return f"Wallet of {self.owner_name} - {self.balance}"
 
 class Commission(models.Model):
     name = models.CharField(max_length=100, default="Platform Fee")
@@ -46,6 +84,8 @@ class Transaction(models.Model):
         COMMISSION = 'COMMISSION', 'Commission plateforme'
         WALLET_DEPOSIT = 'WALLET_DEPOSIT', 'Rechargement portefeuille'
         MANUAL_ADJUSTMENT = 'MANUAL_ADJUSTMENT', 'Ajustement manuel'
+        ORDER_REFUND = 'ORDER_REFUND', 'Remboursement de commande'
+        DRIVER_EARNING = 'DRIVER_EARNING', 'Rémunération livreur'
 
     wallet = models.ForeignKey(
         Wallet,
@@ -69,5 +109,210 @@ class Transaction(models.Model):
     )
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Relevés de portefeuille (pagination par clé timestamp, id)
+            models.Index(fields=['wallet', 'timestamp', 'id'], name='finance_tx_wallet_ts_idx'),
+            # Filtres de l'admin et rapports par libellé/période
+            models.Index(fields=['label', 'status', 'timestamp'], name='finance_tx_label_ts_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.transaction_type} ({self.amount}) - {self.wallet.owner_name} - {self.status}"
+
+class WalletCheckpoint(models.Model):
+    """
+    Dernier état réconcilié d'un portefeuille : somme des transactions COMPLETED
+    jusqu'à `last_transaction_id` inclus (borne stabilisée). Permet les réconciliations incrémentales.
+    """
+    wallet = models.OneToOneField(
+        Wallet,
+        on_delete=models.CASCADE,
+        related_name='checkpoint'
+    )
+    ledger_balance = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    last_transaction_id = models.BigIntegerField(default=0)
+    reconciled_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Checkpoint {self.wallet_id} @ {self.last_transaction_id} - {self.ledger_balance}"
+
+class ReconciliationRun(models.Model):
+    class Status(models.TextChoices):
+        RUNNING = 'RUNNING', 'En cours'
+        COMPLETED = 'COMPLETED', 'Terminé'
+        FAILED = 'FAILED', 'Échoué'
+
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.RUNNING)
+    is_full = models.BooleanField(default=False)
+    wallets_checked = models.PositiveIntegerField(default=0)
+    transactions_checked = models.PositiveBigIntegerField(default=0)
+    drift_count = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Réconciliation #{self.id} - {self.get_status_display()} ({self.drift_count} écarts)"
+
+class WalletDrift(models.Model):
+    """
+    Écart constaté entre `Wallet.balance` et la somme de ses transactions COMPLETED.
+    `first_transaction_id`/`last_transaction_id` bornent les transactions examinées
+    lors de la passe où l'écart a été constaté.
+    """
+    run = models.ForeignKey(
+        ReconciliationRun,
+        on_delete=models.CASCADE,
+        related_name='drifts'
+    )
+    wallet = models.ForeignKey(
+        Wallet,
+        on_delete=models.CASCADE,
+        related_name='drifts'
+    )
+    balance = models.DecimalField(max_digits=14, decimal_places=2)
+    ledger_balance = models.DecimalField(max_digits=14, decimal_places=2)
+    difference = models.DecimalField(max_digits=14, decimal_places=2)
+    first_transaction_id = models.BigIntegerField(null=True, blank=True)
+    last_transaction_id = models.BigIntegerField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Écart {self.difference} sur le portefeuille {self.wallet_id}"
+
+class RollupWatermark(models.Model):
+    """
+    Dernier ID source intégré par un agrégat incrémental (ex. 'transactions', 'order_items').
+    """
+    name = models.CharField(max_length=50, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.last_id}"
+
+class DailyFinanceRollup(models.Model):
+    """
+    Agrégat journalier des transactions COMPLETED par marchand, libellé et type.
+    `merchant` est nul pour les portefeuilles qui ne sont pas ceux d'un marchand.
+    """
+    date = models.DateField()
+    merchant = models.ForeignKey(
+        'merchants.MerchantProfile',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='finance_rollups'
+    )
+    label = models.CharField(max_length=50, choices=Transaction.Label.choices, blank=True, default='')
+    transaction_type = models.CharField(max_length=20, choices=Transaction.Type.choices)
+    total_amount = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal('0.00'))
+    transaction_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'merchant', 'label', 'transaction_type'],
+                name='finance_rollup_unique_key'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['merchant', 'date'], name='finance_rollup_merchant_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.label or '-'} {self.transaction_type}: {self.total_amount} ({self.transaction_count})"
+
+class DailySalesRollup(models.Model):
+    """
+    Agrégat journalier des articles commandés par marchand (date de création de la commande).
+    """
+    date = models.DateField()
+    merchant = models.ForeignKey(
+        'merchants.MerchantProfile',
+        on_delete=models.CASCADE,
+        related_name='sales_rollups'
+    )
+    order_count = models.PositiveIntegerField(default=0)
+    item_count = models.PositiveIntegerField(default=0)
+    sales_total = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'merchant'], name='finance_sales_rollup_unique_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.merchant_id}: {self.sales_total} ({self.order_count} commandes)"
+
+class EscrowHolding(models.Model):
+    """
+    Montant d'une commande payée conservé en séquestre jusqu'à la livraison
+    (versement) ou l'annulation (remboursement). Une ligne par commande, par marchand
+    et par nature : les marchandises reviennent au marchand, les frais de livraison
+    au livreur de la livraison de ce marchand.
+    """
+    class Status(models.TextChoices):
+        HELD = 'HELD', 'En séquestre'
+        RELEASED = 'RELEASED', 'Versé'
+        REFUNDED = 'REFUNDED', 'Remboursé'
+
+    class Kind(models.TextChoices):
+        GOODS = 'GOODS', 'Marchandises'
+        DELIVERY_FEE = 'DELIVERY_FEE', 'Frais de livraison'
+
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.PROTECT,
+        related_name='escrow_holdings'
+    )
+    merchant = models.ForeignKey(
+        'merchants.MerchantProfile',
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='escrow_holdings'
+    )
+    escrow_wallet = models.ForeignKey(
+        Wallet,
+        on_delete=models.PROTECT,
+        related_name='holdings'
+    )
+    kind = models.CharField(max_length=20, choices=Kind.choices, default=Kind.GOODS)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.HELD)
+    created_at = models.DateTimeField(auto_now_add=True)
+    settled_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'order'], name='finance_escrow_status_idx'),
+            models.Index(fields=['kind', 'status'], name='finance_escrow_kind_idx'),
+        ]
+
+    def __str__(self):
+        return f"Séquestre {self.amount} - Commande #{self.order_id} - {self.get_status_display()}"
+
+class DailyDriverEarningsRollup(models.Model):
+    """
+    Agrégat journalier des rémunérations versées aux livreurs (date de livraison),
+    alimenté par la passe de paie dans la même transaction que les versements.
+    """
+    date = models.DateField()
+    driver = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='earnings_rollups'
+    )
+    delivery_count = models.PositiveIntegerField(default=0)
+    earnings_total = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'driver'], name='finance_driver_rollup_unique_key'),
+        ]
+        indexes = [
+            models.Index(fields=['driver', 'date'], name='finance_driver_rollup_idx'),
+        ]
+
     def __str__(self):
-        return f"{self.transaction_type} ({self.amount}) - {self.wallet.user.username} - {self.status}"
+        return f"{self.date} livreur {self.driver_id}: {self.earnings_total} ({self.delivery_count} livraisons)"
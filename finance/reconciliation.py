@@ -0,0 +1,221 @@
+"""
+Réconciliation des portefeuilles : vérifie que `Wallet.balance` est égal à la
+somme des transactions COMPLETED du portefeuille.
+
+Chaque tranche d'IDs de portefeuilles est agrégée par une seule requête SQL
+groupée (solde + delta depuis le dernier checkpoint, lus dans le même instantané),
+puis comparée de manière vectorisée avec NumPy/pandas en centimes entiers.
+
+Le checkpoint n'avance que jusqu'à une borne stabilisée (même délai que les
+agrégats, FINANCE_RECONCILIATION_SETTLE_SECONDS) : une transaction d'ID plus bas
+validée après une plus récente est encore agrégée au passage suivant. Les
+transactions trop récentes sont vérifiées mais restent au-delà du checkpoint.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+import logging
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum, Count, Min, Max, Q, F, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Wallet, Transaction, WalletCheckpoint, ReconciliationRun, WalletDrift
+
+logger = logging.getLogger(__name__)
+
+def _to_cents(values):
+    """Convertit une séquence de Decimal (ou None) en tableau int64 de centimes."""
+    return np.fromiter(
+        (int((value or 0) * 100) for value in values),
+        dtype=np.int64,
+        count=len(values)
+    )
+
+def _from_cents(cents):
+    return (Decimal(int(cents)) / 100).quantize(Decimal('0.01'))
+
+class ReconciliationService:
+    """
+    Service de réconciliation des portefeuilles.
+    """
+
+    DEFAULT_CHUNK_SIZE = 5000
+
+    @staticmethod
+    def wallet_ranges(chunk_size):
+        """Découpe l'espace des IDs de portefeuilles en tranches [start, end]."""
+        bounds = Wallet.objects.aggregate(low=Min('id'), high=Max('id'))
+        if bounds['low'] is None:
+            return []
+        return [
+            (start, min(start + chunk_size - 1, bounds['high']))
+            for start in range(bounds['low'], bounds['high'] + 1, chunk_size)
+        ]
+
+    @staticmethod
+    def settled_bound():
+        """
+        Plus grand ID de transaction stabilisé : on s'arrête juste avant la première
+        transaction trop récente, pour ne jamais dépasser un ID dont la transaction
+        concurrente n'a peut-être pas encore validé.
+        """
+        settle_seconds = getattr(settings, 'FINANCE_RECONCILIATION_SETTLE_SECONDS', 60)
+        cutoff = timezone.now() - timedelta(seconds=settle_seconds)
+        first_recent = Transaction.objects.filter(timestamp__gte=cutoff).aggregate(first=Min('id'))['first']
+        if first_recent is not None:
+            return first_recent - 1
+        return Transaction.objects.aggregate(last=Max('id'))['last'] or 0
+
+    @staticmethod
+    def aggregate_chunk(start_id, end_id, full=False, bound=None):
+        """
+        Une requête groupée par tranche : solde, checkpoint et agrégats des
+        transactions COMPLETED postérieures au checkpoint, par portefeuille.
+        `settled` est la part de ce delta jusqu'à `bound` (intégrée au checkpoint).
+        """
+        if full:
+            window = Q(transactions__status=Transaction.Status.COMPLETED)
+        else:
+            window = Q(
+                transactions__status=Transaction.Status.COMPLETED,
+                transactions__id__gt=Coalesce(F('checkpoint__last_transaction_id'), Value(0))
+            )
+        settled = window if bound is None else window & Q(transactions__id__lte=bound)
+
+        rows = list(
+            Wallet.objects.filter(id__gte=start_id, id__lte=end_id)
+            .annotate(
+                delta=Sum('transactions__amount', filter=window),
+                settled=Sum('transactions__amount', filter=settled),
+                tx_count=Count('transactions', filter=window),
+                first_tx=Min('transactions__id', filter=window),
+                last_tx=Max('transactions__id', filter=window),
+                last_settled_tx=Max('transactions__id', filter=settled),
+            )
+            .values_list(
+                'id', 'balance', 'checkpoint__ledger_balance', 'checkpoint__last_transaction_id',
+                'delta', 'settled', 'tx_count', 'first_tx', 'last_tx', 'last_settled_tx'
+            )
+        )
+        frame = pd.DataFrame(rows, columns=[
+            'wallet_id', 'balance', 'previous_ledger', 'previous_tx',
+            'delta', 'settled', 'tx_count', 'first_tx', 'last_tx', 'last_settled_tx'
+        ])
+        if full:
+            frame['previous_ledger'] = None
+            frame['previous_tx'] = None
+        if bound is not None:
+            frame['last_settled_tx'] = bound
+        return frame
+
+    @staticmethod
+    def compare(frame):
+        """
+        Comparaison vectorisée : ledger = checkpoint + delta, écart = solde - ledger.
+        Le nouveau checkpoint ne retient que la part stabilisée du delta.
+        Retourne le DataFrame enrichi (montants en centimes entiers).
+        """
+        frame = frame.copy()
+        previous_cents = _to_cents(frame['previous_ledger'].tolist())
+        frame['balance_cents'] = _to_cents(frame['balance'].tolist())
+        frame['ledger_cents'] = previous_cents + _to_cents(frame['delta'].tolist())
+        frame['settled_cents'] = previous_cents + _to_cents(frame['settled'].tolist())
+        frame['drift_cents'] = frame['balance_cents'] - frame['ledger_cents']
+        frame['last_reconciled_tx'] = np.maximum(
+            frame['previous_tx'].fillna(0).astype(np.int64).to_numpy(),
+            frame['last_settled_tx'].fillna(0).astype(np.int64).to_numpy()
+        )
+        return frame
+
+    @staticmethod
+    def reconcile_chunk(run_id, start_id, end_id, full=False, bound=None):
+        """
+        Réconcilie une tranche de portefeuilles et avance leurs checkpoints jusqu'à
+        `bound` au plus. Retourne (portefeuilles vérifiés, transactions vérifiées, écarts).
+        """
+        frame = ReconciliationService.compare(
+            ReconciliationService.aggregate_chunk(start_id, end_id, full, bound)
+        )
+        if frame.empty:
+            return 0, 0, 0
+
+        drifted = frame[frame['drift_cents'] != 0]
+
+        with transaction.atomic():
+            WalletCheckpoint.objects.bulk_create(
+                [
+                    WalletCheckpoint(
+                        wallet_id=int(row.wallet_id),
+                        ledger_balance=_from_cents(row.settled_cents),
+                        last_transaction_id=int(row.last_reconciled_tx),
+                        reconciled_at=timezone.now(),
+                    )
+                    for row in frame.itertuples(index=False)
+                ],
+                update_conflicts=True,
+                unique_fields=['wallet'],
+                update_fields=['ledger_balance', 'last_transaction_id', 'reconciled_at'],
+            )
+            WalletDrift.objects.bulk_create([
+                WalletDrift(
+                    run_id=run_id,
+                    wallet_id=int(row.wallet_id),
+                    balance=_from_cents(row.balance_cents),
+                    ledger_balance=_from_cents(row.ledger_cents),
+                    difference=_from_cents(row.drift_cents),
+                    first_transaction_id=None if pd.isna(row.first_tx) else int(row.first_tx),
+                    last_transaction_id=None if pd.isna(row.last_tx) else int(row.last_tx),
+                )
+                for row in drifted.itertuples(index=False)
+            ])
+
+        return len(frame), int(frame['tx_count'].sum()), len(drifted)
+
+    @staticmethod
+    def _reconcile_chunk_in_thread(run_id, start_id, end_id, full, bound):
+        try:
+            return ReconciliationService.reconcile_chunk(run_id, start_id, end_id, full, bound)
+        finally:
+            # Chaque thread ouvre sa propre connexion : on la libère en sortant
+            connection.close()
+
+    @staticmethod
+    def run(full=False, chunk_size=DEFAULT_CHUNK_SIZE, workers=1):
+        """
+        Lance une réconciliation. En mode incrémental, seules les transactions
+        postérieures au checkpoint de chaque portefeuille sont agrégées ; les
+        checkpoints avancent jusqu'à la borne stabilisée lue au départ.
+        Les tranches sont traitées en parallèle si `workers` > 1.
+        """
+        run = ReconciliationRun.objects.create(is_full=full)
+        ranges = ReconciliationService.wallet_ranges(chunk_size)
+        bound = ReconciliationService.settled_bound()
+
+        try:
+            if workers > 1:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    results = list(executor.map(
+                        lambda bounds: ReconciliationService._reconcile_chunk_in_thread(run.id, *bounds, full, bound),
+                        ranges
+                    ))
+            else:
+                results = [ReconciliationService.reconcile_chunk(run.id, *bounds, full, bound) for bounds in ranges]
+        except Exception:
+            logger.exception("Échec de la réconciliation #%s", run.id)
+            run.status = ReconciliationRun.Status.FAILED
+            run.finished_at = timezone.now()
+            run.save()
+            raise
+
+        run.wallets_checked = sum(r[0] for r in results)
+        run.transactions_checked = sum(r[1] for r in results)
+        run.drift_count = sum(r[2] for r in results)
+        run.status = ReconciliationRun.Status.COMPLETED
+        run.finished_at = timezone.now()
+        run.save()
+        return run
@@ -0,0 +1,266 @@
+"""
+Agrégats journaliers pour le reporting financier.
+
+Les tables `DailyFinanceRollup` (transactions) et `DailySalesRollup` (articles commandés)
+sont alimentées de manière incrémentale à partir d'un filigrane (dernier ID intégré),
+si bien que les rapports ne parcourent plus les tables transactionnelles.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum, Count, Min, Max, F, Q, Value, Exists, OuterRef, Case, When, IntegerField
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from orders.models import OrderItem
+from .models import Transaction, Wallet, RollupWatermark, DailyDriverEarningsRollup, DailyFinanceRollup, DailySalesRollup
+
+class RollupSource:
+    """Décrit une table source : requêtes d'agrégation et modèle cible."""
+
+    def __init__(self, name, model, queryset, time_field):
+        self.name = name
+        self.model = model
+        self.queryset = queryset
+        self.time_field = time_field
+
+def _transactions_aggregate(queryset):
+    """
+    Seules les lignes d'un portefeuille utilisateur sont attribuées à son marchand :
+    séquestres (y compris les sous-comptes par marchand) et plateforme restent hors marchand.
+    """
+    return {
+        (row['day'], row['merchant_id'], row['label_key'], row['transaction_type']): {
+            'total_amount': row['total'],
+            'transaction_count': row['count'],
+        }
+        for row in queryset.filter(status=Transaction.Status.COMPLETED)
+        .annotate(
+            day=TruncDate('timestamp'),
+            merchant_id=Case(
+                When(wallet__kind=Wallet.Kind.USER, then=F('wallet__user__merchant_profile')),
+                default=None, output_field=IntegerField(),
+            ),
+            label_key=Coalesce('label', Value('')),
+        )
+        .values('day', 'merchant_id', 'label_key', 'transaction_type')
+        .annotate(total=Sum('amount'), count=Count('id'))
+    }
+
+def _sales_aggregate(queryset, counted_up_to=0):
+    """
+    Les commandes dont un article du même marchand a déjà été intégré (ID <= counted_up_to)
+    ne sont pas recomptées dans `order_count`.
+    """
+    queryset = queryset.annotate(day=TruncDate('order__created_at'), merchant_id=F('product__merchant'))
+    order_filter = None
+    if counted_up_to:
+        queryset = queryset.annotate(already_counted=Exists(
+            OrderItem.objects.filter(
+                order=OuterRef('order'),
+                product__merchant=OuterRef('product__merchant'),
+                id__lte=counted_up_to,
+            )
+        ))
+        order_filter = Q(already_counted=False)
+
+    return {
+        (row['day'], row['merchant_id']): {
+            'order_count': row['orders'],
+            'item_count': row['items'] or 0,
+            'sales_total': row['sales'] or Decimal('0.00'),
+        }
+        for row in queryset.values('day', 'merchant_id').annotate(
+            orders=Count('order', distinct=True, filter=order_filter),
+            items=Sum('quantity'),
+            sales=Sum(F('quantity') * F('price')),
+        )
+    }
+
+TRANSACTIONS = RollupSource('transactions', DailyFinanceRollup, Transaction.objects.all(), 'timestamp')
+ORDER_ITEMS = RollupSource('order_items', DailySalesRollup, OrderItem.objects.all(), 'order__created_at')
+
+_KEY_FIELDS = {
+    DailyFinanceRollup: ('date', 'merchant_id', 'label', 'transaction_type'),
+    DailySalesRollup: ('date', 'merchant_id'),
+    DailyDriverEarningsRollup: ('date', 'driver_id'),
+}
+
+class RollupService:
+    """
+    Maintenance et lecture des agrégats journaliers.
+    """
+
+    DEFAULT_BATCH_SIZE = 50000
+
+    @staticmethod
+    def _aggregate(source, queryset, counted_up_to=0):
+        if source is TRANSACTIONS:
+            return _transactions_aggregate(queryset)
+        return _sales_aggregate(queryset, counted_up_to)
+
+    @staticmethod
+    def _merge(model, aggregates):
+        """Ajoute les agrégats aux lignes existantes (ou les crée)."""
+        if not aggregates:
+            return
+        key_fields = _KEY_FIELDS[model]
+        value_fields = list(next(iter(aggregates.values())))
+        dates = {key[0] for key in aggregates}
+
+        existing = {
+            tuple(getattr(row, field) for field in key_fields): row
+            for row in model.objects.select_for_update().filter(date__in=dates)
+        }
+
+        to_create, to_update = [], []
+        for key, values in aggregates.items():
+            row = existing.get(key)
+            if row is None:
+                to_create.append(model(**dict(zip(key_fields, key)), **values))
+                continue
+            for field, value in values.items():
+                setattr(row, field, getattr(row, field) + value)
+            to_update.append(row)
+
+        model.objects.bulk_create(to_create)
+        model.objects.bulk_update(to_update, value_fields)
+
+    @staticmethod
+    def safe_bound(source, after_id):
+        """
+        Plus grand ID intégrable sans trou : on s'arrête juste avant la première
+        ligne trop récente (non encore stabilisée). Le délai FINANCE_ROLLUP_SETTLE_SECONDS
+        laisse aux transactions concurrentes le temps de valider, pour ne jamais dépasser
+        un ID encore invisible.
+        """
+        settle_seconds = getattr(settings, 'FINANCE_ROLLUP_SETTLE_SECONDS', 60)
+        cutoff = timezone.now() - timedelta(seconds=settle_seconds)
+        window = source.queryset.filter(id__gt=after_id)
+        first_recent = window.filter(**{f'{source.time_field}__gte': cutoff}).aggregate(first=Min('id'))['first']
+        if first_recent is not None:
+            window = window.filter(id__lt=first_recent)
+        return window.aggregate(last=Max('id'))['last']
+
+    @staticmethod
+    def run_incremental(source, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Intègre les lignes postérieures au filigrane, par lots d'IDs.
+        Chaque lot est atomique : agrégats et filigrane avancent ensemble.
+        Retourne le nombre de lots traités.
+        """
+        watermark, _ = RollupWatermark.objects.get_or_create(name=source.name)
+        bound = RollupService.safe_bound(source, watermark.last_id)
+        if bound is None:
+            return 0
+
+        batches = 0
+        low = watermark.last_id
+        while low < bound:
+            high = min(low + batch_size, bound)
+            with transaction.atomic():
+                RollupWatermark.objects.select_for_update().get(name=source.name)
+                aggregates = RollupService._aggregate(
+                    source, source.queryset.filter(id__gt=low, id__lte=high), counted_up_to=low
+                )
+                RollupService._merge(source.model, aggregates)
+                RollupWatermark.objects.filter(name=source.name).update(last_id=high, updated_at=timezone.now())
+            low = high
+            batches += 1
+        return batches
+
+    @staticmethod
+    def _rebuild_days(source, first_day, last_day, up_to_id):
+        """Recalcule entièrement les jours [first_day, last_day] à partir des lignes d'ID <= up_to_id."""
+        start = timezone.make_aware(datetime.combine(first_day, time.min))
+        end = timezone.make_aware(datetime.combine(last_day + timedelta(days=1), time.min))
+        queryset = source.queryset.filter(
+            id__lte=up_to_id,
+            **{f'{source.time_field}__gte': start, f'{source.time_field}__lt': end}
+        )
+        with transaction.atomic():
+            source.model.objects.filter(date__gte=first_day, date__lte=last_day).delete()
+            source.model.objects.bulk_create([
+                source.model(**dict(zip(_KEY_FIELDS[source.model], key)), **values)
+                for key, values in RollupService._aggregate(source, queryset).items()
+            ])
+
+    @staticmethod
+    def _rebuild_days_in_thread(source, first_day, last_day, up_to_id):
+        try:
+            RollupService._rebuild_days(source, first_day, last_day, up_to_id)
+        finally:
+            connection.close()
+
+    @staticmethod
+    def backfill(source, date_from=None, date_to=None, days_per_chunk=7, workers=1):
+        """
+        Reconstruit les agrégats par plages de dates, en parallèle si `workers` > 1.
+        Sans bornes, tout l'historique est reconstruit et le filigrane repositionné ;
+        avec bornes, seules les lignes déjà couvertes par le filigrane sont reprises,
+        le reste étant laissé à la passe incrémentale.
+        """
+        watermark, _ = RollupWatermark.objects.get_or_create(name=source.name)
+        full_rebuild = date_from is None and date_to is None
+
+        if full_rebuild:
+            up_to_id = RollupService.safe_bound(source, 0) or 0
+            bounds = source.queryset.filter(id__lte=up_to_id).aggregate(
+                first=Min(source.time_field), last=Max(source.time_field)
+            )
+            if bounds['first'] is None:
+                return 0
+            date_from = timezone.localtime(bounds['first']).date()
+            date_to = timezone.localtime(bounds['last']).date()
+        else:
+            up_to_id = watermark.last_id
+            date_from = date_from or date_to
+            date_to = date_to or date_from
+
+        chunks = []
+        day = date_from
+        while day <= date_to:
+            last_day = min(day + timedelta(days=days_per_chunk - 1), date_to)
+            chunks.append((day, last_day))
+            day = last_day + timedelta(days=1)
+
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(
+                    lambda chunk: RollupService._rebuild_days_in_thread(source, *chunk, up_to_id),
+                    chunks
+                ))
+        else:
+            for chunk in chunks:
+                RollupService._rebuild_days(source, *chunk, up_to_id)
+
+        if full_rebuild:
+            # Les jours hors plage n'existent plus dans la source : on repart d'une table propre
+            source.model.objects.exclude(date__gte=date_from, date__lte=date_to).delete()
+            RollupWatermark.objects.filter(name=source.name).update(last_id=up_to_id, updated_at=timezone.now())
+        return len(chunks)
+
+    @staticmethod
+    def merchant_sales_summary(merchant_profile):
+        """
+        Nombre de commandes et chiffre d'affaires d'un marchand :
+        agrégats journaliers + lignes pas encore intégrées (au-delà du filigrane).
+        """
+        totals = DailySalesRollup.objects.filter(merchant=merchant_profile).aggregate(
+            orders=Sum('order_count'), sales=Sum('sales_total')
+        )
+        watermark = RollupWatermark.objects.filter(name=ORDER_ITEMS.name).values_list('last_id', flat=True).first() or 0
+
+        tail = _sales_aggregate(
+            OrderItem.objects.filter(product__merchant=merchant_profile, id__gt=watermark),
+            counted_up_to=watermark
+        )
+        return {
+            'total_orders': (totals['orders'] or 0) + sum(v['order_count'] for v in tail.values()),
+            'total_sales': (totals['sales'] or Decimal('0.00')) + sum(
+                (v['sales_total'] for v in tail.values()), Decimal('0.00')
+            ),
+        }
@@ -1,7 +1,13 @@
-from django.db import transaction
-from django.db.models import F
-from .models import Wallet, Transaction, Commission
+from django.core import signing
+from core.transactions import transactional_retry
+from django.db.models import F, Q, Sum, Case, When, Value, DecimalField, Window, Exists, OuterRef
+from django.db.models.expressions import RowRange
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.conf import settings
+from .models import Wallet, Transaction, Commission, EscrowHolding
 from decimal import Decimal
+from typing import NamedTuple, Optional
 import logging
 
 logger = logging.getLogger(__name__)
@@ -10,10 +16,25 @@ class InsufficientFundsError(ValueError):
     """Exception levée quand le solde est insuffisant."""
     pass
 
+class TransferLeg(NamedTuple):
+    """
+    Une jambe d'un transfert multi-portefeuilles.
+    Montant négatif = débit, positif = crédit. `label`, `description` et `order`
+    surchargent ceux du transfert pour cette jambe uniquement.
+    """
+    wallet: Wallet
+    amount: Decimal
+    label: Optional[str] = None
+    description: Optional[str] = None
+    order: Optional[object] = None
+
 class FinanceService:
     """
     Service gérant les opérations financières selon les règles de l'art.
     """
+
+    STATEMENT_PAGE_SIZE = 50
+    STATEMENT_CURSOR_SALT = 'finance.statement'
     
     @staticmethod
     def get_active_commission_rate():
@@ -22,143 +43,403 @@ class FinanceService:
         return commission.rate if commission else Decimal('0.00')
 
     @staticmethod
-    @transaction.atomic
-    def transfer_funds(source_wallet, destination_wallet, amount, label, transaction_type=Transaction.Type.TRANSFER, order=None, description=""):
+    def _post_legs(legs, label, transaction_type, order=None, description=""):
         """
-        Déplace l'argent entre deux portefeuilles avec verrouillage au niveau de la ligne.
+        Applique une liste de jambes (déjà validées) en une seule passe :
+        un SELECT ... FOR UPDATE ordonné, un UPDATE ensembliste des soldes
+        et un INSERT groupé des transactions. Doit être appelé dans un bloc atomique.
         """
-        if amount <= 0:
-            raise ValueError("Le montant doit être supérieur à zéro.")
+        deltas = {}
+        for leg in legs:
+            deltas[leg.wallet.id] = deltas.get(leg.wallet.id, Decimal('0.00')) + leg.amount
 
-        # Verrouiller les deux portefeuilles pour éviter les conditions de course
-        # On utilise select_for_update() sur les IDs pour garantir l'ordre et éviter les deadlocks
-        wallet_ids = sorted([source_wallet.id, destination_wallet.id])
-        wallets = Wallet.objects.select_for_update().filter(id__in=wallet_ids)
-        
-        # Récupérer les instances verrouillées
-        locked_source = (wallets.get(id=source_wallet.id) if source_wallet else None)
-        locked_dest = wallets.get(id=destination_wallet.id)
-
-        if locked_source:
-            if locked_source.balance < amount:
-                raise InsufficientFundsError(f"Solde insuffisant : {locked_source.balance} < {amount}")
-            
-            locked_source.balance = F('balance') - amount
-            locked_source.save()
-            
-            Transaction.objects.create(
-                wallet=locked_source,
-                amount=-amount,
+        # Verrouillage de tous les portefeuilles en une requête, dans l'ordre des IDs (anti-deadlock)
+        wallet_ids = sorted(deltas)
+        locked = {
+            wallet.id: wallet
+            for wallet in Wallet.objects.select_for_update().filter(id__in=wallet_ids).order_by('id')
+        }
+        missing = set(wallet_ids) - set(locked)
+        if missing:
+            raise Wallet.DoesNotExist(f"Portefeuilles introuvables : {sorted(missing)}")
+
+        for wallet_id, delta in deltas.items():
+            if delta < 0 and locked[wallet_id].balance + delta < 0:
+                raise InsufficientFundsError(
+                    f"Solde insuffisant : {locked[wallet_id].balance} < {-delta}"
+                )
+
+        changed = {wallet_id: delta for wallet_id, delta in deltas.items() if delta}
+        if changed:
+            Wallet.objects.filter(id__in=changed).update(
+                balance=F('balance') + Case(
+                    *[When(id=wallet_id, then=Value(delta)) for wallet_id, delta in changed.items()],
+                    default=Value(Decimal('0.00')),
+                    output_field=DecimalField(max_digits=12, decimal_places=2),
+                ),
+                updated_at=timezone.now(),
+            )
+
+        return Transaction.objects.bulk_create([
+            Transaction(
+                wallet=locked[leg.wallet.id],
+                amount=leg.amount,
                 transaction_type=transaction_type,
-                label=label,
-                order=order,
-                description=description,
+                label=leg.label or label,
+                order=leg.order or order,
+                description=leg.description if leg.description is not None else description,
                 status=Transaction.Status.COMPLETED
             )
+            for leg in legs
+        ])
 
-        locked_dest.balance = F('balance') + amount
-        locked_dest.save()
+    @staticmethod
+    @transactional_retry
+    def multi_leg_transfer(legs, label, transaction_type=Transaction.Type.TRANSFER, order=None, description=""):
+        """
+        Transfert atomique entre plusieurs portefeuilles.
+        `legs`: liste de TransferLeg ou de tuples (wallet, amount[, label[, description[, order]]]).
+        La somme des montants doit être nulle : l'argent ne fait que circuler.
+        Retourne la liste des transactions créées (une par jambe).
+        """
+        legs = [leg if isinstance(leg, TransferLeg) else TransferLeg(*leg) for leg in legs]
+        if not legs:
+            raise ValueError("Un transfert doit contenir au moins une jambe.")
+        if any(leg.wallet is None for leg in legs):
+            raise ValueError("Chaque jambe doit désigner un portefeuille.")
+        if any(leg.amount == 0 for leg in legs):
+            raise ValueError("Le montant d'une jambe ne peut pas être nul.")
+        if sum(leg.amount for leg in legs) != 0:
+            raise ValueError("La somme des jambes d'un transfert doit être nulle.")
 
-        Transaction.objects.create(
-            wallet=locked_dest,
-            amount=amount,
-            transaction_type=transaction_type,
-            label=label,
-            order=order,
-            description=description,
-            status=Transaction.Status.COMPLETED
-        )
-        
+        return FinanceService._post_legs(legs, label, transaction_type, order, description)
+
+    @staticmethod
+    @transactional_retry
+    def transfer_funds(source_wallet, destination_wallet, amount, label, transaction_type=Transaction.Type.TRANSFER, order=None, description=""):
+        """
+        Déplace l'argent entre deux portefeuilles avec verrouillage au niveau de la ligne.
+        Sans portefeuille source, le montant est simplement crédité (entrée d'argent externe).
+        """
+        if amount <= 0:
+            raise ValueError("Le montant doit être supérieur à zéro.")
+
+        legs = [TransferLeg(destination_wallet, amount)]
+        if source_wallet is not None:
+            legs.insert(0, TransferLeg(source_wallet, -amount))
+
+        FinanceService._post_legs(legs, label, transaction_type, order, description)
         return True
 
     @staticmethod
-    @transaction.atomic
+    def get_system_wallet(kind, merchant=None):
+        """
+        Portefeuille technique (séquestre ou plateforme), créé à la demande.
+        `merchant` désigne un sous-compte de séquestre propre à un marchand.
+        """
+        merchant_id = getattr(merchant, 'id', merchant)
+        wallet, _ = Wallet.objects.get_or_create(kind=kind, merchant_id=merchant_id, user=None)
+        return wallet
+
+    @staticmethod
+    def get_escrow_wallet(merchant=None):
+        """Séquestre global, ou sous-compte du marchand si FINANCE_ESCROW_PER_MERCHANT est actif."""
+        if not getattr(settings, 'FINANCE_ESCROW_PER_MERCHANT', False):
+            merchant = None
+        return FinanceService.get_system_wallet(Wallet.Kind.ESCROW, merchant)
+
+    @staticmethod
+    def get_escrow_balance(merchant=None):
+        """Montant actuellement en séquestre (lecture d'une seule ligne)."""
+        return FinanceService.get_escrow_wallet(merchant).balance
+
+    @staticmethod
+    @transactional_retry
     def process_order_payment(order):
         """
         Gère le paiement d'une commande par le client.
-        L'argent est débité du client. On pourrait le mettre en 'séquestre' 
-        ou simplement marquer la commande comme payée.
+        Le montant est débité du client et placé en séquestre (une part par marchand)
+        jusqu'à la livraison ou l'annulation.
         """
-        customer_wallet = order.customer.wallet
-        # On verrouille le portefeuille client
-        customer_wallet = Wallet.objects.select_for_update().get(id=customer_wallet.id)
-        
-        if customer_wallet.balance < order.total_price:
-            raise InsufficientFundsError("Solde insuffisant pour payer la commande.")
-            
-        customer_wallet.balance -= order.total_price
-        customer_wallet.save()
-        
-        Transaction.objects.create(
-            wallet=customer_wallet,
-            amount=-order.total_price,
-            transaction_type=Transaction.Type.PAYMENT,
+        if order.total_price <= 0:
+            return True
+
+        shares = [
+            (row['product__merchant'], row['total'])
+            for row in order.items.values('product__merchant').annotate(total=Sum(F('quantity') * F('price')))
+            if row['total']
+        ]
+        # Frais de livraison facturés (un devis figé par boutique) : séquestre global, versés aux livreurs
+        fees = [
+            (merchant_id, fee)
+            for merchant_id, fee in order.delivery_quotes.values_list('merchant', 'fee')
+            if fee
+        ] if order.delivery_fee else []
+        remainder = order.total_price - sum((amount for _, amount in shares + fees), Decimal('0.00'))
+        if remainder < 0:
+            raise ValueError(f"Le total de la commande #{order.id} est inférieur à la somme de ses articles.")
+        if remainder:
+            # Part non attribuable à un marchand (ex. ajustement) : séquestre global
+            shares.append((None, remainder))
+
+        description = f"Paiement de la commande #{order.id}"
+        legs = [TransferLeg(order.customer.wallet, -order.total_price)]
+        holdings = []
+        for merchant_id, amount in shares:
+            escrow_wallet = FinanceService.get_escrow_wallet(merchant_id)
+            legs.append(TransferLeg(escrow_wallet, amount, description=f"Séquestre commande #{order.id}"))
+            holdings.append(EscrowHolding(order=order, merchant_id=merchant_id, escrow_wallet=escrow_wallet, amount=amount))
+        if fees:
+            escrow_wallet = FinanceService.get_escrow_wallet()
+            legs.append(TransferLeg(escrow_wallet, sum(fee for _, fee in fees),
+                                    description=f"Frais de livraison commande #{order.id}"))
+            holdings.extend(
+                EscrowHolding(order=order, merchant_id=merchant_id, escrow_wallet=escrow_wallet, amount=fee,
+                              kind=EscrowHolding.Kind.DELIVERY_FEE)
+                for merchant_id, fee in fees
+            )
+
+        FinanceService.multi_leg_transfer(
+            legs,
             label=Transaction.Label.ORDER_PAYMENT,
+            transaction_type=Transaction.Type.PAYMENT,
             order=order,
-            description=f"Paiement de la commande #{order.id}",
-            status=Transaction.Status.COMPLETED
+            description=description,
         )
-        
-        # Note: L'argent reste "dans le système" jusqu'à la livraison
+        EscrowHolding.objects.bulk_create(holdings)
         return True
 
     @staticmethod
-    @transaction.atomic
+    def _held(queryset, limit=None):
+        """Séquestres en cours, verrouillés (les lignes déjà prises par un autre lot sont ignorées)."""
+        queryset = (
+            queryset.filter(status=EscrowHolding.Status.HELD)
+            .select_for_update(skip_locked=True, of=('self',))
+            .select_related('order__customer__wallet', 'merchant__user__wallet', 'escrow_wallet')
+        )
+        return list(queryset[:limit] if limit else queryset)
+
+    @staticmethod
+    def _payout_holdings(holdings):
+        """
+        Verse les séquestres aux marchands (commission déduite au profit de la plateforme),
+        en un seul transfert multi-jambes, puis les marque versés en une requête.
+        """
+        if not holdings:
+            return 0
+        commission_rate = FinanceService.get_active_commission_rate()
+        platform_wallet = FinanceService.get_system_wallet(Wallet.Kind.PLATFORM)
+
+        legs, released = [], []
+        for holding in holdings:
+            order, merchant = holding.order, holding.merchant
+            if merchant is not None and not hasattr(merchant.user, 'wallet'):
+                logger.error(f"Portefeuille manquant pour le marchand {merchant.store_name}")
+                continue
+
+            legs.append(TransferLeg(holding.escrow_wallet, -holding.amount, order=order,
+                                    description=f"Libération du séquestre commande #{order.id}"))
+            if merchant is None:
+                legs.append(TransferLeg(platform_wallet, holding.amount, Transaction.Label.COMMISSION,
+                                        f"Part plateforme sur commande #{order.id}", order))
+            else:
+                commission_amount = (holding.amount * commission_rate / 100).quantize(Decimal('0.01'))
+                legs.append(TransferLeg(merchant.user.wallet, holding.amount - commission_amount, order=order,
+                                        description=f"Versement pour la commande #{order.id} ({merchant.store_name})"))
+                if commission_amount:
+                    legs.append(TransferLeg(platform_wallet, commission_amount, Transaction.Label.COMMISSION,
+                                            f"Commission plateforme ({commission_rate}%) sur commande #{order.id}", order))
+            released.append(holding.id)
+
+        legs = [leg for leg in legs if leg.amount]
+        if legs:
+            FinanceService.multi_leg_transfer(legs, label=Transaction.Label.MERCHANT_PAYOUT)
+        EscrowHolding.objects.filter(id__in=released).update(
+            status=EscrowHolding.Status.RELEASED, settled_at=timezone.now()
+        )
+        return len(released)
+
+    @staticmethod
+    def _refund_holdings(holdings):
+        """Rembourse les séquestres aux clients, en un seul transfert multi-jambes."""
+        if not holdings:
+            return 0
+        legs = []
+        for holding in holdings:
+            order = holding.order
+            description = f"Remboursement commande #{order.id}"
+            legs.append(TransferLeg(holding.escrow_wallet, -holding.amount, order=order, description=description))
+            legs.append(TransferLeg(order.customer.wallet, holding.amount, order=order, description=description))
+
+        FinanceService.multi_leg_transfer(
+            legs, label=Transaction.Label.ORDER_REFUND, transaction_type=Transaction.Type.REFUND
+        )
+        EscrowHolding.objects.filter(id__in=[h.id for h in holdings]).update(
+            status=EscrowHolding.Status.REFUNDED, settled_at=timezone.now()
+        )
+        return len(holdings)
+
+    @staticmethod
+    def _leg_cancelled():
+        """Vrai si la livraison de la boutique du séquestre a été annulée (sa part revient au client)."""
+        from delivery.models import Delivery
+        return Exists(Delivery.objects.filter(
+            order=OuterRef('order'), merchant=OuterRef('merchant'), status=Delivery.Status.CANCELLED
+        ))
+
+    @staticmethod
+    def _leg_without_driver():
+        """Vrai si la livraison de la boutique du séquestre a été remise sans livreur (clôture manuelle)."""
+        from delivery.models import Delivery
+        return Exists(Delivery.objects.filter(
+            order=OuterRef('order'), merchant=OuterRef('merchant'),
+            status=Delivery.Status.DELIVERED, driver__isnull=True,
+        ))
+
+    @staticmethod
+    def _retain_fees(holdings):
+        """Frais de livraison sans livreur à payer : versés à la plateforme, en un transfert multi-jambes."""
+        if not holdings:
+            return 0
+        platform_wallet = FinanceService.get_system_wallet(Wallet.Kind.PLATFORM)
+        legs = []
+        for holding in holdings:
+            order = holding.order
+            legs.append(TransferLeg(holding.escrow_wallet, -holding.amount, order=order,
+                                    description=f"Libération des frais de livraison commande #{order.id}"))
+            legs.append(TransferLeg(platform_wallet, holding.amount, Transaction.Label.COMMISSION,
+                                    f"Frais de livraison sans livreur, commande #{order.id}", order))
+        FinanceService.multi_leg_transfer(legs, label=Transaction.Label.COMMISSION)
+        EscrowHolding.objects.filter(id__in=[h.id for h in holdings]).update(
+            status=EscrowHolding.Status.RELEASED, settled_at=timezone.now()
+        )
+        return len(holdings)
+
+    @staticmethod
+    @transactional_retry
+    def retain_delivery_fee(order, merchant):
+        """
+        Livraison d'une boutique remise sans livreur (clôture manuelle) : aucun livreur
+        n'est à payer, ses frais de livraison en séquestre reviennent à la plateforme.
+        """
+        holdings = FinanceService._held(EscrowHolding.objects.filter(
+            order_id=getattr(order, 'id', order), merchant_id=getattr(merchant, 'id', merchant),
+            kind=EscrowHolding.Kind.DELIVERY_FEE,
+        ))
+        return FinanceService._retain_fees(holdings)
+
+    @staticmethod
+    @transactional_retry
+    def release_escrow(limit=1000):
+        """
+        Passe de règlement : verse les séquestres des commandes livrées et rembourse
+        ceux des commandes annulées (et des livraisons annulées d'une commande livrée),
+        par lots de `limit` séquestres. Les frais des livraisons remises sans livreur
+        reviennent à la plateforme. La part d'un marchand sans portefeuille reste en
+        séquestre, hors des lots, jusqu'à la création de son portefeuille.
+        Retourne {'released': n, 'refunded': n}.
+        """
+        from orders.models import Order
+        # Les frais de livraison des commandes livrées sont versés par la paie des livreurs
+        holdings = FinanceService._held(
+            EscrowHolding.objects.annotate(
+                leg_cancelled=FinanceService._leg_cancelled(), without_driver=FinanceService._leg_without_driver()
+            ).filter(
+                Q(order__status=Order.Status.CANCELLED)
+                | Q(order__status=Order.Status.DELIVERED, leg_cancelled=True)
+                # Part d'un marchand sans portefeuille : écartée, elle ne bloque pas les lots suivants
+                | Q(order__status=Order.Status.DELIVERED, kind=EscrowHolding.Kind.GOODS)
+                & (Q(merchant__isnull=True) | Q(merchant__user__wallet__isnull=False))
+                | Q(order__status=Order.Status.DELIVERED, kind=EscrowHolding.Kind.DELIVERY_FEE, without_driver=True)
+            ).order_by('id'),
+            limit
+        )
+        refund = {h.id for h in holdings if h.order.status == Order.Status.CANCELLED or h.leg_cancelled}
+        fees = {h.id for h in holdings if h.id not in refund and h.kind == EscrowHolding.Kind.DELIVERY_FEE}
+        return {
+            'released': FinanceService._payout_holdings([h for h in holdings if h.id not in refund | fees])
+            + FinanceService._retain_fees([h for h in holdings if h.id in fees]),
+            'refunded': FinanceService._refund_holdings([h for h in holdings if h.id in refund]),
+        }
+
+    @staticmethod
+    @transactional_retry
     def settle_merchant_payout(order):
         """
         Verse les fonds aux marchands après livraison, déduction faite de la commission.
-        Gère les commandes multi-marchands en ventilant les paiements par article.
+        Gère les commandes multi-marchands : un séquestre par marchand ; la part d'une
+        boutique dont la livraison a été annulée n'est pas versée (elle est remboursée).
+        """
+        goods = EscrowHolding.objects.filter(order=order, kind=EscrowHolding.Kind.GOODS)
+        holdings = FinanceService._held(goods.exclude(FinanceService._leg_cancelled()))
+        if holdings:
+            FinanceService._payout_holdings(holdings)
+        elif not goods.exists():
+            FinanceService._settle_without_escrow(order)
+        return True
+
+    @staticmethod
+    @transactional_retry
+    def refund_merchant_share(order, merchant):
+        """
+        Rembourse au client la part d'une boutique (marchandises et frais de livraison)
+        dont la livraison est annulée ; les autres boutiques de la commande ne sont pas touchées.
+        """
+        holdings = FinanceService._held(EscrowHolding.objects.filter(
+            order_id=getattr(order, 'id', order), merchant_id=getattr(merchant, 'id', merchant)
+        ))
+        return FinanceService._refund_holdings(holdings)
+
+    @staticmethod
+    def _settle_without_escrow(order):
+        """
+        Commandes payées avant la mise en place du séquestre : les parts marchands et la
+        commission sont créditées sans débit correspondant, comme à l'époque du paiement.
         """
         commission_rate = FinanceService.get_active_commission_rate()
-        
+        platform_wallet = FinanceService.get_system_wallet(Wallet.Kind.PLATFORM)
+
         # On regroupe par marchand pour minimiser les transactions
         merchant_shares = {}
-        
         for item in order.items.select_related('product__merchant__user__wallet').all():
             merchant = item.product.merchant
-            if merchant not in merchant_shares:
-                merchant_shares[merchant] = Decimal('0.00')
-            merchant_shares[merchant] += item.price * item.quantity
+            merchant_shares[merchant] = merchant_shares.get(merchant, Decimal('0.00')) + item.price * item.quantity
 
+        legs = []
         for merchant, total_share in merchant_shares.items():
             if not hasattr(merchant.user, 'wallet'):
                 logger.error(f"Portefeuille manquant pour le marchand {merchant.store_name}")
                 continue
-
             commission_amount = (total_share * commission_rate / 100).quantize(Decimal('0.01'))
-            merchant_amount = total_share - commission_amount
-
-            merchant_wallet = Wallet.objects.select_for_update().get(id=merchant.user.wallet.id)
-            
-            # Créditer le marchand
-            merchant_wallet.balance = F('balance') + merchant_amount
-            merchant_wallet.save()
-            
-            Transaction.objects.create(
-                wallet=merchant_wallet,
-                amount=merchant_amount,
-                transaction_type=Transaction.Type.TRANSFER,
-                label=Transaction.Label.MERCHANT_PAYOUT,
-                order=order,
-                description=f"Versement pour la commande #{order.id} ({merchant.store_name})",
-                status=Transaction.Status.COMPLETED
-            )
+            legs.append(TransferLeg(merchant.user.wallet, total_share - commission_amount,
+                                    description=f"Versement pour la commande #{order.id} ({merchant.store_name})"))
+            legs.append(TransferLeg(platform_wallet, commission_amount, Transaction.Label.COMMISSION,
+                                    f"Commission plateforme ({commission_rate}%) sur commande #{order.id}"))
 
-            # Enregistrer la commission plateforme (on pourrait créditer un PlatformWallet ici)
-            Transaction.objects.create(
-                wallet=merchant_wallet, # Trace associée au marchand pour cet exemple
-                amount=commission_amount,
-                transaction_type=Transaction.Type.TRANSFER,
-                label=Transaction.Label.COMMISSION,
-                order=order,
-                description=f"Portion commission plateforme ({commission_rate}%) sur commande #{order.id}",
-                status=Transaction.Status.COMPLETED
-            )
+        legs = [leg for leg in legs if leg.amount]
+        if legs:
+            FinanceService._post_legs(legs, Transaction.Label.MERCHANT_PAYOUT, Transaction.Type.TRANSFER, order)
 
+    @staticmethod
+    @transactional_retry
+    def refund_order(order):
+        """
+        Rembourse le client d'une commande payée à partir du séquestre.
+        """
+        holdings = FinanceService._held(EscrowHolding.objects.filter(order=order))
+        if holdings:
+            FinanceService._refund_holdings(holdings)
+        elif not EscrowHolding.objects.filter(order=order).exists():
+            # Commande payée avant la mise en place du séquestre
+            FinanceService.deposit_funds(
+                order.customer.wallet,
+                order.total_price,
+                description=f"Remboursement commande #{order.id}"
+            )
         return True
 
     @staticmethod
-    @transaction.atomic
+    @transactional_retry
     def deposit_funds(wallet, amount, description="Rechargement"):
         """Crédite le portefeuille."""
         wallet = Wallet.objects.select_for_update().get(id=wallet.id)
@@ -174,3 +455,63 @@ class FinanceService:
             status=Transaction.Status.COMPLETED
         )
         return wallet
+
+    @staticmethod
+    def get_wallet_statement(wallet, cursor=None, date_from=None, date_to=None, page_size=STATEMENT_PAGE_SIZE):
+        """
+        Relevé paginé des transactions COMPLETED d'un portefeuille, du plus récent au plus ancien.
+        Pagination par clé (timestamp, id) : le curseur signé transporte la position et le solde
+        à reporter, si bien que chaque page ne lit que `page_size` lignes via l'index (wallet, timestamp).
+        `date_to` est une borne exclusive.
+        Retourne {'entries': [(transaction, solde après)], 'next_cursor': str|None, 'opening_balance': Decimal}.
+        """
+        transactions = Transaction.objects.filter(wallet=wallet, status=Transaction.Status.COMPLETED)
+        if date_from:
+            transactions = transactions.filter(timestamp__gte=date_from)
+        if date_to:
+            transactions = transactions.filter(timestamp__lt=date_to)
+
+        if cursor:
+            position = signing.loads(cursor, salt=FinanceService.STATEMENT_CURSOR_SALT)
+            timestamp = parse_datetime(position['timestamp'])
+            transactions = transactions.filter(
+                Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=position['id'])
+            )
+            balance = Decimal(position['balance'])
+        else:
+            balance = Wallet.objects.values_list('balance', flat=True).get(id=wallet.id)
+            if date_to:
+                # Solde à la borne haute : on retire ce qui a été passé après
+                later = Transaction.objects.filter(
+                    wallet=wallet, status=Transaction.Status.COMPLETED, timestamp__gte=date_to
+                ).aggregate(total=Sum('amount'))['total']
+                balance -= later or Decimal('0.00')
+
+        # Somme cumulée (du plus récent au plus ancien) calculée par la base
+        rows = list(
+            transactions.annotate(
+                newer_total=Window(
+                    Sum('amount'),
+                    order_by=[F('timestamp').desc(), F('id').desc()],
+                    frame=RowRange(start=None, end=0),
+                )
+            ).select_related('order').order_by('-timestamp', '-id')[:page_size + 1]
+        )
+
+        page = rows[:page_size]
+        entries = [(tx, balance - tx.newer_total + tx.amount) for tx in page]
+
+        next_cursor = None
+        if len(rows) > page_size:
+            last, last_balance = entries[-1]
+            next_cursor = signing.dumps({
+                'timestamp': last.timestamp.isoformat(),
+                'id': last.id,
+                'balance': str(last_balance - last.amount),
+            }, salt=FinanceService.STATEMENT_CURSOR_SALT)
+
+        return {
+            'entries': entries,
+            'next_cursor': next_cursor,
+            'opening_balance': balance,
+        }
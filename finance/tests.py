@@ -1,3 +1,359 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils import timezone
+from catalog.models import Inventory, Product
+from delivery.fees import FeeService
+from delivery.models import Delivery
+from delivery.services import DeliveryService
+from merchants.models import MerchantProfile
+from merchants.services import MerchantService
+from orders.models import Order, OrderItem
+from orders.services import OrderService
+from .models import Wallet, Transaction, Commission, EscrowHolding, DailyFinanceRollup, DailySalesRollup
+from .earnings import EarningsService
+from .services import FinanceService, InsufficientFundsError, TransferLeg
+from .reconciliation import ReconciliationService
+from .rollups import RollupService, TRANSACTIONS, ORDER_ITEMS
 
-# Create your tests here.
+User = get_user_model()
+
+class MultiLegTransferTests(TestCase):
+    def setUp(self):
+        self.customer = User.objects.create_user(username='payer', password='password')
+        self.merchant = User.objects.create_user(username='shop', password='password')
+        self.platform = User.objects.create_user(username='platform', password='password')
+        self.driver = User.objects.create_user(username='rider', password='password')
+        Wallet.objects.filter(user=self.customer).update(balance=Decimal('1000.00'))
+
+    def wallet(self, user):
+        return Wallet.objects.get(user=user)
+
+    def test_split_payout_in_one_transfer(self):
+        """Un débit ventilé en trois crédits : soldes et transactions cohérents."""
+        transactions = FinanceService.multi_leg_transfer(
+            [
+                (self.wallet(self.customer), Decimal('-600.00')),
+                TransferLeg(self.wallet(self.merchant), Decimal('450.00')),
+                TransferLeg(self.wallet(self.platform), Decimal('50.00'), Transaction.Label.COMMISSION),
+                (self.wallet(self.driver), Decimal('100.00')),
+            ],
+            label=Transaction.Label.MERCHANT_PAYOUT,
+            description="Paiement ventilé",
+        )
+
+        self.assertEqual(len(transactions), 4)
+        self.assertEqual(self.wallet(self.customer).balance, Decimal('400.00'))
+        self.assertEqual(self.wallet(self.merchant).balance, Decimal('450.00'))
+        self.assertEqual(self.wallet(self.platform).balance, Decimal('50.00'))
+        self.assertEqual(self.wallet(self.driver).balance, Decimal('100.00'))
+        self.assertEqual(
+            Transaction.objects.filter(label=Transaction.Label.COMMISSION).count(), 1
+        )
+
+    def test_unbalanced_legs_are_rejected(self):
+        with self.assertRaises(ValueError):
+            FinanceService.multi_leg_transfer(
+                [(self.wallet(self.customer), Decimal('-10.00')), (self.wallet(self.merchant), Decimal('5.00'))],
+                label=Transaction.Label.MANUAL_ADJUSTMENT,
+            )
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_insufficient_funds_rolls_back(self):
+        with self.assertRaises(InsufficientFundsError):
+            FinanceService.multi_leg_transfer(
+                [(self.wallet(self.merchant), Decimal('-10.00')), (self.wallet(self.customer), Decimal('10.00'))],
+                label=Transaction.Label.MANUAL_ADJUSTMENT,
+            )
+        self.assertEqual(self.wallet(self.customer).balance, Decimal('1000.00'))
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_transfer_funds_without_source_credits_destination(self):
+        FinanceService.transfer_funds(None, self.wallet(self.merchant), Decimal('25.00'), Transaction.Label.MANUAL_ADJUSTMENT)
+        self.assertEqual(self.wallet(self.merchant).balance, Decimal('25.00'))
+        self.assertEqual(Transaction.objects.count(), 1)
+
+class ReconciliationTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.bob = User.objects.create_user(username='bob', password='password')
+        FinanceService.deposit_funds(Wallet.objects.get(user=self.alice), Decimal('100.00'))
+        FinanceService.deposit_funds(Wallet.objects.get(user=self.bob), Decimal('40.00'))
+
+    def test_consistent_wallets_have_no_drift(self):
+        run = ReconciliationService.run(chunk_size=1)
+        self.assertEqual(run.drift_count, 0)
+        self.assertEqual(run.transactions_checked, 2)
+
+    @override_settings(FINANCE_RECONCILIATION_SETTLE_SECONDS=0)
+    def test_incremental_run_reports_new_drift_range(self):
+        ReconciliationService.run()
+
+        wallet = Wallet.objects.get(user=self.bob)
+        tx = Transaction.objects.create(
+            wallet=wallet, amount=Decimal('5.00'),
+            transaction_type=Transaction.Type.TRANSFER, label=Transaction.Label.COMMISSION
+        )
+        run = ReconciliationService.run()
+
+        self.assertEqual(run.transactions_checked, 1)
+        drift = run.drifts.get()
+        self.assertEqual(drift.wallet, wallet)
+        self.assertEqual(drift.difference, Decimal('-5.00'))
+        self.assertEqual((drift.first_transaction_id, drift.last_transaction_id), (tx.id, tx.id))
+
+    def test_checkpoint_stops_before_unsettled_transactions(self):
+        wallet = Wallet.objects.get(user=self.bob)
+        Transaction.objects.update(timestamp=timezone.now() - timedelta(minutes=5))
+        settled = Transaction.objects.get(wallet=wallet)
+        FinanceService.deposit_funds(wallet, Decimal('5.00'))
+
+        run = ReconciliationService.run()
+        self.assertEqual(run.drift_count, 0)
+        self.assertEqual(run.transactions_checked, 3)
+        checkpoint = wallet.checkpoint
+        self.assertEqual((checkpoint.last_transaction_id, checkpoint.ledger_balance), (settled.id, Decimal('40.00')))
+
+        # Une fois stabilisée, la transaction récente est intégrée au checkpoint
+        Transaction.objects.update(timestamp=timezone.now() - timedelta(minutes=5))
+        run = ReconciliationService.run()
+        self.assertEqual((run.drift_count, run.transactions_checked), (0, 1))
+        checkpoint.refresh_from_db()
+        self.assertEqual(checkpoint.ledger_balance, Decimal('45.00'))
+
+class WalletStatementTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='holder', password='password')
+        self.wallet = Wallet.objects.get(user=self.user)
+        for amount in ('10.00', '20.00', '30.00', '40.00', '50.00'):
+            FinanceService.deposit_funds(self.wallet, Decimal(amount))
+
+    def test_keyset_pages_carry_running_balance(self):
+        first = FinanceService.get_wallet_statement(self.wallet, page_size=2)
+        self.assertEqual(
+            [(tx.amount, balance) for tx, balance in first['entries']],
+            [(Decimal('50.00'), Decimal('150.00')), (Decimal('40.00'), Decimal('100.00'))]
+        )
+
+        second = FinanceService.get_wallet_statement(self.wallet, cursor=first['next_cursor'], page_size=2)
+        third = FinanceService.get_wallet_statement(self.wallet, cursor=second['next_cursor'], page_size=2)
+        self.assertEqual([balance for _, balance in second['entries']], [Decimal('60.00'), Decimal('30.00')])
+        self.assertEqual([balance for _, balance in third['entries']], [Decimal('10.00')])
+        self.assertIsNone(third['next_cursor'])
+
+    def test_statement_api(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/finance/api/statement/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['transactions'][0]['balance_after'], '150.00')
+
+        response = self.client.get('/finance/api/statement/', {'cursor': 'forged'})
+        self.assertEqual(response.status_code, 400)
+
+@override_settings(FINANCE_ROLLUP_SETTLE_SECONDS=0)
+class DailyRollupTests(TestCase):
+    def setUp(self):
+        self.merchant_user = User.objects.create_user(username='seller', password='password', role=User.Role.MERCHANT)
+        self.merchant = MerchantProfile.objects.get(user=self.merchant_user)
+        self.customer = User.objects.create_user(username='buyer', password='password')
+        self.product = Product.objects.create(merchant=self.merchant, name='Mil', price=Decimal('20.00'), sku='MIL-1')
+
+    def order(self, quantity):
+        order = Order.objects.create(customer=self.customer, total_price=quantity * Decimal('20.00'))
+        OrderItem.objects.create(order=order, product=self.product, quantity=quantity, price=Decimal('20.00'))
+        return order
+
+    def test_incremental_rollup_matches_backfill(self):
+        FinanceService.deposit_funds(self.merchant_user.wallet, Decimal('15.00'))
+        self.order(2)
+        RollupService.run_incremental(TRANSACTIONS)
+        RollupService.run_incremental(ORDER_ITEMS)
+
+        FinanceService.deposit_funds(self.merchant_user.wallet, Decimal('5.00'))
+        self.order(1)
+        RollupService.run_incremental(TRANSACTIONS, batch_size=1)
+        RollupService.run_incremental(ORDER_ITEMS, batch_size=1)
+
+        deposits = DailyFinanceRollup.objects.get(merchant=self.merchant, label=Transaction.Label.WALLET_DEPOSIT)
+        self.assertEqual((deposits.total_amount, deposits.transaction_count), (Decimal('20.00'), 2))
+        sales = DailySalesRollup.objects.get(merchant=self.merchant)
+        self.assertEqual((sales.order_count, sales.item_count, sales.sales_total), (2, 3, Decimal('60.00')))
+
+        RollupService.backfill(ORDER_ITEMS, workers=1)
+        rebuilt = DailySalesRollup.objects.get(merchant=self.merchant)
+        self.assertEqual((rebuilt.order_count, rebuilt.sales_total), (2, Decimal('60.00')))
+
+    @override_settings(FINANCE_ESCROW_PER_MERCHANT=True)
+    def test_escrow_sub_ledgers_are_not_merchant_activity(self):
+        FinanceService.deposit_funds(self.customer.wallet, Decimal('100.00'))
+        order = self.order(1)
+        FinanceService.process_order_payment(order)
+        order.status = Order.Status.DELIVERED
+        order.save()
+        FinanceService.release_escrow()
+        RollupService.run_incremental(TRANSACTIONS)
+
+        rows = DailyFinanceRollup.objects.filter(merchant=self.merchant)
+        self.assertEqual(
+            list(rows.values_list('label', 'transaction_type', 'total_amount', 'transaction_count')),
+            [(Transaction.Label.MERCHANT_PAYOUT, Transaction.Type.TRANSFER, Decimal('20.00'), 1)]
+        )
+        # Débit du client et crédit du sous-compte de séquestre : hors marchand
+        payment = DailyFinanceRollup.objects.get(merchant=None, label=Transaction.Label.ORDER_PAYMENT)
+        self.assertEqual((payment.total_amount, payment.transaction_count), (Decimal('0.00'), 2))
+
+    def test_dashboard_stats_combine_rollup_and_tail(self):
+        self.order(2)
+        RollupService.run_incremental(ORDER_ITEMS)
+        self.order(1)
+
+        stats = MerchantService.get_dashboard_stats(self.merchant)
+        self.assertEqual(stats['total_orders'], 2)
+        self.assertEqual(stats['total_sales'], Decimal('60.00'))
+
+class EscrowTests(TestCase):
+    def setUp(self):
+        self.merchant_user = User.objects.create_user(username='vendor', password='password', role=User.Role.MERCHANT)
+        self.merchant = MerchantProfile.objects.get(user=self.merchant_user)
+        self.customer = User.objects.create_user(username='client', password='password')
+        FinanceService.deposit_funds(self.customer.wallet, Decimal('500.00'))
+        Commission.objects.create(rate=Decimal('10.00'))
+        product = Product.objects.create(merchant=self.merchant, name='Fonio', price=Decimal('100.00'), sku='FON-1')
+        self.order = Order.objects.create(customer=self.customer, total_price=Decimal('200.00'))
+        OrderItem.objects.create(order=self.order, product=product, quantity=2, price=Decimal('100.00'))
+
+    def balance(self, wallet):
+        return Wallet.objects.get(id=wallet.id).balance
+
+    def test_payment_is_held_then_released_on_delivery(self):
+        FinanceService.process_order_payment(self.order)
+        self.assertEqual(self.balance(self.customer.wallet), Decimal('300.00'))
+        self.assertEqual(FinanceService.get_escrow_balance(), Decimal('200.00'))
+
+        self.order.status = Order.Status.DELIVERED
+        self.order.save()
+        result = FinanceService.release_escrow()
+
+        self.assertEqual(result, {'released': 1, 'refunded': 0})
+        self.assertEqual(FinanceService.get_escrow_balance(), Decimal('0.00'))
+        self.assertEqual(self.balance(self.merchant_user.wallet), Decimal('180.00'))
+        self.assertEqual(self.balance(FinanceService.get_system_wallet(Wallet.Kind.PLATFORM)), Decimal('20.00'))
+        self.assertEqual(ReconciliationService.run(full=True).drift_count, 0)
+
+    def test_cancellation_refunds_from_escrow(self):
+        FinanceService.process_order_payment(self.order)
+        FinanceService.refund_order(self.order)
+
+        self.assertEqual(self.balance(self.customer.wallet), Decimal('500.00'))
+        self.assertEqual(FinanceService.get_escrow_balance(), Decimal('0.00'))
+        self.assertEqual(EscrowHolding.objects.get().status, EscrowHolding.Status.REFUNDED)
+        # Un second règlement ne verse rien
+        self.assertEqual(FinanceService.release_escrow(), {'released': 0, 'refunded': 0})
+
+    def test_merchant_without_wallet_does_not_block_later_payouts(self):
+        walletless = User.objects.create_user(username='nowallet', password='password', role=User.Role.MERCHANT)
+        Wallet.objects.filter(user=walletless).delete()
+        product = Product.objects.create(merchant=walletless.merchant_profile, name='Mil', price=Decimal('50.00'), sku='MIL-9')
+        stuck = Order.objects.create(customer=self.customer, total_price=Decimal('50.00'))
+        OrderItem.objects.create(order=stuck, product=product, quantity=1, price=Decimal('50.00'))
+        for order in (stuck, self.order):
+            FinanceService.process_order_payment(order)
+            order.status = Order.Status.DELIVERED
+            order.save()
+
+        self.assertEqual(FinanceService.release_escrow(limit=1), {'released': 1, 'refunded': 0})
+        self.assertEqual(self.balance(self.merchant_user.wallet), Decimal('180.00'))
+        self.assertEqual(EscrowHolding.objects.get(order=stuck).status, EscrowHolding.Status.HELD)
+        self.assertEqual(FinanceService.release_escrow(limit=1), {'released': 0, 'refunded': 0})
+
+    @override_settings(FINANCE_ESCROW_PER_MERCHANT=True)
+    def test_per_merchant_sub_ledger(self):
+        FinanceService.process_order_payment(self.order)
+        self.assertEqual(FinanceService.get_escrow_balance(self.merchant), Decimal('200.00'))
+
+class DriverEarningsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        FeeService.clear_cache()
+        merchant_user = User.objects.create_user(username='vendor', password='password', role=User.Role.MERCHANT)
+        MerchantProfile.objects.filter(user=merchant_user).update(latitude=Decimal('48.850000'), longitude=Decimal('2.350000'))
+        self.merchant_wallet = merchant_user.wallet
+        self.customer = User.objects.create_user(username='client', password='password', address='12 Avenue Foch')
+        User.objects.filter(pk=self.customer.pk).update(latitude=Decimal('48.880000'), longitude=Decimal('2.290000'))
+        self.customer.refresh_from_db()
+        FinanceService.deposit_funds(self.customer.wallet, Decimal('5000.00'))
+        self.driver = User.objects.create_user(username='rider', password='password', role=User.Role.DRIVER)
+        product = Product.objects.create(
+            merchant=merchant_user.merchant_profile, name='Fonio', price=Decimal('100.00'), sku='FON-1'
+        )
+        Inventory.objects.update_or_create(product=product, defaults={'quantity': 5})
+        self.order = OrderService.place_order(self.customer, [{'product_id': product.id, 'quantity': 1}])
+
+    def balance(self, wallet):
+        return Wallet.objects.get(id=wallet.id).balance
+
+    def test_fee_is_charged_held_and_paid_to_the_driver(self):
+        fee = self.order.delivery_fee
+        self.assertGreater(fee, 0)
+        self.assertEqual(self.order.total_price, Decimal('100.00') + fee)
+
+        OrderService.fulfill_order(self.order.id)
+        self.assertEqual(self.balance(self.customer.wallet), Decimal('4900.00') - fee)
+        delivery = Delivery.objects.get(order=self.order)
+        Delivery.objects.filter(pk=delivery.pk).update(driver=self.driver, status=Delivery.Status.IN_TRANSIT)
+        DeliveryService.complete_delivery(delivery.id, delivery.delivery_code)
+
+        # Le marchand est payé à la livraison ; les frais attendent la paie des livreurs
+        self.assertEqual(self.balance(self.merchant_wallet), Decimal('100.00'))
+        self.assertEqual(FinanceService.get_escrow_balance(), fee)
+
+        self.assertEqual(EarningsService.run(), 1)
+        self.assertEqual(EarningsService.run(), 0)
+        self.assertEqual(self.balance(self.driver.wallet), fee)
+        self.assertEqual(FinanceService.get_escrow_balance(), Decimal('0.00'))
+        earning = Transaction.objects.get(wallet=self.driver.wallet)
+        self.assertEqual((earning.label, earning.order_id), (Transaction.Label.DRIVER_EARNING, self.order.id))
+        summary = EarningsService.driver_summary(self.driver)
+        self.assertEqual((summary['deliveries'], summary['earnings']), (1, fee))
+        self.assertEqual(ReconciliationService.run(full=True).drift_count, 0)
+
+    def test_driver_without_wallet_does_not_block_later_fees(self):
+        walletless = User.objects.create_user(username='nowallet', password='password', role=User.Role.DRIVER)
+        Wallet.objects.filter(user=walletless).delete()
+        product = self.order.items.get().product
+        orders = [self.order, OrderService.place_order(self.customer, [{'product_id': product.id, 'quantity': 1}])]
+        for order, driver in zip(orders, [walletless, self.driver]):
+            OrderService.fulfill_order(order.id)
+            delivery = Delivery.objects.get(order=order)
+            Delivery.objects.filter(pk=delivery.pk).update(driver=driver, status=Delivery.Status.IN_TRANSIT)
+            DeliveryService.complete_delivery(delivery.id, delivery.delivery_code)
+
+        self.assertEqual(EarningsService.run(batch_size=1), 1)
+        self.assertEqual(self.balance(self.driver.wallet), orders[1].delivery_fee)
+        self.assertTrue(EscrowHolding.objects.filter(
+            order=orders[0], kind=EscrowHolding.Kind.DELIVERY_FEE, status=EscrowHolding.Status.HELD
+        ).exists())
+
+    def test_fee_of_a_leg_closed_without_driver_goes_to_the_platform(self):
+        fee = self.order.delivery_fee
+        OrderService.fulfill_order(self.order.id)
+        delivery = Delivery.objects.get(order=self.order)
+        DeliveryService.force_complete(delivery.id)
+
+        holding = EscrowHolding.objects.get(order=self.order, kind=EscrowHolding.Kind.DELIVERY_FEE)
+        self.assertEqual(holding.status, EscrowHolding.Status.RELEASED)
+        self.assertEqual(self.balance(FinanceService.get_system_wallet(Wallet.Kind.PLATFORM)), fee)
+        self.assertEqual(FinanceService.get_escrow_balance(), Decimal('0.00'))
+        self.assertEqual(EarningsService.run(), 0)
+
+        # Livraison clôturée sans livreur avant la correction : reprise par la passe de règlement
+        product = self.order.items.get().product
+        order = OrderService.place_order(self.customer, [{'product_id': product.id, 'quantity': 1}])
+        OrderService.fulfill_order(order.id)
+        Delivery.objects.filter(order=order).update(status=Delivery.Status.DELIVERED)
+        Order.objects.filter(pk=order.pk).update(status=Order.Status.DELIVERED)
+        self.assertEqual(FinanceService.release_escrow(), {'released': 2, 'refunded': 0})
+        self.assertFalse(EscrowHolding.objects.filter(order=order).exclude(status=EscrowHolding.Status.RELEASED).exists())
+        self.assertEqual(self.balance(FinanceService.get_system_wallet(Wallet.Kind.PLATFORM)), fee + order.delivery_fee)
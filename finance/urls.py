@@ -0,0 +1,10 @@
+from django.urls import path
+from . import views
+
+app_name = 'finance'
+
+urlpatterns = [
+    path('statement/', views.wallet_statement, name='statement'),
+    path('api/statement/', views.wallet_statement_api, name='statement_api'),
+    path('api/earnings/', views.driver_earnings_api, name='earnings_api'),
+]
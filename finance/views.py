@@ -1,3 +1,102 @@
-from django.shortcuts import render
+from datetime import datetime, time, timedelta
+from django.shortcuts import render, get_object_or_404
+from django.contrib.auth.decorators import login_required
+from django.contrib import messages
+from django.core import signing
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from .earnings import EarningsService
+from .models import Wallet
+from .services import FinanceService
 
-# Create your views here.
+def _statement_bounds(params):
+    """
+    Convertit les paramètres GET `from`/`to` (AAAA-MM-JJ, `to` inclus) en bornes datetime.
+    """
+    date_from = parse_date(params['from']) if params.get('from') else None
+    date_to = parse_date(params['to']) if params.get('to') else None
+    start = timezone.make_aware(datetime.combine(date_from, time.min)) if date_from else None
+    end = timezone.make_aware(datetime.combine(date_to + timedelta(days=1), time.min)) if date_to else None
+    return start, end
+
+def _get_statement(request):
+    wallet = get_object_or_404(Wallet, user=request.user)
+    date_from, date_to = _statement_bounds(request.GET)
+    return wallet, FinanceService.get_wallet_statement(
+        wallet,
+        cursor=request.GET.get('cursor'),
+        date_from=date_from,
+        date_to=date_to,
+    )
+
+@login_required
+def wallet_statement(request):
+    """
+    Relevé du portefeuille de l'utilisateur connecté.
+    """
+    try:
+        wallet, statement = _get_statement(request)
+    except (ValueError, TypeError, signing.BadSignature):
+        messages.error(request, "Paramètres de relevé invalides.")
+        wallet = get_object_or_404(Wallet, user=request.user)
+        statement = FinanceService.get_wallet_statement(wallet)
+
+    return render(request, 'finance/statement.html', {
+        'wallet': wallet,
+        'statement': statement,
+        'date_from': request.GET.get('from', ''),
+        'date_to': request.GET.get('to', ''),
+    })
+
+@login_required
+def wallet_statement_api(request):
+    """
+    Relevé du portefeuille au format JSON (pagination par curseur).
+    """
+    try:
+        wallet, statement = _get_statement(request)
+    except (ValueError, TypeError, signing.BadSignature):
+        return JsonResponse({'error': "Paramètres de relevé invalides."}, status=400)
+
+    return JsonResponse({
+        'wallet': wallet.id,
+        'balance': str(wallet.balance),
+        'transactions': [
+            {
+                'reference': str(tx.reference),
+                'timestamp': tx.timestamp.isoformat(),
+                'type': tx.transaction_type,
+                'label': tx.label,
+                'description': tx.description,
+                'order': tx.order_id,
+                'amount': str(tx.amount),
+                'balance_after': str(balance_after),
+            }
+            for tx, balance_after in statement['entries']
+        ],
+        'next_cursor': statement['next_cursor'],
+    })
+
+@login_required
+def driver_earnings_api(request):
+    """
+    Gains versés au livreur connecté (`from`/`to` optionnels, AAAA-MM-JJ inclus).
+    """
+    if request.user.role != request.user.Role.DRIVER:
+        return JsonResponse({'error': "Réservé aux livreurs."}, status=403)
+    try:
+        date_from = parse_date(request.GET['from']) if request.GET.get('from') else None
+        date_to = parse_date(request.GET['to']) if request.GET.get('to') else None
+    except ValueError:
+        return JsonResponse({'error': "Paramètres de dates invalides."}, status=400)
+
+    summary = EarningsService.driver_summary(request.user, date_from, date_to)
+    return JsonResponse({
+        'deliveries': summary['deliveries'],
+        'earnings': str(summary['earnings']),
+        'days': [
+            {'date': day['date'].isoformat(), 'deliveries': day['deliveries'], 'earnings': str(day['earnings'])}
+            for day in summary['days']
+        ],
+    })
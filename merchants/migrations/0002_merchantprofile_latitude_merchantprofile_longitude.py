@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-19 13:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('merchants', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='merchantprofile',
+            name='latitude',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.AddField(
+            model_name='merchantprofile',
+            name='longitude',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True),
+        ),
+    ]
@@ -14,6 +14,9 @@ class MerchantProfile(models.Model):
     logo = models.ImageField(upload_to='merchants/logos/', blank=True, null=True)
     banner_image = models.ImageField(upload_to='merchants/banners/', blank=True, null=True)
     address = models.TextField()
+    # Coordonnées de `address`, renseignées en arrière-plan à chaque changement d'adresse
+    latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     is_verified = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
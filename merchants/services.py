@@ -26,6 +26,8 @@ class MerchantService:
     def update_store_info(profile, store_name, description, address):
         """
         Met à jour les informations de la boutique.
+        Un changement d'adresse efface les coordonnées et déclenche leur recalcul en
+        arrière-plan (signaux de `merchants.signals`).
         """
         profile.store_name = store_name
         profile.description = description
@@ -38,32 +40,23 @@ class MerchantService:
     def get_dashboard_stats(merchant_profile):
         """
         Récupère les statistiques pour le tableau de bord du marchand.
+        Les volumes cumulés proviennent des agrégats journaliers (finance.rollups) ;
+        seules les commandes en attente sont comptées en direct.
         """
         from orders.models import OrderItem, Order
-        from django.db.models import Sum, F
+        from finance.rollups import RollupService
 
-        products = merchant_profile.products.all()
-        
-        # Commandes contenant au moins un produit du marchand
-        order_items = OrderItem.objects.filter(product__merchant=merchant_profile)
-        
-        total_orders = order_items.values('order').distinct().count()
-        
-        # Calcul du revenu total
-        # On suppose que OrderItem a les champs quantity et price
-        revenue_data = order_items.aggregate(
-            total_revenue=Sum(F('quantity') * F('price'))
-        )
-        total_revenue = revenue_data['total_revenue'] or 0
+        sales = RollupService.merchant_sales_summary(merchant_profile)
 
-        pending_orders = order_items.filter(
+        pending_orders = OrderItem.objects.filter(
+            product__merchant=merchant_profile,
             order__status=Order.Status.PENDING
         ).values('order').distinct().count()
 
         return {
-            'total_products': products.count(),
-            'total_orders': total_orders,
-            'total_sales': total_revenue,
+            'total_products': merchant_profile.products.count(),
+            'total_orders': sales['total_orders'],
+            'total_sales': sales['total_sales'],
             'pending_orders': pending_orders,
         }
 
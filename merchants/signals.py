@@ -1,4 +1,4 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_init, post_save, pre_save
 from django.dispatch import receiver
 from .models import MerchantProfile
 
@@ -10,3 +10,36 @@ def notify_merchant_verification(sender, instance, created, **kwargs):
     if not created and instance.is_verified:
         # On pourrait envoyer un email ici via un MailService
         print(f"Le marchand {instance.store_name} a été vérifié.")
+
+@receiver(post_init, sender=MerchantProfile)
+def remember_address(sender, instance, **kwargs):
+    # __dict__ : ne déclenche pas de requête pour un champ différé (.only())
+    instance._loaded_address = instance.__dict__.get('address')
+
+def _address_changed(instance, update_fields=None):
+    """Adresse chargée, enregistrée par ce save() et différente de celle lue en base."""
+    if update_fields is not None and 'address' not in update_fields:
+        return False
+    return 'address' in instance.__dict__ and instance.address != instance._loaded_address
+
+@receiver(pre_save, sender=MerchantProfile)
+def clear_stale_coordinates(sender, instance, update_fields=None, **kwargs):
+    """
+    Adresse modifiée (admin, save() direct) : les anciennes coordonnées de la boutique
+    sont effacées en attendant le géocodage.
+    """
+    if not instance._state.adding and update_fields is None and _address_changed(instance):
+        instance.latitude = None
+        instance.longitude = None
+
+@receiver(post_save, sender=MerchantProfile)
+def geocode_store_address(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Géocode en arrière-plan l'adresse d'une nouvelle boutique, ou d'une adresse modifiée.
+    """
+    if not (created or _address_changed(instance, update_fields)):
+        return
+    if instance.address:
+        from delivery.geocoding import GeocodingService
+        GeocodingService.schedule_refresh(instance)
+    instance._loaded_address = instance.address
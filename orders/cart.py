@@ -107,6 +107,12 @@ class Cart:
         del self.session[settings.CART_SESSION_ID]
         self.save()
     
+    def product_ids(self):
+        """
+        Identifiants des produits du panier.
+        """
+        return [int(product_id) for product_id in self.cart]
+    
     def get_items_data(self):
         """
         Retourne les données du panier au format attendu par OrderService.
@@ -1,3 +1,4 @@
+from decimal import Decimal
 from django.db import models
 from django.conf import settings
 
@@ -20,12 +21,18 @@ class Order(models.Model):
         default=Status.PENDING
     )
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    # Frais de livraison figés à la validation, inclus dans total_price
+    delivery_fee = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Order #{self.id} - {self.customer.username}"
 
+    @property
+    def items_total(self):
+        return self.total_price - self.delivery_fee
+
 class OrderItem(models.Model):
     order = models.ForeignKey(
         Order,
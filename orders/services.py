@@ -1,5 +1,6 @@
 import secrets
-from django.db import transaction
+from decimal import Decimal
+from core.transactions import transactional_retry
 from django.core.exceptions import ValidationError
 from .models import Order, OrderItem
 from catalog.models import Product
@@ -12,11 +13,12 @@ class OrderService:
     """
     
     @staticmethod
-    @transaction.atomic
-    def place_order(customer, items_data):
+    @transactional_retry
+    def place_order(customer, items_data, quote_token=None):
         """
         Crée une nouvelle commande et réserve les stocks.
         items_data: list of dict {'product_id': id, 'quantity': q}
+        quote_token: jeton des frais de livraison affichés (`FeeService.sign`), facturés tels quels
         """
         if not items_data:
             raise ValidationError("Une commande doit contenir au moins un article.")
@@ -66,10 +68,18 @@ class OrderService:
                 price=item['price']
             )
 
+        # 5. Figer les frais de livraison affichés dans le panier et les ajouter au total
+        from delivery.fees import FeeService
+        quotes = FeeService.lock(order, quote_token)
+        order.delivery_fee = sum((quote['fee'] for quote in quotes), Decimal('0.00'))
+        if order.delivery_fee:
+            order.total_price += order.delivery_fee
+            order.save(update_fields=['delivery_fee', 'total_price'])
+
         return order
 
     @staticmethod
-    @transaction.atomic
+    @transactional_retry
     def fulfill_order(order_id):
         """
         Procède au paiement et valide la commande.
@@ -89,40 +99,52 @@ class OrderService:
         return order
 
     @staticmethod
-    @transaction.atomic
-    def cancel_order(order_id, reason=""):
+    @transactional_retry
+    def cancel_order(order_id, reason="", actor=None):
         """
-        Annule une commande et restaure les stocks.
+        Annule une commande et restaure les stocks. Les livraisons encore ouvertes sont
+        annulées une à une (remboursement de la part de chaque boutique) ; une commande
+        dont une livraison a déjà été remise ne peut plus être annulée.
         """
-        order = Order.objects.get(id=order_id)
+        from delivery.models import Delivery
+        from delivery.services import DeliveryService
+        order = Order.objects.select_for_update().get(id=order_id)
         
         if order.status in [Order.Status.DELIVERED, Order.Status.CANCELLED]:
             raise ValidationError(f"La commande #{order.id} ne peut plus être annulée.")
+        if order.deliveries.filter(status=Delivery.Status.DELIVERED).exists():
+            raise ValidationError(
+                f"La commande #{order.id} a déjà été livrée en partie : annulez les livraisons restantes une à une."
+            )
 
         # 1. Restaurer les stocks
         for item in order.items.all():
             InventoryService.adjust_stock(item.product, item.quantity)
 
-        # 2. Rembourser si payé
-        if order.status == Order.Status.PAID:
-            FinanceService.deposit_funds(
-                order.customer.wallet, 
-                order.total_price, 
-                description=f"Remboursement commande #{order.id}"
-            )
-
-        # 3. Changer le statut
-        order.status = Order.Status.CANCELLED
-        order.save()
+        # 2. Annuler les livraisons ouvertes : la dernière clôture et rembourse la commande
+        open_legs = order.deliveries.exclude(status=Delivery.Status.CANCELLED).values_list('id', flat=True)
+        for delivery_id in list(open_legs):
+            DeliveryService.cancel_delivery(delivery_id, reason=reason, actor=actor)
+        order.refresh_from_db()
+
+        # 3. Commande sans livraison : remboursement du séquestre si payée, puis statut
+        if order.status != Order.Status.CANCELLED:
+            if order.status in [Order.Status.PAID, Order.Status.SHIPPED]:
+                FinanceService.refund_order(order)
+            order.status = Order.Status.CANCELLED
+            order.save()
         
         return order
 
     @staticmethod
-    @transaction.atomic
-    def ship_order(order_id, merchant_notes=""):
+    @transactional_retry
+    def ship_order(order_id, merchant_notes="", merchant=None):
         """
         Le marchand prépare la commande et la marque comme prête pour le ramassage.
+        Pour une commande multi-marchands, chaque boutique (`merchant`) signale sa
+        propre livraison ; la commande passe à expédiée quand toutes sont prêtes.
         """
+        from delivery.models import Delivery
         from delivery.services import DeliveryService
         order = Order.objects.get(id=order_id)
         
@@ -130,41 +152,45 @@ class OrderService:
             raise ValidationError(f"La commande #{order.id} doit être payée avant l'expédition.")
         
         # On passe par le service de livraison
-        if hasattr(order, 'delivery'):
-            DeliveryService.mark_as_ready(order.delivery.id, merchant_notes)
+        pending = order.deliveries.filter(status=Delivery.Status.PENDING)
+        if merchant is not None:
+            pending = pending.filter(merchant=merchant)
+        for delivery_id in pending.values_list('id', flat=True):
+            DeliveryService.mark_as_ready(delivery_id, merchant_notes)
         
-        order.status = Order.Status.SHIPPED
-        order.save()
+        if not order.deliveries.filter(status=Delivery.Status.PENDING).exists():
+            order.status = Order.Status.SHIPPED
+            order.save()
         return order
 
     @staticmethod
-    @transaction.atomic
-    def mark_as_delivered(order_id, otp_code=None):
+    @transactional_retry
+    def mark_as_delivered(order_id, otp_code=None, actor=None):
         """
         Finalise la livraison (généralement appelé par le livreur via DeliveryService).
+        Chaque livraison passe par le service de livraison (historique, clôture de la
+        commande et versement aux marchands une seule fois, à la dernière).
         """
+        from delivery.models import Delivery
         from delivery.services import DeliveryService
-        order = Order.objects.select_related('delivery').get(id=order_id)
+        order = Order.objects.get(id=order_id)
+        deliveries = list(order.deliveries.exclude(
+            status__in=[Delivery.Status.DELIVERED, Delivery.Status.CANCELLED]
+        ).values_list('id', flat=True))
         
-        if not hasattr(order, 'delivery'):
+        if not deliveries and not order.deliveries.exists():
              # Fallback pour les commandes sans objet delivery (ne devrait pas arriver)
             order.status = Order.Status.DELIVERED
             order.save()
             return order
 
-        # Si un code est fourni, on passe par la validation sécurisée
-        if otp_code:
-            DeliveryService.complete_delivery(order.delivery.id, otp_code)
-        else:
-            # Mode manuel/simple si pas de code (moins recommandé)
-            order.status = Order.Status.DELIVERED
-            order.save()
-            
-            delivery = order.delivery
-            delivery.status = delivery.Status.DELIVERED
-            delivery.delivered_at = timezone.now()
-            delivery.save()
-            
-        return order
-
+        for delivery_id in deliveries:
+            # Si un code est fourni, on passe par la validation sécurisée
+            if otp_code:
+                DeliveryService.complete_delivery(delivery_id, otp_code)
+            else:
+                # Mode manuel/simple si pas de code (moins recommandé)
+                DeliveryService.force_complete(delivery_id, actor=actor)
 
+        order.refresh_from_db()
+        return order
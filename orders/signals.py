@@ -12,7 +12,7 @@ def trigger_delivery_creation(sender, instance, created, **kwargs):
     from delivery.services import DeliveryService
     
     if not created and instance.status == Order.Status.PAID:
-        # On vérifie si une livraison n'existe pas déjà
-        if not hasattr(instance, 'delivery'):
-            DeliveryService.create_delivery(instance)
+        # On vérifie si les livraisons n'existent pas déjà
+        if not instance.deliveries.exists():
+            DeliveryService.create_deliveries(instance)
             print(f"Logistique de livraison initialisée pour la commande #{instance.id}")
@@ -1,13 +1,17 @@
+from decimal import Decimal
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.utils.decorators import method_decorator
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
+from django.core.exceptions import ValidationError
+from django.db.models import Prefetch
 from .models import Order, OrderItem
 from .services import OrderService
 from .cart import Cart
 from catalog.models import Product
+from delivery.models import Delivery
 
 def merchant_required(view_func):
     def _wrapped_view(request, *args, **kwargs):
@@ -24,7 +28,21 @@ def cart_view(request):
     Affiche le panier d'achat.
     """
     cart = Cart(request)
-    return render(request, 'orders/cart.html', {'cart': cart})
+    context = {'cart': cart}
+    if request.user.is_authenticated and request.user.address and len(cart):
+        from delivery.fees import FeeService
+        try:
+            quotes = FeeService.quote_many(request.user, FeeService.merchants_of(
+                Product.objects.filter(id__in=cart.product_ids()).select_related('merchant')
+            ))
+        except ValidationError as exc:
+            # Adresse non localisable : pas de frais affichés, la commande sera refusée
+            messages.warning(request, exc.messages[0])
+        else:
+            context['delivery_fee'] = sum((quote['fee'] for quote in quotes), Decimal('0'))
+            context['quote_token'] = FeeService.sign(request.user, quotes)
+            context['order_total'] = cart.get_total_price() + context['delivery_fee']
+    return render(request, 'orders/cart.html', context)
 
 @require_POST
 def add_to_cart(request, product_id):
@@ -90,11 +108,17 @@ def checkout(request):
     if len(cart) == 0:
         messages.error(request, "Votre panier est vide.")
         return redirect('orders:cart')
+
+    # Les frais facturés sont ceux affichés dans le panier, jamais recalculés ici
+    quote_token = request.POST.get('quote_token')
+    if not quote_token:
+        messages.error(request, "Confirmez les frais de livraison affichés dans le panier.")
+        return redirect('orders:cart')
     
     try:
         # Créer la commande à partir du panier
         items_data = cart.get_items_data()
-        order = OrderService.place_order(request.user, items_data)
+        order = OrderService.place_order(request.user, items_data, quote_token=quote_token)
         
         # Vider le panier
         cart.clear()
@@ -102,6 +126,10 @@ def checkout(request):
         messages.success(request, f"Commande #{order.id} créée avec succès ! Elle est en attente de paiement.")
         return redirect('orders:detail', order_id=order.id)
         
+    except ValidationError as e:
+        # Frais changés ou expirés : le panier réaffiche les nouveaux frais à confirmer
+        messages.warning(request, e.messages[0])
+        return redirect('orders:cart')
     except Exception as e:
         messages.error(request, f"Erreur lors de la création de la commande : {e}")
         return redirect('orders:cart')
@@ -137,7 +165,7 @@ def ship_order(request, order_id):
     """
     if request.method == 'POST':
         try:
-            OrderService.ship_order(order_id)
+            OrderService.ship_order(order_id, merchant=request.user.merchant_profile)
             messages.success(request, f"Commande #{order_id} marquée comme expédiée.")
         except Exception as e:
             messages.error(request, f"Erreur lors de l'expédition : {e}")
@@ -172,7 +200,7 @@ def deliver_order(request, order_id):
     """
     if request.method == 'POST':
         try:
-            OrderService.mark_as_delivered(order_id)
+            OrderService.mark_as_delivered(order_id, actor=request.user)
             messages.success(request, f"Commande #{order_id} livrée avec succès.")
         except Exception as e:
             messages.error(request, f"Erreur lors de la livraison : {e}")
@@ -186,7 +214,10 @@ def order_detail(request, order_id):
     """
     Affiche le détail d'une commande avec un design premium.
     """
-    order = get_object_or_404(Order, id=order_id, customer=request.user)
+    order = get_object_or_404(
+        Order.objects.prefetch_related(Prefetch('deliveries', queryset=Delivery.objects.select_related('merchant'))),
+        id=order_id, customer=request.user
+    )
     return render(request, 'orders/detail.html', {'order': order})
 
 @login_required
@@ -214,7 +245,7 @@ def order_cancel(request, order_id):
         return redirect('orders:detail', order_id=order_id)
         
     try:
-        order = OrderService.cancel_order(order_id)
+        order = OrderService.cancel_order(order_id, actor=request.user)
         messages.warning(request, f"La commande #{order.id} a été annulée.")
     except Exception as e:
         messages.error(request, f"Impossible d'annuler la commande : {e}")
@@ -15,6 +15,9 @@ class User(AbstractUser):
     )
     phone_number = models.CharField(max_length=20, blank=True)
     address = models.TextField(blank=True)
+    # Coordonnées de `address`, renseignées en arrière-plan à chaque changement d'adresse
+    latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
 
     def __str__(self):
         return f"{self.username} ({self.get_role_display()})"
@@ -33,3 +33,17 @@ class UserService:
         user.phone_number = new_phone_number
         user.save()
         return user
+
+    @staticmethod
+    def update_address(user, new_address):
+        """
+        Met à jour l'adresse ; les coordonnées sont recalculées en arrière-plan
+        (signal `geocode_user_address`).
+        """
+        if user.address == new_address:
+            return user
+        user.address = new_address
+        user.latitude = None
+        user.longitude = None
+        user.save(update_fields=['address', 'latitude', 'longitude'])
+        return user
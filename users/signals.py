@@ -1,4 +1,4 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_init, post_save, pre_save
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 from merchants.models import MerchantProfile
@@ -24,3 +24,36 @@ def create_related_profiles(sender, instance, created, **kwargs):
         from django.contrib.auth.models import Group
         group, _ = Group.objects.get_or_create(name=instance.get_role_display())
         instance.groups.add(group)
+
+@receiver(post_init, sender=User)
+def remember_address(sender, instance, **kwargs):
+    # __dict__ : ne déclenche pas de requête pour un champ différé (.only())
+    instance._loaded_address = instance.__dict__.get('address')
+
+def _address_changed(instance, update_fields=None):
+    """Adresse chargée, enregistrée par ce save() et différente de celle lue en base."""
+    if update_fields is not None and 'address' not in update_fields:
+        return False
+    return 'address' in instance.__dict__ and instance.address != instance._loaded_address
+
+@receiver(pre_save, sender=User)
+def clear_stale_coordinates(sender, instance, update_fields=None, **kwargs):
+    """
+    Adresse modifiée (admin, formulaire, save() direct) : les anciennes coordonnées ne
+    valent plus, elles sont effacées en attendant le géocodage.
+    """
+    if not instance._state.adding and update_fields is None and _address_changed(instance):
+        instance.latitude = None
+        instance.longitude = None
+
+@receiver(post_save, sender=User)
+def geocode_user_address(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Géocode en arrière-plan l'adresse saisie à l'inscription ou modifiée ensuite.
+    """
+    if not (created or _address_changed(instance, update_fields)):
+        return
+    if instance.address:
+        from delivery.geocoding import GeocodingService
+        GeocodingService.schedule_refresh(instance)
+    instance._loaded_address = instance.address
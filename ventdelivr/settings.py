@@ -101,6 +101,25 @@ DATABASES = {
 }
 
 
+# Caches
+# L'état de suivi des livraisons doit être partagé entre les processus web :
+# Redis en production (REDIS_URL, paquet `redis` requis), à défaut une table de cache
+# en base, créée par les migrations de l'application delivery.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'tracking': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL'),
+    } if os.getenv('REDIS_URL') else {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'delivery_tracking_cache',
+    },
+}
+TRACKING_CACHE_ALIAS = 'tracking'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -23,5 +23,7 @@ urlpatterns = [
     path('catalog/', include('catalog.urls')),
     path('orders/', include('orders.urls')),
     path('users/', include('users.urls')),
+    path('finance/', include('finance.urls')),
+    path('delivery/', include('delivery.urls')),
     path('', include('core.urls')),
 ]
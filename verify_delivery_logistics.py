@@ -20,7 +20,8 @@ from django.db.models.signals import post_save
 from users.models import User
 from catalog.models import Product
 from orders.models import Order, OrderItem
-from delivery.models import Delivery
+from delivery.models import Delivery, DriverPosition
+from delivery.locations import buffer as location_buffer
 from delivery.services import DeliveryService
 from delivery.google_maps import GoogleMapsService
 from decimal import Decimal
@@ -117,7 +118,7 @@ def test_delivery_creation_with_fee():
         print(f"✓ Commande créée: #{order.id}")
         
         # Create delivery with fee calculation
-        delivery = DeliveryService.create_delivery(order)
+        delivery = DeliveryService.create_deliveries(order)[0]
         
         print(f"✓ Livraison créée: #{delivery.id}")
         print(f"  - Code: {delivery.delivery_code}")
@@ -192,7 +193,7 @@ def test_driver_allocation():
             price=product.price
         )
         
-        delivery = DeliveryService.create_delivery(order)
+        delivery = DeliveryService.create_deliveries(order)[0]
         print(f"✓ Livraison créée: #{delivery.id}")
         
         # Auto-assign driver
@@ -257,7 +258,7 @@ def test_location_tracking():
             price=product.price
         )
         
-        delivery = DeliveryService.create_delivery(order)
+        delivery = DeliveryService.create_deliveries(order)[0]
         delivery = DeliveryService.assign_driver(delivery.id, driver)
         print(f"✓ Livraison créée et assignée: #{delivery.id}")
         
@@ -266,14 +267,16 @@ def test_location_tracking():
         delivery = DeliveryService.pickup_package(delivery.id, "Colis récupéré")
         print(f"✓ Statut: {delivery.status}")
         
-        # Update location
+        # Update location (tampon d'ingestion, vidé explicitement ici)
         delivery = DeliveryService.update_driver_location(
             delivery.id,
             48.8606,  # New latitude
             2.3376    # New longitude
         )
-        print(f"✓ Position mise à jour: ({delivery.current_latitude}, {delivery.current_longitude})")
-        print(f"  - Dernière mise à jour: {delivery.last_location_update}")
+        location_buffer.flush()
+        position = DriverPosition.objects.get(driver=driver)
+        print(f"✓ Position mise à jour: ({position.latitude}, {position.longitude})")
+        print(f"  - Dernière mise à jour: {position.recorded_at}")
         
         # Cleanup
         transaction.set_rollback(True)
@@ -75,7 +75,7 @@ def verify_flow():
     assert customer_wallet.balance == Decimal('500.00')
 
     # 4. Création et finalisation de livraison
-    delivery = DeliveryService.create_delivery(order)
+    delivery = DeliveryService.create_deliveries(order)[0]
     delivery.status = delivery.Status.IN_TRANSIT # Bypass intermediate steps for test
     delivery.save()
     
@@ -87,8 +87,8 @@ def run_verification():
 
     # 7. Vérification de la livraison générée (Signal)
     print("\n[6] Vérification de la livraison automatique...")
-    if hasattr(order, 'delivery'):
-        delivery = order.delivery
+    delivery = order.deliveries.first()
+    if delivery:
         print(f"[+] Livraison générée avec succès !")
         print(f"    - Code de livraison : {delivery.delivery_code}")
         print(f"    - Statut : {delivery.status}")
@@ -65,8 +65,8 @@ def run_verification():
     print(f"[OK] Commande payée. Statut: {order.status}, Nouveau solde client: {customer.wallet.balance}")
 
     # 7. Vérification de la livraison (Signal)
-    if hasattr(order, 'delivery'):
-        print(f"[OK] Livraison créée automatiquement. Code: {order.delivery.delivery_code}")
+    if order.deliveries.exists():
+        print(f"[OK] Livraison créée automatiquement. Code: {order.deliveries.first().delivery_code}")
     else:
         print("[!] ERREUR: Livraison non créée.")
 